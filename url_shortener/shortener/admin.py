@@ -1,7 +1,14 @@
 from django.contrib import admin
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.admin import UserAdmin
-from .models import ShortenedURL, ClickStatistics, DailyStats, UserProfile
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from .models import ShortenedURL, ClickStatistics, DailyStats, HourlyStats, UserProfile
+from .cache import invalidate_short_codes
+from .feed import schedule_public_feed_refresh
+from .pagination import keyset_page
+from .retention import delete_urls
+from .totals import recount_user_totals
 
 # Отмена регистрации стандартных моделей
 admin.site.unregister(User)
@@ -42,6 +49,48 @@ class DailyStatsInline(admin.TabularInline):
     def has_add_permission(self, request, obj):
         return False
 
+# Список ссылок по курсору (created_at, id) вместо OFFSET и COUNT
+class KeysetChangeList(ChangeList):
+    cursor_params = ('after', 'before')
+    
+    def __init__(self, request, *args, **kwargs):
+        super().__init__(request, *args, **kwargs)
+        # Курсор не переносится в ссылки фильтров и сортировки
+        for param in self.cursor_params:
+            self.params.pop(param, None)
+    
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        for param in self.cursor_params:
+            lookup_params.pop(param, None)
+        return lookup_params
+    
+    def get_results(self, request):
+        self.keyset_page = None
+        # При сортировке по другой колонке - обычные страницы
+        if self.params.get(ORDER_VAR):
+            return super().get_results(request)
+        try:
+            page = keyset_page(self.queryset, request.GET.get('after'), request.GET.get('before'),
+                               self.list_per_page)
+        except ValueError:
+            raise IncorrectLookupParameters
+        
+        self.keyset_page = page
+        self.first_page_url = self.get_query_string(remove=self.cursor_params)
+        self.previous_page_url = page.has_previous and self.get_query_string(
+            {'before': page.previous_cursor}, ['after'])
+        self.next_page_url = page.has_next and self.get_query_string(
+            {'after': page.next_cursor}, ['before'])
+        self.result_count = len(page)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = page.items
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+
 # Админ для ShortenedURL
 @admin.register(ShortenedURL)
 class ShortenedURLAdmin(admin.ModelAdmin):
@@ -65,6 +114,10 @@ class ShortenedURLAdmin(admin.ModelAdmin):
         }),
     )
     inlines = [ClickStatisticsInline, DailyStatsInline]
+    show_full_result_count = False
+    
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
     
     def original_url_truncated(self, obj):
         return obj.original_url[:50] + '...' if len(obj.original_url) > 50 else obj.original_url
@@ -78,13 +131,37 @@ class ShortenedURLAdmin(admin.ModelAdmin):
     
     actions = ['activate_urls', 'deactivate_urls']
     
+    def save_model(self, request, obj, form, change):
+        old_short_code = form.initial.get('short_code') if change else None
+        super().save_model(request, obj, form, change)
+        invalidate_short_codes(old_short_code, obj.short_code)
+    
+    def delete_model(self, request, obj):
+        # Клики удаляются пачками, а не одним каскадом в транзакции
+        delete_urls([obj.pk])
+    
+    def delete_queryset(self, request, queryset):
+        delete_urls(queryset.values_list('id', flat=True))
+    
     def activate_urls(self, request, queryset):
+        short_codes = list(queryset.values_list('short_code', flat=True))
+        user_ids = set(queryset.exclude(user=None).values_list('user_id', flat=True))
         updated = queryset.update(is_active=True)
+        invalidate_short_codes(*short_codes)
+        schedule_public_feed_refresh()
+        # update() обходит сигналы: пересчитываем счетчики владельцев
+        recount_user_totals(user_ids)
         self.message_user(request, f'{updated} ссылок активировано.')
     activate_urls.short_description = "Активировать выбранные ссылки"
     
     def deactivate_urls(self, request, queryset):
+        short_codes = list(queryset.values_list('short_code', flat=True))
+        user_ids = set(queryset.exclude(user=None).values_list('user_id', flat=True))
         updated = queryset.update(is_active=False)
+        invalidate_short_codes(*short_codes)
+        schedule_public_feed_refresh()
+        # update() обходит сигналы: пересчитываем счетчики владельцев
+        recount_user_totals(user_ids)
         self.message_user(request, f'{updated} ссылок деактивировано.')
     deactivate_urls.short_description = "Деактивировать выбранные ссылки"
 
@@ -118,6 +195,17 @@ class DailyStatsAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         return False
 
+# Админ для HourlyStats
+@admin.register(HourlyStats)
+class HourlyStatsAdmin(admin.ModelAdmin):
+    list_display = ('shortened_url', 'hour', 'clicks')
+    search_fields = ('shortened_url__short_code',)
+    readonly_fields = ('shortened_url', 'hour', 'clicks', 'devices', 'browsers', 'countries')
+    date_hierarchy = 'hour'
+    
+    def has_add_permission(self, request):
+        return False
+
 # Регистрируем кастомного UserAdmin
 admin.site.register(User, CustomUserAdmin)
 
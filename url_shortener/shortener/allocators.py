@@ -0,0 +1,196 @@
+"""Выдача коротких кодов без обращения к таблице ссылок.
+
+SequenceAllocator - процесс резервирует блок номеров в ShortCodeSequence
+одним UPDATE и выдает коды из него без запросов к БД. Номер переводится
+в base62 фиксированной длины; при shuffle=True номер предварительно
+перемешивается биекцией (сеть Фейстеля с ключом), так что соседние коды
+не угадываются. Уникальность между процессами обеспечивает сам блок.
+
+PoolAllocator - процесс забирает пачку заранее сгенерированных кодов
+из ShortCodePool (команда fill_code_pool) и выдает их из памяти.
+"""
+import hashlib
+import logging
+import os
+import string
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Subquery
+from django.utils.module_loading import import_string
+
+from .models import ShortCodeSequence, ShortCodePool
+
+logger = logging.getLogger(__name__)
+
+ALPHABET = string.ascii_letters + string.digits
+BASE = len(ALPHABET)
+
+
+def encode_base62(number, length):
+    """Переводит число в base62 строку фиксированной длины"""
+    chars = []
+    for _ in range(length):
+        number, remainder = divmod(number, BASE)
+        chars.append(ALPHABET[remainder])
+    if number:
+        raise ValueError('Число не помещается в код заданной длины')
+    return ''.join(reversed(chars))
+
+
+class FeistelPermutation:
+    """Биекция на [0, size) с ключом: сеть Фейстеля и cycle walking"""
+    ROUNDS = 4
+
+    def __init__(self, size, key):
+        self.size = size
+        bits = max((size - 1).bit_length(), 2)
+        self.half_bits = (bits + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        self.key = hashlib.blake2b(key.encode(), digest_size=32).digest()
+
+    def _round(self, round_number, value):
+        digest = hashlib.blake2b(
+            value.to_bytes(8, 'big'), key=self.key,
+            digest_size=8, person=round_number.to_bytes(16, 'big')
+        ).digest()
+        return int.from_bytes(digest, 'big') & self.half_mask
+
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for round_number in range(self.ROUNDS):
+            left, right = right, left ^ self._round(round_number, right)
+        return (left << self.half_bits) | right
+
+    def __call__(self, value):
+        # Перестановка на 2^bits; выходы за пределы size прогоняем повторно
+        value = self._encrypt(value)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+
+class BaseAllocator:
+    """Базовый аллокатор коротких кодов"""
+
+    def allocate(self):
+        raise NotImplementedError
+
+
+class SequenceAllocator(BaseAllocator):
+    """Коды из зарезервированных блоков последовательности"""
+
+    def __init__(self, length=6, block_size=100, shuffle=True, key=None, sequence='short_code'):
+        self.length = length
+        self.block_size = block_size
+        self.shuffle = shuffle
+        self.key = key or getattr(settings, 'SHORT_CODE_SHUFFLE_KEY', '') or settings.SECRET_KEY
+        self.sequence = sequence
+        self._permutations = {}
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._pid = None
+
+    def reserve_block(self):
+        """Резервирует блок номеров [start, end) одним атомарным UPDATE"""
+        # Если внешняя транзакция откатится, блок может быть выдан повторно;
+        # совпадение кодов тогда ловит ограничение unique в ShortenedURL.save
+        with transaction.atomic():
+            updated = ShortCodeSequence.objects.filter(name=self.sequence).update(
+                next_value=F('next_value') + self.block_size
+            )
+            if not updated:
+                try:
+                    with transaction.atomic():
+                        ShortCodeSequence.objects.create(name=self.sequence, next_value=self.block_size)
+                    return 0, self.block_size
+                except IntegrityError:
+                    # Последовательность создал другой процесс
+                    ShortCodeSequence.objects.filter(name=self.sequence).update(
+                        next_value=F('next_value') + self.block_size
+                    )
+            end = ShortCodeSequence.objects.values_list('next_value', flat=True).get(name=self.sequence)
+        return end - self.block_size, end
+
+    def _next_number(self):
+        with self._lock:
+            # Блок, унаследованный от родителя после fork, использовать нельзя
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._next, self._end = self.reserve_block()
+                self._pid = os.getpid()
+            number = self._next
+            self._next += 1
+            return number
+
+    def encode(self, number):
+        """Переводит номер последовательности в код"""
+        # Каждой длине кода соответствует свой диапазон номеров
+        length = self.length
+        while number >= BASE ** length:
+            number -= BASE ** length
+            length += 1
+        if self.shuffle:
+            permutation = self._permutations.get(length)
+            if permutation is None:
+                permutation = FeistelPermutation(BASE ** length, f'{self.key}:{length}')
+                self._permutations[length] = permutation
+            number = permutation(number)
+        return encode_base62(number, length)
+
+    def allocate(self):
+        return self.encode(self._next_number())
+
+
+class PoolAllocator(BaseAllocator):
+    """Коды из заранее сгенерированного пула ShortCodePool"""
+
+    def __init__(self, batch_size=100, **fallback_options):
+        self.batch_size = batch_size
+        # Если пул опустел, коды выдаются из последовательности
+        self.fallback = SequenceAllocator(**fallback_options)
+        self._lock = threading.Lock()
+        self._codes = []
+        self._pid = None
+
+    def claim_batch(self):
+        """Забирает из пула до batch_size кодов, возвращает их список"""
+        token = uuid.uuid4().hex
+        with transaction.atomic():
+            free = ShortCodePool.objects.filter(claim='').values('pk')[:self.batch_size]
+            # Повторная проверка claim='' не дает двум процессам забрать один код
+            ShortCodePool.objects.filter(pk__in=Subquery(free), claim='').update(claim=token)
+            claimed = ShortCodePool.objects.filter(claim=token)
+            codes = list(claimed.values_list('code', flat=True))
+            claimed.delete()
+        return codes
+
+    def allocate(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._codes = []
+                self._pid = os.getpid()
+            if not self._codes:
+                self._codes = self.claim_batch()
+            if self._codes:
+                return self._codes.pop()
+        logger.warning('Пул коротких кодов пуст, используется резервный аллокатор')
+        return self.fallback.allocate()
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_allocator():
+    """Возвращает аллокатор из настройки SHORT_CODE_ALLOCATOR"""
+    global _allocator
+    if _allocator is None:
+        with _allocator_lock:
+            if _allocator is None:
+                allocator_class = import_string(getattr(
+                    settings, 'SHORT_CODE_ALLOCATOR', 'shortener.allocators.SequenceAllocator'
+                ))
+                _allocator = allocator_class(**getattr(settings, 'SHORT_CODE_ALLOCATOR_OPTIONS', {}))
+    return _allocator
@@ -0,0 +1,154 @@
+"""Агрегация детальной статистики кликов.
+
+Вместо отдельного COUNT на каждый час, день недели и срез по устройствам
+выполняется один запрос GROUP BY (час, день недели, устройство, браузер,
+страна) с суммой весов; гистограммы, распределения и проценты
+собираются из его строк в Python. Число групп ограничено
+(24 x 7 x устройства x браузеры x страны), а не числом кликов.
+
+Для ссылки целиком (url_click_breakdown) уже свернутые часы читаются
+из HourlyStats, а сырые строки - только выше отметки свертки.
+Границы периода для HourlyStats округляются до часа, гистограммы по ним
+собираются векторно (series.local_hour_histograms).
+
+Уникальные посетители за период - слияние дневных HLL-скетчей DailyStats
+(ошибка ~1.6%, см. hll); границы периода округляются до дня по UTC.
+"""
+from collections import Counter
+from datetime import timedelta
+from datetime import timezone as dt_timezone
+
+import numpy as np
+from django.db.models import Sum
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay
+
+from .hll import HyperLogLog
+from .models import ClickStatistics, DailyStats, HourlyStats
+from .rollups import hourly_rollup_watermark
+from .series import local_hour_histograms
+
+DAYS_OF_WEEK = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+TOP_COUNTRIES_LIMIT = 10
+
+
+def _distribution(counter, key, total, limit=None):
+    """Список {key, count, percentage} по убыванию count"""
+    return [
+        {key: value, 'count': count, 'percentage': count * 100.0 / total if total else 0.0}
+        for value, count in counter.most_common(limit)
+    ]
+
+
+class Breakdown:
+    """Накопитель гистограмм и распределений кликов"""
+
+    def __init__(self):
+        self.total = 0
+        self.hours = [0] * 24
+        self.weekdays = [0] * 7
+        self.devices = Counter()
+        self.browsers = Counter()
+        self.countries = Counter()
+
+    def add_grouped_clicks(self, rows):
+        """Строки GROUP BY (hour, weekday, device_type, browser, country) с суммой clicks"""
+        for row in rows:
+            clicks = row['clicks']
+            self.total += clicks
+            self.hours[row['hour']] += clicks
+            self.weekdays[row['weekday'] - 1] += clicks
+            self.devices[row['device_type']] += clicks
+            self.browsers[row['browser']] += clicks
+            if row['country']:
+                self.countries[row['country']] += clicks
+
+    def add_hourly_stats(self, hourly_stats):
+        """Строки HourlyStats; час и день недели - по местному времени"""
+        hours, clicks = [], []
+        for stats in hourly_stats:
+            hours.append(stats.hour.timestamp())
+            clicks.append(stats.clicks)
+            self.devices.update(stats.devices)
+            self.browsers.update(stats.browsers)
+            self.countries.update(stats.countries)
+        clicks = np.array(clicks, dtype=np.int64)
+        hour_counts, weekday_counts = local_hour_histograms(np.array(hours, dtype=np.int64), clicks)
+        self.total += int(clicks.sum())
+        self.hours = (hour_counts + self.hours).tolist()
+        self.weekdays = (weekday_counts + self.weekdays).tolist()
+
+    def as_dict(self):
+        total = self.total
+        return {
+            'total': total,
+            'hourly': [{'hour': hour, 'count': count} for hour, count in enumerate(self.hours)],
+            'weekdays': [{'day': day, 'count': count} for day, count in zip(DAYS_OF_WEEK, self.weekdays)],
+            'devices': _distribution(self.devices, 'device_type', total),
+            'browsers': _distribution(self.browsers, 'browser', total),
+            'countries': _distribution(self.countries, 'country', total, TOP_COUNTRIES_LIMIT),
+        }
+
+
+def grouped_clicks(clicks_qs):
+    """GROUP BY (час, день недели, устройство, браузер, страна) с суммой весов"""
+    return (clicks_qs
+            .annotate(hour=ExtractHour('clicked_at'), weekday=ExtractIsoWeekDay('clicked_at'))
+            .values('hour', 'weekday', 'device_type', 'browser', 'country')
+            .annotate(clicks=Sum('weight'))
+            .order_by())
+
+
+def click_breakdown(clicks_qs):
+    """Гистограммы и распределения кликов для queryset ClickStatistics одним запросом"""
+    breakdown = Breakdown()
+    breakdown.add_grouped_clicks(grouped_clicks(clicks_qs))
+    return breakdown.as_dict()
+
+
+def url_click_breakdown(shortened_url, since=None, until=None):
+    """Статистика ссылки за [since, until): HourlyStats плюс еще не свернутые клики"""
+    watermark = hourly_rollup_watermark()
+
+    hourly_qs = HourlyStats.objects.filter(shortened_url=shortened_url)
+    clicks_qs = ClickStatistics.objects.filter(shortened_url=shortened_url, id__gt=watermark)
+    if since is not None:
+        hourly_qs = hourly_qs.filter(hour__gte=since.replace(minute=0, second=0, microsecond=0))
+        clicks_qs = clicks_qs.filter(clicked_at__gte=since)
+    if until is not None:
+        hourly_qs = hourly_qs.filter(hour__lt=until)
+        clicks_qs = clicks_qs.filter(clicked_at__lt=until)
+
+    breakdown = Breakdown()
+    breakdown.add_hourly_stats(hourly_qs.only('hour', 'clicks', 'devices', 'browsers', 'countries'))
+    breakdown.add_grouped_clicks(grouped_clicks(clicks_qs))
+    return breakdown.as_dict()
+
+
+def unique_visitors_by_period(shortened_url, periods):
+    """Уникальные посетители ссылки по HLL-скетчам DailyStats одним запросом.
+
+    periods - {имя: (первая дата или None, последняя дата или None)}, даты по UTC;
+    возвращает {имя: оценка числа посетителей}.
+    """
+    sketches = {name: HyperLogLog() for name in periods}
+    rows = DailyStats.objects.filter(shortened_url=shortened_url)
+    starts = [start for start, _ in periods.values()]
+    if starts and None not in starts:
+        rows = rows.filter(date__gte=min(starts))
+
+    for date, data in rows.values_list('date', 'visitor_sketch'):
+        daily = None
+        for name, (start, end) in periods.items():
+            if (start is None or date >= start) and (end is None or date <= end):
+                if daily is None:
+                    daily = HyperLogLog.from_bytes(data)
+                sketches[name].merge(daily)
+    return {name: sketch.count() for name, sketch in sketches.items()}
+
+
+def period_dates(since=None, until=None):
+    """Даты DailyStats (UTC), покрывающие интервал [since, until)"""
+    start = since.astimezone(dt_timezone.utc).date() if since is not None else None
+    end = (until - timedelta(microseconds=1)).astimezone(dt_timezone.utc).date() if until is not None else None
+    return start, end
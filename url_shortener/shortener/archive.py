@@ -0,0 +1,391 @@
+"""Колоночный архив старых кликов.
+
+Клики старше CLICK_ARCHIVE_AFTER_DAYS переносятся из ClickStatistics
+в файлы-сегменты в CLICK_ARCHIVE_DIR и удаляются из БД. Архивируются только
+строки, уже учтенные в HourlyStats и DailyStats (ниже отметок свертки),
+поэтому агрегаты от архивации не меняются.
+
+Формат сегмента:
+
+    MAGIC | блок 1 | блок 2 | ... | оглавление (JSON) | длина оглавления (8 байт) | MAGIC
+
+Строки сегмента отсортированы по (ссылка, время клика) и разбиты на блоки
+по ARCHIVE_BLOCK_ROWS строк. Каждая колонка блока сжата zlib отдельно:
+числа - массивом int64/float64, строки - словарем значений и массивом
+номеров в нем. В оглавлении для каждого блока хранятся смещения колонок
+и зональные карты (min/max ссылки, времени и id), по которым scan
+пропускает неподходящие блоки, не распаковывая их. Выгрузке (см. export)
+строки нужны по возрастанию id: scan_blocks отдает строки каждого блока
+в этом порядке для слияния. Файлы читаются через mmap.
+
+archive_clicks читает строки сегмента из БД потоком, уже упорядоченными
+по (ссылка, время клика), и сжимает блок, как только он заполнится.
+"""
+import heapq
+import json
+import mmap
+import os
+import sys
+import threading
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import ClickStatistics
+from .rollups import rolled_up_watermark
+
+MAGIC = b'CLKSEG1\n'
+FORMAT_VERSION = 1
+
+ARCHIVE_BLOCK_ROWS = 16384
+
+ARCHIVE_DELETE_CHUNK_SIZE = 500
+
+# Сколько строк забирать из курсора БД за раз при архивации
+ARCHIVE_FETCH_CHUNK_SIZE = 2000
+
+# Колонка ClickStatistics -> способ кодирования
+COLUMNS = {
+    'id': 'int',
+    'shortened_url_id': 'int',
+    'clicked_at': 'time',
+    'ip_address': 'str',
+    'user_agent': 'str',
+    'referer': 'str',
+    'country': 'str',
+    'city': 'str',
+    'latitude': 'float',
+    'longitude': 'float',
+    'device_type': 'str',
+    'browser': 'str',
+    'operating_system': 'str',
+    'is_bot': 'bool',
+    'session_id': 'str',
+    'weight': 'int',
+}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _to_micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def _array_bytes(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _array_from(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def encode_column(kind, values):
+    """Кодирует значения колонки блока в сжатые байты"""
+    if kind == 'str':
+        dictionary = {}
+        codes = array('I', (dictionary.setdefault(value, len(dictionary)) for value in values))
+        encoded = json.dumps(list(dictionary), ensure_ascii=False).encode()
+        return zlib.compress(len(encoded).to_bytes(4, 'little') + encoded + _array_bytes(codes))
+    if kind == 'float':
+        data = array('d', (float('nan') if value is None else value for value in values))
+    elif kind == 'time':
+        data = array('q', (_to_micros(value) for value in values))
+    else:
+        data = array('q', (int(value) for value in values))
+    return zlib.compress(_array_bytes(data))
+
+
+def decode_column(kind, data):
+    """Восстанавливает список значений колонки блока"""
+    data = zlib.decompress(data)
+    if kind == 'str':
+        length = int.from_bytes(data[:4], 'little')
+        dictionary = json.loads(data[4:4 + length])
+        return [dictionary[code] for code in _array_from('I', data[4 + length:])]
+    if kind == 'float':
+        return [None if value != value else value for value in _array_from('d', data)]
+    values = _array_from('q', data)
+    if kind == 'time':
+        return [_from_micros(value) for value in values]
+    if kind == 'bool':
+        return [bool(value) for value in values]
+    return values.tolist()
+
+
+def _encode_block(segment, chunk):
+    clicked = [row['clicked_at'] for row in chunk]
+    url_ids = [row['shortened_url_id'] for row in chunk]
+    ids = [row['id'] for row in chunk]
+    block = {
+        'rows': len(chunk),
+        'min_url': min(url_ids),
+        'max_url': max(url_ids),
+        'min_time': _to_micros(min(clicked)),
+        'max_time': _to_micros(max(clicked)),
+        'min_id': min(ids),
+        'max_id': max(ids),
+        'columns': {},
+    }
+    for column, kind in COLUMNS.items():
+        data = encode_column(kind, [row[column] for row in chunk])
+        block['columns'][column] = [segment.tell(), len(data)]
+        segment.write(data)
+    return block
+
+
+def write_segment(path, rows):
+    """Записывает строки (словари колонок COLUMNS) в файл сегмента атомарно; возвращает их число.
+
+    rows - итератор строк, упорядоченных по (ссылка, время клика): в памяти
+    держится только текущий блок.
+    """
+    blocks = []
+    chunk = []
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as segment:
+        segment.write(MAGIC)
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == ARCHIVE_BLOCK_ROWS:
+                blocks.append(_encode_block(segment, chunk))
+                chunk = []
+        if chunk:
+            blocks.append(_encode_block(segment, chunk))
+        if not blocks:
+            os.remove(tmp_path)
+            return 0
+        footer = json.dumps({
+            'version': FORMAT_VERSION,
+            'rows': sum(block['rows'] for block in blocks),
+            'min_id': min(block['min_id'] for block in blocks),
+            'max_id': max(block['max_id'] for block in blocks),
+            'blocks': blocks,
+        }).encode()
+        segment.write(footer)
+        segment.write(len(footer).to_bytes(8, 'little'))
+        segment.write(MAGIC)
+        segment.flush()
+        os.fsync(segment.fileno())
+    os.replace(tmp_path, path)
+    return sum(block['rows'] for block in blocks)
+
+
+class ArchiveSegment:
+    """Сегмент архива, открытый через mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as segment:
+            self.mmap = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+        tail = len(self.mmap) - len(MAGIC)
+        if self.mmap[:len(MAGIC)] != MAGIC or self.mmap[tail:] != MAGIC:
+            raise ValueError(f'Поврежденный сегмент архива: {path}')
+        footer_length = int.from_bytes(self.mmap[tail - 8:tail], 'little')
+        footer = json.loads(self.mmap[tail - 8 - footer_length:tail - 8])
+        self.rows = footer['rows']
+        self.min_id = footer['min_id']
+        self.max_id = footer['max_id']
+        self.blocks = footer['blocks']
+
+    def close(self):
+        self.mmap.close()
+
+    def _column(self, block, column):
+        offset, length = block['columns'][column]
+        return decode_column(COLUMNS[column], self.mmap[offset:offset + length])
+
+    def _matches(self, block, shortened_url_ids, since_us, until_us, after):
+        # Зональные карты: блок читается, только если в нем могут быть нужные строки
+        if after is not None and block['max_id'] <= after:
+            return False
+        if shortened_url_ids is not None and not any(
+            block['min_url'] <= url_id <= block['max_url'] for url_id in shortened_url_ids
+        ):
+            return False
+        if since_us is not None and block['max_time'] < since_us:
+            return False
+        if until_us is not None and block['min_time'] >= until_us:
+            return False
+        return True
+
+    def _blocks(self, shortened_url_ids, since, until, after):
+        since_us = _to_micros(since) if since is not None else None
+        until_us = _to_micros(until) if until is not None else None
+        return [block for block in self.blocks
+                if self._matches(block, shortened_url_ids, since_us, until_us, after)]
+
+    def _scan_block(self, block, columns, shortened_url_ids, since, until, after, by_id=False):
+        url_ids = self._column(block, 'shortened_url_id')
+        clicked_at = self._column(block, 'clicked_at')
+        ids = self._column(block, 'id') if after is not None or by_id else None
+        selected = [
+            index for index in range(block['rows'])
+            if (shortened_url_ids is None or url_ids[index] in shortened_url_ids)
+            and (since is None or clicked_at[index] >= since)
+            and (until is None or clicked_at[index] < until)
+            and (after is None or ids[index] > after)
+        ]
+        if not selected:
+            return
+        if by_id:
+            selected.sort(key=ids.__getitem__)
+        decoded = {}
+        for column in columns:
+            if column == 'shortened_url_id':
+                decoded[column] = url_ids
+            elif column == 'clicked_at':
+                decoded[column] = clicked_at
+            elif column == 'id' and ids is not None:
+                decoded[column] = ids
+            else:
+                decoded[column] = self._column(block, column)
+        for index in selected:
+            yield {column: values[index] for column, values in decoded.items()}
+
+    def scan(self, columns, shortened_url_ids=None, since=None, until=None, after=None):
+        """Строки блоков, прошедших зональные карты, с фильтром по ссылкам, [since, until) и id > after"""
+        for block in self._blocks(shortened_url_ids, since, until, after):
+            yield from self._scan_block(block, columns, shortened_url_ids, since, until, after)
+
+    def scan_blocks(self, columns, shortened_url_ids=None, since=None, until=None, after=None):
+        """Как scan, но итератор на каждый блок; строки блока - по возрастанию id"""
+        columns = list(dict.fromkeys(['id', *columns]))
+        return [
+            self._scan_block(block, columns, shortened_url_ids, since, until, after, by_id=True)
+            for block in self._blocks(shortened_url_ids, since, until, after)
+        ]
+
+
+class ClickArchive:
+    """Каталог сегментов архива кликов"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    def segments(self):
+        """Открытые сегменты каталога в порядке ID кликов"""
+        try:
+            names = sorted(name for name in os.listdir(self.directory) if name.endswith('.seg'))
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            opened = []
+            for name in names:
+                path = os.path.join(self.directory, name)
+                mtime = os.stat(path).st_mtime_ns
+                cached = self._segments.get(name)
+                if cached is None or cached[0] != mtime:
+                    if cached is not None:
+                        cached[1].close()
+                    cached = (mtime, ArchiveSegment(path))
+                    self._segments[name] = cached
+                opened.append(cached[1])
+            for name in set(self._segments) - set(names):
+                self._segments.pop(name)[1].close()
+        return opened
+
+    def scan(self, columns=None, shortened_url_id=None, shortened_url_ids=None, since=None, until=None):
+        """Архивные клики: словари с колонками columns (по умолчанию все)"""
+        columns = list(columns or COLUMNS)
+        if shortened_url_id is not None:
+            shortened_url_ids = {shortened_url_id}
+        elif shortened_url_ids is not None:
+            shortened_url_ids = set(shortened_url_ids)
+        for segment in self.segments():
+            yield from segment.scan(columns, shortened_url_ids, since, until)
+
+    def drop_before(self, cutoff):
+        """Удаляет сегменты, все клики которых старше cutoff; возвращает число строк в них"""
+        cutoff_us = _to_micros(cutoff)
+        dropped = 0
+        for segment in self.segments():
+            if all(block['max_time'] < cutoff_us for block in segment.blocks):
+                os.remove(segment.path)
+                dropped += segment.rows
+        return dropped
+
+    def path_for(self, min_id, max_id):
+        return os.path.join(self.directory, f'clicks-{min_id:012d}-{max_id:012d}.seg')
+
+
+click_archive = ClickArchive(
+    getattr(settings, 'CLICK_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive'))
+)
+
+
+def archived_clicks(shortened_url_id, since=None, until=None, limit=None):
+    """Последние архивные клики ссылки как несохраненные объекты ClickStatistics"""
+    rows = click_archive.scan(shortened_url_id=shortened_url_id, since=since, until=until)
+    if limit is None:
+        rows = sorted(rows, key=itemgetter('clicked_at'), reverse=True)
+    else:
+        rows = heapq.nlargest(limit, rows, key=itemgetter('clicked_at'))
+    return [ClickStatistics(**row) for row in rows]
+
+
+def _finish_interrupted_archive():
+    # Если прошлый запуск упал между записью сегмента и удалением строк,
+    # дочищаем их, иначе следующий сегмент продублирует эти клики
+    segments = click_archive.segments()
+    if not segments:
+        return
+    newest = max(segments, key=lambda segment: segment.max_id)
+    if not ClickStatistics.objects.filter(id=newest.max_id).exists():
+        return
+    ids = [row['id'] for row in newest.scan(['id'])]
+    for start in range(0, len(ids), ARCHIVE_DELETE_CHUNK_SIZE):
+        ClickStatistics.objects.filter(id__in=ids[start:start + ARCHIVE_DELETE_CHUNK_SIZE]).delete()
+
+
+def archive_clicks(older_than_days=None, segment_rows=200000):
+    """Переносит старые клики в сегменты архива; возвращает число перенесенных строк"""
+    if older_than_days is None:
+        older_than_days = getattr(settings, 'CLICK_ARCHIVE_AFTER_DAYS', 90)
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    # Только строки, уже свернутые в HourlyStats и DailyStats
+    max_id = rolled_up_watermark()
+
+    os.makedirs(click_archive.directory, exist_ok=True)
+    _finish_interrupted_archive()
+    archived = 0
+    last_id = 0
+    while True:
+        candidates = ClickStatistics.objects.filter(clicked_at__lt=cutoff, id__gt=last_id, id__lte=max_id)
+        ids = candidates.order_by('id').values_list('id', flat=True)
+        first_id = ids.first()
+        if first_id is None:
+            return archived
+        # Сегмент - следующие segment_rows кандидатов по id
+        last_id = next(iter(ids[segment_rows - 1:segment_rows]), None)
+        if last_id is None:
+            last_id = candidates.aggregate(last=Max('id'))['last']
+        rows = (candidates.filter(id__lte=last_id)
+                .order_by('shortened_url_id', 'clicked_at', 'id')
+                .values(*COLUMNS)
+                .iterator(chunk_size=ARCHIVE_FETCH_CHUNK_SIZE))
+        written = write_segment(click_archive.path_for(first_id, last_id), rows)
+        with transaction.atomic():
+            # Строки ниже отметок свертки уже не меняются: удаляем ровно записанные
+            ClickStatistics.objects.filter(
+                clicked_at__lt=cutoff, id__gte=first_id, id__lte=last_id
+            ).delete()
+        archived += written
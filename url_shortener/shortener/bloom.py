@@ -0,0 +1,174 @@
+"""Фильтр Блума по всем выданным коротким кодам.
+
+Отсекает заведомо несуществующие коды (сканеры, опечатки) без запроса к БД.
+Фильтр строится потоково из таблицы ссылок при запуске сервера
+(wsgi.py/asgi.py вызывают warm, см. SHORTCODE_FILTER_WARM_ON_STARTUP)
+или при первом обращении, пополняется сигналом post_save в своем процессе и раз в
+SHORTCODE_FILTER_REFRESH_INTERVAL секунд дочитывает коды, измененные
+другими процессами (по индексу updated_at). Удаление кода из фильтра Блума
+невозможно: удаленные коды дают ложные срабатывания (идут в БД), а при
+накоплении удалений фильтр перестраивается.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ShortenedURL
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Битовый фильтр Блума с двойным хешированием"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class ShortCodeFilter:
+    """Фильтр Блума коротких кодов с ленивым построением и дочитыванием"""
+
+    def __init__(self, refresh_interval=5, error_rate=0.001, min_capacity=100000, chunk_size=5000):
+        self.refresh_interval = refresh_interval
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self.chunk_size = chunk_size
+        self._filter = None
+        self._deleted = 0
+        self._refreshed_at = None
+        self._next_refresh = 0
+        self._lock = threading.Lock()
+
+    def _stream_codes(self, queryset):
+        return queryset.values_list('short_code', flat=True).order_by().iterator(
+            chunk_size=self.chunk_size
+        )
+
+    def rebuild(self):
+        """Полностью перестраивает фильтр потоковым чтением таблицы"""
+        started_at = timezone.now()
+        capacity = max(ShortenedURL.objects.count() * 2, self.min_capacity)
+        bloom = BloomFilter(capacity, self.error_rate)
+        for code in self._stream_codes(ShortenedURL.objects.all()):
+            bloom.add(code)
+        self._filter = bloom
+        self._deleted = 0
+        self._refreshed_at = started_at
+        logger.info('Фильтр коротких кодов построен: %d кодов', bloom.count)
+
+    def refresh(self):
+        """Дочитывает коды, сохраненные с момента прошлого обновления"""
+        started_at = timezone.now()
+        # Запас на транзакции, закоммиченные позже своего updated_at
+        since = self._refreshed_at - timedelta(seconds=self.refresh_interval * 2 + 60)
+        bloom = self._filter
+        for code in self._stream_codes(ShortenedURL.objects.filter(updated_at__gte=since)):
+            bloom.add(code)
+        self._refreshed_at = started_at
+        if bloom.count > bloom.capacity or self._deleted > bloom.capacity // 10:
+            self.rebuild()
+
+    def _maybe_refresh(self):
+        if time.monotonic() < self._next_refresh:
+            return
+        # Строит и обновляет один поток, остальные пользуются текущим фильтром
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() < self._next_refresh:
+                return
+            self._next_refresh = float('inf')
+        finally:
+            self._lock.release()
+        try:
+            if self._filter is None:
+                self.rebuild()
+            else:
+                self.refresh()
+        finally:
+            self._next_refresh = time.monotonic() + self.refresh_interval
+
+    def warm(self):
+        """Строит фильтр заранее, чтобы первые запросы не ждали чтения таблицы"""
+        try:
+            self._maybe_refresh()
+        except Exception:
+            # Без фильтра коды проверяются по БД, а построить его попробуют при обращении
+            logger.exception('Не удалось построить фильтр коротких кодов')
+
+    def might_exist(self, short_code):
+        """False - кода точно нет; True - код, вероятно, выдан"""
+        try:
+            self._maybe_refresh()
+        except Exception:
+            logger.exception('Не удалось обновить фильтр коротких кодов')
+        bloom = self._filter
+        if bloom is None:
+            return True
+        return short_code in bloom
+
+    async def amight_exist(self, short_code):
+        """Асинхронный вариант might_exist"""
+        if time.monotonic() >= self._next_refresh:
+            try:
+                await sync_to_async(self._maybe_refresh)()
+            except Exception:
+                logger.exception('Не удалось обновить фильтр коротких кодов')
+        bloom = self._filter
+        if bloom is None:
+            return True
+        return short_code in bloom
+
+    def add(self, short_code):
+        if self._filter is not None:
+            self._filter.add(short_code)
+
+    def discard(self, short_code):
+        # Из фильтра Блума удалить нельзя, только учитываем для перестройки
+        self._deleted += 1
+
+    def reset(self):
+        """Сбрасывает фильтр; он будет перестроен при следующем обращении"""
+        self._filter = None
+        self._next_refresh = 0
+
+
+short_code_filter = ShortCodeFilter(
+    refresh_interval=getattr(settings, 'SHORTCODE_FILTER_REFRESH_INTERVAL', 5),
+    error_rate=getattr(settings, 'SHORTCODE_FILTER_ERROR_RATE', 0.001),
+    min_capacity=getattr(settings, 'SHORTCODE_FILTER_MIN_CAPACITY', 100000),
+)
+
+
+def is_short_code_taken(short_code):
+    """Проверяет занятость кода; для заведомо свободных кодов без запроса к БД"""
+    if not short_code_filter.might_exist(short_code):
+        return False
+    return ShortenedURL.objects.filter(short_code=short_code).exists()
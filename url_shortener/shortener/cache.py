@@ -0,0 +1,217 @@
+"""Кэш разрешения коротких кодов для перенаправлений.
+
+Двухуровневый кэш: ограниченный LRU в памяти процесса с коротким TTL
+и общий бэкенд кэша Django (Redis/Memcached в продакшене). В кэше хранятся
+только поля, нужные для перенаправления, пароль в кэш не попадает.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .bloom import short_code_filter
+from .models import ShortenedURL
+
+# Коды, которые безопасно использовать в ключах кэша
+SHORT_CODE_RE = re.compile(r'^[A-Za-z0-9_-]{1,20}$')
+
+CACHE_KEY_PREFIX = 'shortcode:'
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш в памяти процесса с ограничением по размеру и TTL"""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResolvedURL(namedtuple('ResolvedURL', [
+    'id', 'short_code', 'original_url', 'is_active',
+    'expires_at', 'is_private', 'has_password',
+])):
+    """Минимальный снимок ссылки, достаточный для перенаправления"""
+    __slots__ = ()
+
+    @classmethod
+    def from_instance(cls, url):
+        return cls(
+            id=url.pk,
+            short_code=url.short_code,
+            original_url=url.original_url,
+            is_active=url.is_active,
+            expires_at=url.expires_at,
+            is_private=url.is_private,
+            has_password=bool(url.password),
+        )
+
+    def is_expired(self):
+        """Проверяет, истекла ли ссылка"""
+        if self.expires_at:
+            return timezone.now() > self.expires_at
+        return False
+
+    @property
+    def is_protected(self):
+        """Требуется ли ввод пароля перед перенаправлением"""
+        return self.is_private and self.has_password
+
+
+_local_cache = LRUCache(
+    maxsize=getattr(settings, 'SHORTCODE_LOCAL_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'SHORTCODE_LOCAL_CACHE_TTL', 10),
+)
+
+
+def _shared_cache():
+    return caches[getattr(settings, 'SHORTCODE_CACHE_ALIAS', 'default')]
+
+
+def _cache_key(short_code):
+    return CACHE_KEY_PREFIX + short_code
+
+
+def _resolve_queryset():
+    return ShortenedURL.objects.values_list(
+        'id', 'original_url', 'is_active', 'expires_at', 'is_private', 'password'
+    )
+
+
+def _from_row(short_code, row):
+    url_id, original_url, is_active, expires_at, is_private, password = row
+    return ResolvedURL(url_id, short_code, original_url, is_active,
+                       expires_at, is_private, bool(password))
+
+
+def _load_from_db(short_code):
+    try:
+        row = _resolve_queryset().get(short_code=short_code)
+    except ShortenedURL.DoesNotExist:
+        return None
+    return _from_row(short_code, row)
+
+
+def _store(resolved):
+    key = _cache_key(resolved.short_code)
+    _local_cache.set(key, resolved)
+    _shared_cache().set(key, tuple(resolved),
+                        getattr(settings, 'SHORTCODE_CACHE_TIMEOUT', 300))
+
+
+def resolve_short_code(short_code):
+    """Возвращает ResolvedURL по короткому коду или None, если ссылки нет"""
+    if not SHORT_CODE_RE.match(short_code):
+        # Такие коды не кэшируем, чтобы не получить небезопасный ключ
+        return _load_from_db(short_code)
+
+    key = _cache_key(short_code)
+    resolved = _local_cache.get(key)
+    if resolved is not None:
+        return resolved
+
+    cached = _shared_cache().get(key)
+    if cached is not None:
+        resolved = ResolvedURL(*cached)
+        _local_cache.set(key, resolved)
+        return resolved
+
+    # Заведомо несуществующий код не доходит до БД
+    if not short_code_filter.might_exist(short_code):
+        return None
+
+    resolved = _load_from_db(short_code)
+    if resolved is not None:
+        _store(resolved)
+    return resolved
+
+
+async def _aload_from_db(short_code):
+    try:
+        row = await _resolve_queryset().aget(short_code=short_code)
+    except ShortenedURL.DoesNotExist:
+        return None
+    return _from_row(short_code, row)
+
+
+async def aresolve_short_code(short_code):
+    """Асинхронный вариант resolve_short_code для async-представлений"""
+    if not SHORT_CODE_RE.match(short_code):
+        return await _aload_from_db(short_code)
+
+    key = _cache_key(short_code)
+    resolved = _local_cache.get(key)
+    if resolved is not None:
+        return resolved
+
+    cached = await _shared_cache().aget(key)
+    if cached is not None:
+        resolved = ResolvedURL(*cached)
+        _local_cache.set(key, resolved)
+        return resolved
+
+    if not await short_code_filter.amight_exist(short_code):
+        return None
+
+    resolved = await _aload_from_db(short_code)
+    if resolved is not None:
+        _local_cache.set(key, resolved)
+        await _shared_cache().aset(key, tuple(resolved),
+                                   getattr(settings, 'SHORTCODE_CACHE_TIMEOUT', 300))
+    return resolved
+
+
+def cache_resolved(url):
+    """Кладет в кэш снимок только что сохраненной ссылки после фиксации транзакции"""
+    if SHORT_CODE_RE.match(url.short_code):
+        # Снимок берем сразу: до фиксации экземпляр может измениться.
+        # При откате транзакции в кэш ничего не попадает
+        resolved = ResolvedURL.from_instance(url)
+        transaction.on_commit(lambda: _store(resolved))
+
+
+def invalidate_short_codes(*short_codes):
+    """Удаляет коды из локального и общего кэша"""
+    keys = [_cache_key(code) for code in short_codes if code and SHORT_CODE_RE.match(code)]
+    if not keys:
+        return
+    for key in keys:
+        _local_cache.delete(key)
+    _shared_cache().delete_many(keys)
@@ -0,0 +1,14 @@
+from functools import partial
+
+from django.utils.functional import SimpleLazyObject
+
+from .profiles import get_profile, get_user_theme
+
+
+def user_profile_processor(request):
+    """Добавляет профиль пользователя и тему в контекст всех шаблонов"""
+    context = {'theme': SimpleLazyObject(partial(get_user_theme, request))}
+    if request.user.is_authenticated:
+        # Профиль читается, только если шаблон к нему обратится
+        context['user_profile'] = SimpleLazyObject(partial(get_profile, request))
+    return context
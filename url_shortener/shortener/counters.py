@@ -0,0 +1,231 @@
+"""Агрегация счетчиков кликов с периодическим сбросом в БД.
+
+Вместо UPDATE на каждый клик накапливаются приращения click_count
+и максимальное last_clicked по каждой ссылке, а затем раз в
+CLICK_COUNTER_FLUSH_INTERVAL миллисекунд сбрасываются атомарными
+UPDATE ... SET click_count = click_count + n (один запрос на ссылку);
+так же пополняется UserProfile.total_clicks владельцев (см. totals).
+
+Бэкенды:
+  memory - накопление в памяти процесса (по умолчанию);
+  cache  - накопление в общем кэше Django (Redis/Memcached), тогда
+           команда flush_click_counters сбрасывает счетчики всех процессов.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import ShortenedURL
+from .totals import add_user_clicks
+
+logger = logging.getLogger(__name__)
+
+
+def apply_click_deltas(deltas):
+    """Применяет приращения {url_id: (n, last_clicked)} к ShortenedURL"""
+    with transaction.atomic():
+        for url_id, (count, last_clicked) in deltas.items():
+            ShortenedURL.objects.filter(pk=url_id).update(
+                click_count=F('click_count') + count,
+                last_clicked=Greatest(Coalesce('last_clicked', Value(last_clicked)), Value(last_clicked)),
+            )
+        # Те же клики - в total_clicks владельцев, одним UPDATE на пользователя
+        add_user_clicks(deltas)
+    return len(deltas)
+
+
+class MemoryClickCounter:
+    """Накопитель приращений в памяти процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def add(self, url_id, count, last_clicked):
+        with self._lock:
+            pending = self._pending.get(url_id)
+            if pending is None:
+                self._pending[url_id] = [count, last_clicked]
+            else:
+                pending[0] += count
+                if last_clicked > pending[1]:
+                    pending[1] = last_clicked
+
+    def take(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return {url_id: tuple(value) for url_id, value in pending.items()}
+
+    def restore(self, deltas):
+        for url_id, (count, last_clicked) in deltas.items():
+            self.add(url_id, count, last_clicked)
+
+
+class CacheClickCounter:
+    """Накопитель приращений в общем кэше Django, общий для всех процессов"""
+    KEY_PREFIX = 'clickctr:'
+    DIRTY_KEY = 'clickctr:dirty'
+    LOCK_KEY = 'clickctr:lock'
+    KEY_TIMEOUT = 86400
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _count_key(self, url_id):
+        return f'{self.KEY_PREFIX}n:{url_id}'
+
+    def _time_key(self, url_id):
+        return f'{self.KEY_PREFIX}ts:{url_id}'
+
+    def _locked(self, func):
+        # Простая блокировка на cache.add: держится миллисекунды
+        for _ in range(100):
+            if self.cache.add(self.LOCK_KEY, os.getpid(), 5):
+                try:
+                    return func()
+                finally:
+                    self.cache.delete(self.LOCK_KEY)
+            time.sleep(0.01)
+        raise RuntimeError('Не удалось захватить блокировку счетчиков кликов')
+
+    def _mark_dirty(self, url_id):
+        def mark():
+            dirty = self.cache.get(self.DIRTY_KEY) or set()
+            dirty.add(url_id)
+            self.cache.set(self.DIRTY_KEY, dirty, None)
+        self._locked(mark)
+
+    def add(self, url_id, count, last_clicked):
+        cache = self.cache
+        key = self._count_key(url_id)
+        cache.set(self._time_key(url_id), last_clicked.timestamp(), self.KEY_TIMEOUT)
+        if cache.add(key, count, self.KEY_TIMEOUT):
+            self._mark_dirty(url_id)
+            return
+        try:
+            value = cache.incr(key, count)
+        except ValueError:
+            # Ключ истек между add и incr
+            cache.set(key, count, self.KEY_TIMEOUT)
+            value = count
+        if value == count:
+            # Счетчик был обнулен последним сбросом
+            self._mark_dirty(url_id)
+
+    def take(self):
+        def swap():
+            dirty = self.cache.get(self.DIRTY_KEY) or set()
+            self.cache.delete(self.DIRTY_KEY)
+            return dirty
+        dirty = self._locked(swap)
+        if not dirty:
+            return {}
+
+        cache = self.cache
+        keys = {url_id: self._count_key(url_id) for url_id in dirty}
+        counts = cache.get_many(keys.values())
+        times = cache.get_many([self._time_key(url_id) for url_id in dirty])
+        deltas = {}
+        for url_id, key in keys.items():
+            count = counts.get(key)
+            if not count:
+                continue
+            # Уменьшаем, а не удаляем: клики, пришедшие во время сброса, не теряются
+            if cache.decr(key, count) > 0:
+                self._mark_dirty(url_id)
+            timestamp = times.get(self._time_key(url_id))
+            last_clicked = (datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+                            if timestamp else datetime.now(tz=dt_timezone.utc))
+            deltas[url_id] = (count, last_clicked)
+        return deltas
+
+    def restore(self, deltas):
+        for url_id, (count, last_clicked) in deltas.items():
+            self.add(url_id, count, last_clicked)
+
+
+class ClickCounterAggregator:
+    """Накопитель приращений с фоновым периодическим сбросом"""
+
+    def __init__(self, backend, flush_interval=0.5):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, url_id, count=1, last_clicked=None):
+        """Добавляет count кликов по ссылке url_id"""
+        if last_clicked is None:
+            last_clicked = datetime.now(tz=dt_timezone.utc)
+        self.backend.add(url_id, count, last_clicked)
+        self._ensure_started()
+
+    def flush(self):
+        """Сбрасывает накопленные приращения в БД, возвращает число ссылок"""
+        with self._flush_lock:
+            deltas = self.backend.take()
+            if not deltas:
+                return 0
+            try:
+                return apply_click_deltas(deltas)
+            except Exception:
+                # Возвращаем приращения, чтобы записать их следующим сбросом
+                self.backend.restore(deltas)
+                raise
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='click-counter-flush', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception('Не удалось сбросить счетчики кликов')
+
+    def stop(self):
+        """Останавливает фоновый сброс и сбрасывает остаток"""
+        self._stopping.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+
+def _make_backend():
+    if getattr(settings, 'CLICK_COUNTER_BACKEND', 'memory') == 'cache':
+        return CacheClickCounter(getattr(settings, 'CLICK_COUNTER_CACHE_ALIAS', 'default'))
+    return MemoryClickCounter()
+
+
+click_counter = ClickCounterAggregator(
+    _make_backend(),
+    flush_interval=getattr(settings, 'CLICK_COUNTER_FLUSH_INTERVAL', 500) / 1000,
+)
+atexit.register(click_counter.stop)
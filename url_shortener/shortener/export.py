@@ -0,0 +1,179 @@
+"""Потоковая выгрузка кликов в CSV и NDJSON.
+
+Строки ClickStatistics читаются страницами по ключу (id > курсора,
+ORDER BY id, LIMIT EXPORT_PAGE_SIZE), каждая страница - через
+.iterator(chunk_size=...), поэтому память не зависит от размера выгрузки,
+а глубокие страницы не замедляются, как при OFFSET. Клики из архива
+(см. archive) читаются из сегментов потоком и сливаются с кликами из БД
+по возрастанию id; строка, которая во время архивации есть и в БД,
+и в сегменте, выгружается один раз.
+
+Курсор выгрузки - id последней выданной строки: прерванную выгрузку
+можно продолжить с параметром after=<последний полученный id>.
+Сжатие gzip выполняется на лету потоковым zlib (wbits=31).
+"""
+import csv
+import heapq
+import json
+import zlib
+from datetime import datetime, time
+from itertools import islice
+from operator import itemgetter
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .archive import click_archive
+from .models import ClickStatistics, ShortenedURL
+
+EXPORT_PAGE_SIZE = 10000
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Строк в одном куске ответа
+EXPORT_ROWS_PER_CHUNK = 500
+
+EXPORT_FIELDS = [
+    'id', 'short_code', 'clicked_at', 'ip_address', 'user_agent', 'referer',
+    'country', 'city', 'latitude', 'longitude', 'device_type', 'browser',
+    'operating_system', 'is_bot', 'session_id', 'weight',
+]
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+# Колонки ClickStatistics, кроме short_code
+_CLICK_COLUMNS = [field for field in EXPORT_FIELDS if field != 'short_code']
+
+
+def _live_clicks(urls, after, since, until, page_size):
+    queryset = ClickStatistics.objects.all()
+    if urls is not None:
+        queryset = queryset.filter(shortened_url__in=urls)
+    if since is not None:
+        queryset = queryset.filter(clicked_at__gte=since)
+    if until is not None:
+        queryset = queryset.filter(clicked_at__lt=until)
+    last_id = after
+    chunk_size = min(page_size, EXPORT_CHUNK_SIZE)
+    while True:
+        page = (queryset.filter(id__gt=last_id).order_by('id')
+                .values_list('shortened_url__short_code', *_CLICK_COLUMNS)[:page_size])
+        count = 0
+        for row in page.iterator(chunk_size=chunk_size):
+            count += 1
+            last_id = row[1]
+            yield row
+        if count < page_size:
+            return
+
+
+def _archived_clicks(urls, after, since, until):
+    url_ids = None if urls is None else set(urls.values_list('id', flat=True))
+    # Сегменты не пересекаются по id; внутри сегмента строки лежат по ссылке
+    # и времени, поэтому блоки (каждый по возрастанию id) сливаются по id
+    codes = {}
+    for segment in sorted(click_archive.segments(), key=lambda segment: segment.min_id):
+        if segment.max_id <= after:
+            continue
+        blocks = segment.scan_blocks(['shortened_url_id', *_CLICK_COLUMNS], url_ids, since, until, after)
+        rows = heapq.merge(*blocks, key=itemgetter('id'))
+        while True:
+            chunk = list(islice(rows, EXPORT_CHUNK_SIZE))
+            if not chunk:
+                break
+            missing = {row['shortened_url_id'] for row in chunk} - codes.keys()
+            if missing:
+                codes.update(dict.fromkeys(missing))
+                codes.update(ShortenedURL.objects.filter(id__in=missing).values_list('id', 'short_code'))
+            for row in chunk:
+                # Клики удаленных ссылок остаются в архиве, но не выгружаются
+                short_code = codes[row['shortened_url_id']]
+                if short_code is not None:
+                    yield (short_code, *(row[column] for column in _CLICK_COLUMNS))
+
+
+def export_clicks(urls=None, after=0, since=None, until=None, include_archive=True, page_size=EXPORT_PAGE_SIZE):
+    """Клики ссылок queryset urls (None - всех) по возрастанию id: словари с полями EXPORT_FIELDS"""
+    streams = [_live_clicks(urls, after, since, until, page_size)]
+    if include_archive:
+        streams.append(_archived_clicks(urls, after, since, until))
+    last_id = None
+    for row in heapq.merge(*streams, key=lambda row: row[1]):
+        # Пока archive_clicks не удалил записанные в сегмент строки, они есть и в БД
+        if row[1] == last_id:
+            continue
+        last_id = row[1]
+        record = dict(zip(_CLICK_COLUMNS, row[1:]))
+        record['short_code'] = row[0]
+        yield record
+
+
+def parse_moment(value):
+    """Дата-время ISO или дата (начало дня в местном времени); ValueError, если не разобрать"""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+class _Line:
+    """Приемник csv.writer: возвращает записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def encode_rows(records, export_format):
+    """Куски текста выгрузки по EXPORT_ROWS_PER_CHUNK строк"""
+    if export_format == 'csv':
+        writer = csv.writer(_Line())
+        lines = [writer.writerow(EXPORT_FIELDS)]
+        for record in records:
+            lines.append(writer.writerow([_plain(record[field]) for field in EXPORT_FIELDS]))
+            if len(lines) >= EXPORT_ROWS_PER_CHUNK:
+                yield ''.join(lines)
+                lines = []
+    else:
+        lines = []
+        for record in records:
+            lines.append(json.dumps({field: _plain(record[field]) for field in EXPORT_FIELDS},
+                                    ensure_ascii=False) + '\n')
+            if len(lines) >= EXPORT_ROWS_PER_CHUNK:
+                yield ''.join(lines)
+                lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def gzip_chunks(chunks):
+    """Сжимает поток кусков в формат gzip на лету"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(urls, export_format='csv', compress=False, **filters):
+    """Байтовые куски выгрузки кликов в формате export_format, при compress - в gzip"""
+    chunks = encode_rows(export_clicks(urls, **filters), export_format)
+    if compress:
+        return gzip_chunks(chunks)
+    return (chunk.encode() for chunk in chunks)
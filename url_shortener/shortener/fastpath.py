@@ -0,0 +1,177 @@
+"""Быстрый путь перенаправлений в обход цепочки MIDDLEWARE.
+
+Обертки над WSGI/ASGI-приложением перехватывают GET/HEAD запросы, которые
+маршрутизируются на представление redirect (/<код>/), и отвечают сами:
+разрешение кода через кэш, постановка клика в очередь и 302. Сессии, CSRF,
+аутентификация, сообщения и разбор User-Agent в middleware для этого
+не нужны. Неактивные, просроченные и защищенные паролем ссылки, а также
+все остальные запросы передаются полному стеку Django.
+
+Заголовки безопасности (nosniff, Referrer-Policy, X-Frame-Options)
+добавляются так же, как их выставили бы SecurityMiddleware
+и XFrameOptionsMiddleware.
+
+Если разрешить код не удалось (например, недоступны кэш или БД), запрос
+тоже передается полному стеку: там ошибку обработают обычным образом.
+Ошибка постановки клика в очередь только записывается в лог - посетитель
+все равно получает перенаправление.
+"""
+import io
+import logging
+
+from django.conf import settings
+from django.core import signals
+from django.core.exceptions import DisallowedHost
+from django.core.handlers.asgi import ASGIRequest
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import HttpResponseRedirect
+from django.urls import Resolver404, resolve
+
+from .cache import aresolve_short_code, resolve_short_code
+from .ingest import submit_click, submit_click_nowait
+from .views import abuild_click_event, build_click_event, short_code_not_found
+
+logger = logging.getLogger(__name__)
+
+FAST_METHODS = ('GET', 'HEAD')
+
+# Имя маршрута, который обслуживает быстрый путь
+REDIRECT_URL_NAME = 'redirect'
+
+
+def security_headers():
+    """Заголовки, которые добавили бы SecurityMiddleware и XFrameOptionsMiddleware"""
+    headers = []
+    if getattr(settings, 'SECURE_CONTENT_TYPE_NOSNIFF', True):
+        headers.append(('X-Content-Type-Options', 'nosniff'))
+    referrer_policy = getattr(settings, 'SECURE_REFERRER_POLICY', 'same-origin')
+    if referrer_policy:
+        if not isinstance(referrer_policy, str):
+            referrer_policy = ','.join(referrer_policy)
+        headers.append(('Referrer-Policy', referrer_policy))
+    headers.append(('X-Frame-Options', getattr(settings, 'X_FRAME_OPTIONS', 'DENY').upper()))
+    return headers
+
+
+def match_short_code(path):
+    """Короткий код, если путь ведет на представление redirect, иначе None"""
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return None
+    if match.url_name != REDIRECT_URL_NAME:
+        return None
+    return match.kwargs.get('short_code')
+
+
+def fast_response(request, resolved):
+    """Ответ быстрого пути или None, если запрос нужно отдать полному стеку"""
+    try:
+        # Проверка ALLOWED_HOSTS, как в CommonMiddleware
+        request.get_host()
+    except DisallowedHost:
+        return None
+    if resolved is None:
+        response = short_code_not_found()
+    elif not resolved.is_active or resolved.is_protected or resolved.is_expired():
+        return None
+    else:
+        response = HttpResponseRedirect(resolved.original_url)
+    for header, value in security_headers():
+        response.headers.setdefault(header, value)
+    return response
+
+
+def submit_redirect_click(request, resolved):
+    """Ставит клик по перенаправлению в очередь; ошибки только пишет в лог"""
+    try:
+        event = build_click_event(request, resolved)
+        if event is not None:
+            submit_click(event)
+    except Exception:
+        logger.exception('Не удалось поставить клик в очередь на быстром пути')
+
+
+async def asubmit_redirect_click(request, resolved):
+    """Асинхронный submit_redirect_click: клик ставится в очередь без ожидания"""
+    try:
+        event = await abuild_click_event(request, resolved)
+        if event is not None:
+            submit_click_nowait(event)
+    except Exception:
+        logger.exception('Не удалось поставить клик в очередь на быстром пути')
+
+
+class FastRedirectWSGI:
+    """WSGI-обертка: перенаправления без middleware, остальное - в application"""
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') not in FAST_METHODS:
+            return self.application(environ, start_response)
+        short_code = match_short_code(environ.get('PATH_INFO', '/'))
+        if short_code is None:
+            return self.application(environ, start_response)
+
+        # Сигналы нужны для обслуживания соединений с БД (CONN_MAX_AGE)
+        signals.request_started.send(sender=self.__class__, environ=environ)
+        try:
+            request = WSGIRequest(environ)
+            resolved = resolve_short_code(short_code)
+            response = fast_response(request, resolved)
+            if response is not None and response.status_code == 302:
+                submit_redirect_click(request, resolved)
+        except Exception:
+            logger.exception('Ошибка быстрого пути, запрос передан полному стеку')
+            response = None
+        finally:
+            signals.request_finished.send(sender=self.__class__)
+        if response is None:
+            return self.application(environ, start_response)
+
+        start_response(
+            f'{response.status_code} {response.reason_phrase}',
+            list(response.items()),
+        )
+        return [] if request.method == 'HEAD' else [response.content]
+
+
+class FastRedirectASGI:
+    """ASGI-обертка: перенаправления без middleware, остальное - в application"""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in FAST_METHODS:
+            return await self.application(scope, receive, send)
+        short_code = match_short_code(scope['path'])
+        if short_code is None:
+            return await self.application(scope, receive, send)
+
+        try:
+            request = ASGIRequest(scope, io.BytesIO())
+            resolved = await aresolve_short_code(short_code)
+            response = fast_response(request, resolved)
+        except Exception:
+            logger.exception('Ошибка быстрого пути, запрос передан полному стеку')
+            response = None
+        if response is None:
+            return await self.application(scope, receive, send)
+        if response.status_code == 302:
+            await asubmit_redirect_click(request, resolved)
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [
+                (header.lower().encode('latin-1'), value.encode('latin-1'))
+                for header, value in response.items()
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'' if request.method == 'HEAD' else response.content,
+        })
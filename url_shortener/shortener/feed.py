@@ -0,0 +1,143 @@
+"""Лента последних публичных ссылок на главной странице.
+
+Лента - готовый список PUBLIC_FEED_SIZE снимков ссылок в общем кэше:
+главная страница читает ее одним обращением к кэшу, без запросов к БД.
+После фиксации транзакции, создающей, изменяющей или удаляющей публичную
+ссылку (или ссылку из ленты), лента пересобирается (см. signals).
+
+PUBLIC_FEED_TIMEOUT - страховочный срок: после него, как и после
+истечения срока одной из ссылок ленты, ленту пересобирает один процесс
+(блокировка cache.add), а остальные до конца пересборки отдают прежнюю
+ленту без истекших ссылок. Счетчики кликов в ленте обновляются только
+при пересборке.
+"""
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ShortenedURL
+
+PUBLIC_FEED_SIZE = 10
+
+FEED_CACHE_KEY = 'public_feed'
+
+FEED_LOCK_KEY = 'public_feed:lock'
+
+# Секунд, на которые берется блокировка пересборки
+FEED_LOCK_TIMEOUT = 10
+
+# Сколько ждать чужую пересборку, если прежней ленты нет
+FEED_WAIT_TIMEOUT = 1.0
+
+FEED_WAIT_STEP = 0.05
+
+
+class PublicLink(namedtuple('PublicLink', [
+    'id', 'short_code', 'title', 'click_count', 'created_at', 'expires_at',
+])):
+    """Снимок публичной ссылки для ленты"""
+    __slots__ = ()
+
+    def get_short_url(self):
+        return f'/{self.short_code}'
+
+    def is_expired(self):
+        return self.expires_at is not None and timezone.now() > self.expires_at
+
+
+def _cache():
+    return caches[getattr(settings, 'PUBLIC_FEED_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'PUBLIC_FEED_TIMEOUT', 60)
+
+
+def public_links_queryset():
+    """Публичные активные неистекшие ссылки, новые первыми"""
+    return ShortenedURL.objects.filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()),
+        is_private=False,
+        is_active=True,
+    ).order_by('-created_at')
+
+
+def _load_links():
+    rows = public_links_queryset().values_list(*PublicLink._fields)[:PUBLIC_FEED_SIZE]
+    return [PublicLink(*row) for row in rows]
+
+
+def refresh_public_feed():
+    """Собирает ленту из БД и кладет в кэш; возвращает список PublicLink"""
+    now = timezone.now()
+    links = _load_links()
+    # Лента устаревает по страховочному сроку или когда истекает одна из ее ссылок
+    stale_at = min([now + timedelta(seconds=_timeout())]
+                   + [link.expires_at for link in links if link.expires_at is not None])
+    # В кэше лента живет дольше срока, чтобы ее можно было отдавать во время пересборки
+    _cache().set(FEED_CACHE_KEY, {'links': [tuple(link) for link in links], 'stale_at': stale_at},
+                 _timeout() * 2)
+    return links
+
+
+def _unexpired(entry):
+    return [link for link in map(PublicLink._make, entry['links']) if not link.is_expired()]
+
+
+def public_feed():
+    """Лента последних публичных ссылок из кэша; пересобирается одним процессом"""
+    cache = _cache()
+    entry = cache.get(FEED_CACHE_KEY)
+    if entry is not None and timezone.now() < entry['stale_at']:
+        return list(map(PublicLink._make, entry['links']))
+
+    if cache.add(FEED_LOCK_KEY, True, FEED_LOCK_TIMEOUT):
+        try:
+            return refresh_public_feed()
+        finally:
+            cache.delete(FEED_LOCK_KEY)
+
+    # Ленту уже пересобирает другой процесс
+    if entry is not None:
+        return _unexpired(entry)
+    deadline = time.monotonic() + FEED_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(FEED_WAIT_STEP)
+        entry = cache.get(FEED_CACHE_KEY)
+        if entry is not None:
+            return _unexpired(entry)
+    return _load_links()
+
+
+def affects_public_feed(url):
+    """Меняет ли сохранение или удаление ссылки ленту"""
+    if not url.is_private:
+        return True
+    entry = _cache().get(FEED_CACHE_KEY)
+    return entry is not None and any(link[0] == url.pk for link in entry['links'])
+
+
+# Номера запланированных пересборок потока (соединение с БД у потока свое)
+_scheduled = threading.local()
+
+
+def _refresh_after_commit(sequence):
+    # Первый колбэк зафиксированной транзакции пересобирает ленту за все
+    # запланированные до него; остальные колбэки той же транзакции пропускаются
+    if getattr(_scheduled, 'refreshed', 0) < sequence:
+        _scheduled.refreshed = _scheduled.sequence
+        refresh_public_feed()
+
+
+def schedule_public_feed_refresh():
+    """Пересобирает ленту после фиксации текущей транзакции, один раз на транзакцию"""
+    _scheduled.sequence = getattr(_scheduled, 'sequence', 0) + 1
+    transaction.on_commit(partial(_refresh_after_commit, _scheduled.sequence))
@@ -4,6 +4,7 @@ from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta
 from .models import ShortenedURL, UserProfile
+from .bloom import is_short_code_taken
 
 class URLShortenForm(forms.ModelForm):
     custom_code = forms.CharField(
@@ -61,8 +62,8 @@ class URLShortenForm(forms.ModelForm):
             if not custom_code.isalnum():
                 raise forms.ValidationError('Код может содержать только буквы и цифры')
             
-            # Проверяем уникальность
-            if ShortenedURL.objects.filter(short_code=custom_code).exists():
+            # Проверяем уникальность (заведомо свободные коды - без запроса к БД)
+            if is_short_code_taken(custom_code):
                 raise forms.ValidationError('Этот код уже занят. Попробуйте другой.')
         return custom_code
     
@@ -82,7 +83,10 @@ class URLShortenForm(forms.ModelForm):
         instance.expires_at = timezone.now() + timedelta(days=expiry_days)
         
         if commit:
-            instance.save()
+            # Только поля формы: click_count параллельно увеличивают клики (см. counters)
+            instance.save(update_fields=[
+                *self._meta.fields, 'short_code', 'expires_at', 'user', 'updated_at',
+            ] if instance.pk else None)
         
         return instance
 
@@ -158,6 +162,13 @@ class UserProfileForm(forms.ModelForm):
             'class': 'form-control'
         }),
     }
+    
+    def save(self, commit=True):
+        instance = super().save(commit=False)
+        if commit:
+            # Только поля формы: счетчики профиля меняются параллельно (см. totals)
+            instance.save(update_fields=[*self._meta.fields, 'updated_at'] if instance.pk else None)
+        return instance
 
 
 class StatsFilterForm(forms.Form):
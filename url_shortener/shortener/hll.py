@@ -0,0 +1,78 @@
+"""HyperLogLog для оценки числа уникальных посетителей.
+
+Скетч из m = 2^p однобайтовых регистров хранится в DailyStats.visitor_sketch
+(сжатый zlib, с байтом точности в начале) и обновляется при записи кликов.
+Скетчи объединяются поэлементным максимумом регистров, поэтому уникальные
+посетители за неделю, месяц или все время считаются слиянием дневных
+скетчей без чтения кликов.
+
+Точность: при p = 12 (4096 регистров, до 4 КБ несжатыми) стандартная
+ошибка оценки 1.04 / sqrt(m) ~ 1.6%, то есть примерно в 95% случаев
+оценка отличается от точного значения не более чем на 3.3%. Слияние
+скетчей ошибку не увеличивает. Для малых значений (до 2.5 * m)
+используется линейный счет, который на них почти точен.
+"""
+import hashlib
+import math
+import zlib
+
+DEFAULT_PRECISION = 12
+
+# 2^-r для всех возможных значений регистра
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+
+
+class HyperLogLog:
+    """Скетч HyperLogLog с 64-битным хешем blake2b"""
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError('Точность HyperLogLog должна быть от 4 до 16')
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = registers if registers is not None else bytearray(self.size)
+
+    def add(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8', 'replace'), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+        index = hashed >> (64 - self.precision)
+        rest_bits = 64 - self.precision
+        rest = hashed & ((1 << rest_bits) - 1)
+        # Позиция первой единицы в оставшихся битах
+        rank = rest_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Объединяет со скетчем той же точности"""
+        if other.precision != self.precision:
+            raise ValueError('Нельзя объединить скетчи HyperLogLog разной точности')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """Оценка числа различных добавленных значений"""
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(map(_INVERSE_POWERS.__getitem__, self.registers))
+        if estimate <= 2.5 * size:
+            zeros = self.registers.count(0)
+            if zeros:
+                estimate = size * math.log(size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data, precision=DEFAULT_PRECISION):
+        """Восстанавливает скетч; пустые данные - пустой скетч точности precision"""
+        data = bytes(data or b'')
+        if not data:
+            return cls(precision)
+        return cls(data[0], bytearray(zlib.decompress(data[1:])))
+
+
+def visitor_key(ip_address, user_agent):
+    """Идентификатор посетителя для скетча: IP и User-Agent"""
+    return f'{ip_address or ""}|{user_agent or ""}'
@@ -0,0 +1,236 @@
+"""Фоновая пакетная запись кликов.
+
+Перенаправление только кладет событие клика в ограниченную очередь процесса.
+Фоновый поток забирает события пачками (по размеру или по времени)
+и записывает их одной транзакцией: bulk_create для ClickStatistics
+(только события с детальной строкой, см. sampling), upsert DailyStats
+и слияние скетчей уникальных посетителей;
+счетчики ссылок передаются в агрегатор counters, значения рефереров,
+стран, городов и ОС - в скетчи топ-значений (topk).
+Если очередь переполнена, событие записывается
+синхронно в потоке запроса (обратное давление, а не потеря данных).
+При завершении процесса очередь дописывается.
+"""
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter, namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .counters import click_counter
+from .models import ClickStatistics, ShortenedURL
+from .hll import visitor_key
+from .rollups import merge_daily_visitors, upsert_daily_stats
+from .topk import click_dimensions, top_k_accumulator
+
+logger = logging.getLogger(__name__)
+
+ClickEvent = namedtuple('ClickEvent', [
+    'shortened_url_id', 'clicked_at', 'ip_address', 'user_agent', 'referer',
+    'device_type', 'browser', 'operating_system', 'is_bot', 'session_id',
+    # Сколько кликов представляет детальная строка; 0 - строку не писать
+    'weight',
+    'country', 'city',
+], defaults=(1, '', ''))
+
+
+def write_click_batch(events):
+    """Записывает пачку событий кликов в БД одной транзакцией"""
+    # Другие процессы принимают клики удаленной ссылки, пока она в их кэше:
+    # такие события отбрасываем, иначе внешний ключ откатит всю пачку
+    existing = set(ShortenedURL.objects.filter(
+        id__in={event.shortened_url_id for event in events},
+    ).values_list('id', flat=True))
+    events = [event for event in events if event.shortened_url_id in existing]
+    if not events:
+        return
+
+    clicks = Counter()
+    last_clicked = {}
+    for event in events:
+        url_id = event.shortened_url_id
+        clicks[url_id] += 1
+        if url_id not in last_clicked or event.clicked_at > last_clicked[url_id]:
+            last_clicked[url_id] = event.clicked_at
+
+    with transaction.atomic():
+        # Клики без детальной строки (выборка, боты) попадают только в агрегаты
+        ClickStatistics.objects.bulk_create([
+            ClickStatistics(
+                shortened_url_id=event.shortened_url_id,
+                clicked_at=event.clicked_at,
+                ip_address=event.ip_address,
+                user_agent=event.user_agent,
+                referer=event.referer,
+                device_type=event.device_type,
+                browser=event.browser,
+                operating_system=event.operating_system,
+                is_bot=event.is_bot,
+                session_id=event.session_id,
+                weight=event.weight,
+                country=event.country,
+                city=event.city,
+            )
+            for event in events if event.weight
+        ])
+
+        # Вся пачка сворачивается в upsert DailyStats с разбивкой по устройствам
+        upsert_daily_stats(
+            (event.shortened_url_id, event.clicked_at.date(), event.device_type)
+            for event in events
+        )
+        # Уникальные посетители - слиянием HLL-скетчей дня, без чтения кликов
+        merge_daily_visitors(
+            (event.shortened_url_id, event.clicked_at.date(), visitor_key(event.ip_address, event.user_agent))
+            for event in events if not event.is_bot
+        )
+
+    # Счетчики ссылок копятся и сбрасываются одним UPDATE на ссылку за интервал
+    for url_id, count in clicks.items():
+        click_counter.add(url_id, count, last_clicked[url_id])
+
+    # Топ рефереров, стран, городов и ОС - в скетчи процесса, в БД раз в интервал.
+    # Как и rebuild_top_k, считаем по весу: клики без строки (вес 0) не учитываются
+    for event in events:
+        if event.weight:
+            top_k_accumulator.add(event.shortened_url_id, click_dimensions(
+                event.referer, event.country, event.city, event.operating_system,
+            ), event.weight)
+    try:
+        top_k_accumulator.maybe_flush()
+    except Exception:
+        logger.exception('Не удалось сохранить скетчи топ-значений')
+
+
+class ClickIngestor:
+    """Ограниченная очередь кликов с фоновым потоком-писателем"""
+
+    def __init__(self, maxsize=10000, batch_size=500, flush_interval=1.0, put_timeout=0.05):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, event):
+        """Ставит событие в очередь; при переполнении пишет его синхронно"""
+        self._ensure_started()
+        try:
+            self.queue.put(event, timeout=self.put_timeout)
+        except queue.Full:
+            logger.warning('Очередь кликов переполнена, синхронная запись')
+            write_click_batch([event])
+
+    def offer(self, event):
+        """Ставит событие в очередь без ожидания; False, если места нет"""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            return False
+        return True
+
+    def _ensure_started(self):
+        # После fork (gunicorn) поток родителя в дочернем процессе не существует
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='click-ingestor', daemon=True
+            )
+            self._thread.start()
+
+    def _drain(self, first=None, deadline=None):
+        batch = [] if first is None else [first]
+        while len(batch) < self.batch_size:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            try:
+                if timeout is None or timeout <= 0:
+                    batch.append(self.queue.get_nowait())
+                else:
+                    batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            write_click_batch(batch)
+        except Exception:
+            logger.exception('Не удалось записать пачку из %d кликов', len(batch))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                close_old_connections()
+                continue
+            batch = self._drain(first, deadline=time.monotonic() + self.flush_interval)
+            close_old_connections()
+            self._write(batch)
+
+    def flush(self):
+        """Синхронно записывает все накопленные в очереди события"""
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._write(batch)
+
+    def stop(self):
+        """Останавливает поток-писатель и дописывает очередь"""
+        self._stopping.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+        top_k_accumulator.flush()
+
+
+ingestor = ClickIngestor(
+    maxsize=getattr(settings, 'CLICK_INGEST_QUEUE_SIZE', 10000),
+    batch_size=getattr(settings, 'CLICK_INGEST_BATCH_SIZE', 500),
+    flush_interval=getattr(settings, 'CLICK_INGEST_FLUSH_INTERVAL', 1.0),
+    put_timeout=getattr(settings, 'CLICK_INGEST_PUT_TIMEOUT', 0.05),
+)
+atexit.register(ingestor.stop)
+
+
+def submit_click(event):
+    """Отправляет клик на запись: в фоновую очередь или сразу в БД"""
+    if getattr(settings, 'CLICK_INGEST_ASYNC', True):
+        ingestor.submit(event)
+    else:
+        _write_click_now(event)
+
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора до завершения
+_background_tasks = set()
+
+
+def _write_click_now(event):
+    write_click_batch([event])
+    click_counter.flush()
+
+
+def submit_click_nowait(event):
+    """Отправляет клик на запись из async-кода, не дожидаясь БД"""
+    if getattr(settings, 'CLICK_INGEST_ASYNC', True) and ingestor.offer(event):
+        return
+    task = asyncio.get_running_loop().create_task(sync_to_async(_write_click_now)(event))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
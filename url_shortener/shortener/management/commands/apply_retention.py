@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shortener.retention import apply_archive_retention, apply_click_retention, apply_hourly_stats_retention
+
+
+class Command(BaseCommand):
+    help = ('Удаляет клики старше сроков хранения (общего и пользовательских), оставляя агрегаты, '
+            'прореживает старую почасовую статистику и сегменты архива (запускать по расписанию)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=getattr(settings, 'CLICK_RETENTION_BATCH_SIZE', 5000),
+                            help='Сколько ID кликов удалять одним запросом')
+        parser.add_argument('--rate', type=int,
+                            default=getattr(settings, 'CLICK_RETENTION_ROWS_PER_SECOND', 20000),
+                            help='Не больше стольких удаленных строк в секунду (0 - без ограничения)')
+
+    def handle(self, *args, **options):
+        deleted = apply_click_retention(options['batch_size'], options['rate'])
+        for days, count in sorted(deleted.items()):
+            self.stdout.write(f'Срок {days} дн.: удалено кликов {count}')
+        hourly = apply_hourly_stats_retention(options['batch_size'])
+        archived = apply_archive_retention()
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено кликов: {sum(deleted.values())}, почасовой статистики: {hourly}, '
+            f'кликов в сегментах архива: {archived}'
+        ))
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shortener.archive import archive_clicks, click_archive
+
+
+class Command(BaseCommand):
+    help = 'Переносит старые клики из ClickStatistics в колоночный архив на диске'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=getattr(settings, 'CLICK_ARCHIVE_AFTER_DAYS', 90),
+                            help='Архивировать клики старше стольких дней')
+        parser.add_argument('--segment-rows', type=int, default=200000,
+                            help='Максимум строк в одном файле-сегменте')
+
+    def handle(self, *args, **options):
+        archived = archive_clicks(options['days'], options['segment_rows'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено в архив кликов: {archived} (каталог {click_archive.directory})'
+        ))
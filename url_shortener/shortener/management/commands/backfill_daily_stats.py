@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from shortener.rollups import backfill_daily_stats
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает страны и скетчи уникальных посетителей DailyStats всех ссылок '
+            'за диапазон дат (UTC) по сырым кликам')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start_date', required=True, help='Первая дата, ГГГГ-ММ-ДД')
+        parser.add_argument('--to', dest='end_date', required=True, help='Последняя дата, ГГГГ-ММ-ДД')
+        parser.add_argument('--recount', action='store_true',
+                            help='Пересчитать и клики по устройствам')
+
+    def handle(self, *args, **options):
+        start_date = parse_date(options['start_date'])
+        end_date = parse_date(options['end_date'])
+        if start_date is None or end_date is None or start_date > end_date:
+            raise CommandError('Укажите корректный диапазон дат: --from ГГГГ-ММ-ДД --to ГГГГ-ММ-ДД')
+
+        updated = backfill_daily_stats(start_date, end_date, recount_clicks=options['recount'])
+        self.stdout.write(self.style.SUCCESS(f'Обновлено записей DailyStats: {updated}'))
@@ -0,0 +1,188 @@
+import asyncio
+import io
+import statistics
+import time
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from shortener.counters import click_counter
+from shortener.fastpath import FastRedirectASGI, FastRedirectWSGI
+from shortener.ingest import ingestor
+from shortener.models import ShortenedURL
+
+BENCH_USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                    '(KHTML, like Gecko) Chrome/120.0 Safari/537.36')
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает перенаправление: синхронное представление через WSGI и ASGI, '
+            'асинхронное (/go/<код>/) через ASGI и быстрый путь fastpath '
+            'против полного стека middleware')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Запросов на каждый путь')
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Одновременных запросов для ASGI')
+        parser.add_argument('--allow-live-db', action='store_true',
+                            help='Писать ссылку и клики в настроенную БД, а не во временную тестовую')
+
+    def handle(self, *args, **options):
+        total = options['requests']
+        concurrency = options['concurrency']
+        if options['allow_live_db']:
+            self.bench(total, concurrency)
+            return
+
+        # Клики, счетчики и агрегаты бенчмарка не должны попасть в рабочую БД
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.bench(total, concurrency)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def bench(self, total, concurrency):
+        url = ShortenedURL.objects.create(
+            original_url='https://example.com/benchmark',
+            title='bench_redirect',
+            is_active=True,
+        )
+        try:
+            # Тестовые клиенты обращаются к хосту testserver
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                wsgi = self.bench_wsgi(f'/{url.short_code}/', total)
+                asgi_sync = asyncio.run(self.bench_asgi(f'/{url.short_code}/', total, concurrency))
+                asgi = asyncio.run(self.bench_asgi(f'/go/{url.short_code}/', total, concurrency))
+                # Обработчики вызываются напрямую, без накладных расходов тестового клиента
+                wsgi_app = get_wsgi_application()
+                full_wsgi = self.bench_wsgi_app(wsgi_app, f'/{url.short_code}/', total)
+                fast_wsgi = self.bench_wsgi_app(FastRedirectWSGI(wsgi_app), f'/{url.short_code}/', total)
+                asgi_app = get_asgi_application()
+                full_asgi = asyncio.run(self.bench_asgi_app(asgi_app, f'/{url.short_code}/', total, concurrency))
+                fast_asgi = asyncio.run(self.bench_asgi_app(
+                    FastRedirectASGI(asgi_app), f'/{url.short_code}/', total, concurrency
+                ))
+            self.report('WSGI /<код>/', wsgi)
+            self.report(f'ASGI /<код>/ (x{concurrency})', asgi_sync)
+            self.report(f'ASGI /go/<код>/ (x{concurrency})', asgi)
+            self.report('WSGIHandler, полный стек', full_wsgi)
+            self.report('WSGIHandler, fastpath', fast_wsgi)
+            self.report(f'ASGIHandler, полный стек (x{concurrency})', full_asgi)
+            self.report(f'ASGIHandler, fastpath (x{concurrency})', fast_asgi)
+        finally:
+            # Дожидаемся записи всех кликов, иначе удаление ссылки нарушит FK
+            ingestor.stop()
+            click_counter.flush()
+            url.delete()
+
+    def bench_wsgi(self, path, total):
+        client = Client()
+        client.get(path)
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(total):
+            t0 = time.perf_counter()
+            response = client.get(path)
+            latencies.append(time.perf_counter() - t0)
+            assert response.status_code == 302, response.status_code
+        return time.perf_counter() - started, latencies
+
+    async def bench_asgi(self, path, total, concurrency):
+        client = AsyncClient()
+        await client.get(path)
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                t0 = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - t0)
+                assert response.status_code == 302, response.status_code
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        return time.perf_counter() - started, latencies
+
+    def bench_wsgi_app(self, application, path, total):
+        def start_response(status, headers):
+            assert status.startswith('302'), status
+
+        def call():
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'SCRIPT_NAME': '',
+                'QUERY_STRING': '', 'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+                'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+                'HTTP_USER_AGENT': BENCH_USER_AGENT,
+                'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': io.StringIO(),
+            }
+            response = application(environ, start_response)
+            if hasattr(response, 'close'):
+                response.close()
+
+        call()
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(total):
+            t0 = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - t0)
+        return time.perf_counter() - started, latencies
+
+    async def bench_asgi_app(self, application, path, total, concurrency):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'root_path': '', 'query_string': b'', 'server': ('testserver', 80),
+            'client': ('127.0.0.1', 50000),
+            'headers': [(b'host', b'testserver'), (b'user-agent', BENCH_USER_AGENT.encode())],
+        }
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                assert message['status'] == 302, message['status']
+
+        async def call():
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+            disconnected = asyncio.Event()
+
+            async def receive():
+                # После тела запроса ждем отключения клиента, как настоящий сервер
+                if messages:
+                    return messages.pop()
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            await application(dict(scope), receive, send)
+            disconnected.set()
+
+        await call()
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                t0 = time.perf_counter()
+                await call()
+                latencies.append(time.perf_counter() - t0)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        return time.perf_counter() - started, latencies
+
+    def report(self, name, result):
+        elapsed, latencies = result
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        self.stdout.write(
+            f'{name}: {len(latencies) / elapsed:.0f} запр/с, '
+            f'медиана {statistics.median(latencies) * 1000:.2f} мс, '
+            f'p99 {p99 * 1000:.2f} мс'
+        )
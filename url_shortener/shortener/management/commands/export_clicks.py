@@ -0,0 +1,51 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shortener.export import EXPORT_FORMATS, export_stream, parse_moment
+from shortener.models import ShortenedURL
+
+
+class Command(BaseCommand):
+    help = ('Потоково выгружает клики в CSV или NDJSON (по умолчанию все ссылки, в stdout); '
+            'прерванную выгрузку можно продолжить с --after <последний выгруженный id>')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--link', action='append', dest='links', metavar='CODE',
+                            help='Короткий код ссылки (можно несколько раз)')
+        parser.add_argument('--user', help='Имя пользователя: все его ссылки')
+        parser.add_argument('--since', help='Клики не раньше, ГГГГ-ММ-ДД или дата и время ISO')
+        parser.add_argument('--until', help='Клики раньше, ГГГГ-ММ-ДД или дата и время ISO')
+        parser.add_argument('--after', type=int, default=0, help='Курсор: выгружать клики с id больше')
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Сжимать выгрузку gzip')
+        parser.add_argument('--no-archive', action='store_true', help='Не выгружать клики из архива')
+        parser.add_argument('--output', help='Файл выгрузки (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        urls = None
+        if options['links'] or options['user']:
+            urls = ShortenedURL.objects.all()
+            if options['links']:
+                urls = urls.filter(short_code__in=options['links'])
+            if options['user']:
+                urls = urls.filter(user__username=options['user'])
+        try:
+            since = parse_moment(options['since'])
+            until = parse_moment(options['until'])
+        except ValueError as error:
+            raise CommandError(f'Неверная дата: {error}')
+
+        chunks = export_stream(
+            urls, options['format'], options['gzip'], after=options['after'],
+            since=since, until=until, include_archive=not options['no_archive'],
+        )
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
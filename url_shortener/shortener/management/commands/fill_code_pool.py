@@ -0,0 +1,38 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from shortener.allocators import ALPHABET
+from shortener.models import ShortenedURL, ShortCodePool
+
+
+class Command(BaseCommand):
+    help = 'Пополняет пул свободных коротких кодов для PoolAllocator'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help='Сколько кодов добавить')
+        parser.add_argument('--length', type=int, default=6, help='Длина кода')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = options['count']
+        length = options['length']
+        batch_size = options['batch_size']
+        rng = random.SystemRandom()
+
+        added = 0
+        while added < count:
+            size = min(batch_size, count - added)
+            codes = {''.join(rng.choice(ALPHABET) for _ in range(length)) for _ in range(size)}
+            # Генерация офлайн, поэтому здесь можно свериться с таблицей ссылок
+            codes -= set(ShortenedURL.objects.filter(short_code__in=codes)
+                         .values_list('short_code', flat=True))
+            before = ShortCodePool.objects.count()
+            ShortCodePool.objects.bulk_create(
+                [ShortCodePool(code=code) for code in codes], ignore_conflicts=True
+            )
+            added += ShortCodePool.objects.count() - before
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено кодов: {added}, всего в пуле: {ShortCodePool.objects.count()}'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shortener.counters import click_counter
+from shortener.ingest import ingestor
+
+
+class Command(BaseCommand):
+    help = 'Принудительно сбрасывает накопленные счетчики кликов в БД'
+
+    def handle(self, *args, **options):
+        # Сначала дописываем очередь кликов этого процесса, она пополняет счетчики
+        ingestor.flush()
+        flushed = click_counter.flush()
+        self.stdout.write(self.style.SUCCESS(f'Сброшено счетчиков ссылок: {flushed}'))
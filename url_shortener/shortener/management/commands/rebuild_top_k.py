@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from shortener.models import ShortenedURL
+from shortener.topk import rebuild_top_k
+
+
+class Command(BaseCommand):
+    help = ('Строит скетчи топ-значений (рефереры, страны, города, ОС) заново '
+            'по кликам в БД и в архиве')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--link', action='append', dest='links', metavar='CODE',
+                            help='Короткий код ссылки (можно несколько раз); по умолчанию все ссылки')
+
+    def handle(self, *args, **options):
+        url_ids = None
+        if options['links']:
+            url_ids = list(ShortenedURL.objects.filter(short_code__in=options['links'])
+                           .values_list('id', flat=True))
+        counted = rebuild_top_k(url_ids)
+        self.stdout.write(self.style.SUCCESS(f'Учтено кликов: {counted}'))
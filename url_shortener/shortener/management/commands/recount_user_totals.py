@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from shortener.totals import recount_user_totals
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счетчики профилей (ссылки, активные ссылки, клики) по ссылкам '
+            'пользователей и создает недостающие профили')
+
+    def handle(self, *args, **options):
+        users = recount_user_totals()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано профилей: {users}'))
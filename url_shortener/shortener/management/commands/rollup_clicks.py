@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from shortener.rollups import ROLLUP_BATCH_SIZE, roll_up_daily_stats, roll_up_hourly_stats
+
+
+class Command(BaseCommand):
+    help = ('Сворачивает новые клики в почасовую статистику HourlyStats и пересчитывает '
+            'посетителей и страны в DailyStats (запускать по расписанию, например раз в минуту)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ROLLUP_BATCH_SIZE,
+                            help='Сколько ID кликов сворачивать в одной транзакции')
+
+    def handle(self, *args, **options):
+        hourly = roll_up_hourly_stats(batch_size=options['batch_size'])
+        daily = roll_up_daily_stats(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Свернуто ID кликов: почасовая статистика {hourly}, ежедневная {daily}'
+        ))
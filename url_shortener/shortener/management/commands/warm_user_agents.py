@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from shortener.useragents import user_agent_cache, warm_user_agent_cache
+
+
+class Command(BaseCommand):
+    help = 'Прогревает общий кэш классификации User-Agent самыми частыми строками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Сколько самых частых строк User-Agent загрузить')
+
+    def handle(self, *args, **options):
+        warmed = warm_user_agent_cache(options['limit'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено строк User-Agent: {warmed}, промахов кэша: {user_agent_cache.misses}'
+        ))
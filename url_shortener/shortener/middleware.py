@@ -0,0 +1,22 @@
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.functional import SimpleLazyObject
+from django_user_agents.utils import get_user_agent
+
+
+@sync_and_async_middleware
+def user_agent_middleware(get_response):
+    """Аналог django_user_agents UserAgentMiddleware, поддерживающий ASGI.
+
+    Оригинальный middleware только синхронный, из-за чего под ASGI каждый
+    запрос, включая async-представления, уходил в поток через sync_to_async.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            request.user_agent = SimpleLazyObject(lambda: get_user_agent(request))
+            return await get_response(request)
+    else:
+        def middleware(request):
+            request.user_agent = SimpleLazyObject(lambda: get_user_agent(request))
+            return get_response(request)
+    return middleware
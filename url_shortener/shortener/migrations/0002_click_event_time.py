@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-17 06:01
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='clickstatistics',
+            name='clicked_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время клика'),
+        ),
+    ]
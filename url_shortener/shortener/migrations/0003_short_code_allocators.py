@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-17 06:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0002_click_event_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShortCodePool',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=20, unique=True, verbose_name='Код')),
+                ('claim', models.CharField(blank=True, db_index=True, max_length=32, verbose_name='Метка выдачи')),
+            ],
+            options={
+                'verbose_name': 'Свободный короткий код',
+                'verbose_name_plural': 'Свободные короткие коды',
+            },
+        ),
+        migrations.CreateModel(
+            name='ShortCodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Имя последовательности')),
+                ('next_value', models.BigIntegerField(default=0, verbose_name='Следующее значение')),
+            ],
+            options={
+                'verbose_name': 'Последовательность коротких кодов',
+                'verbose_name_plural': 'Последовательности коротких кодов',
+            },
+        ),
+    ]
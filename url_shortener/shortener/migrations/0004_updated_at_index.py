@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-17 06:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0003_short_code_allocators'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shortenedurl',
+            index=models.Index(fields=['updated_at'], name='shortener_s_updated_7aea0d_idx'),
+        ),
+    ]
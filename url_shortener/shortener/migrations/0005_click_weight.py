@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 08:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0004_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clickstatistics',
+            name='weight',
+            field=models.PositiveIntegerField(default=1, help_text='Сколько кликов представляет строка при выборочной записи', verbose_name='Вес'),
+        ),
+    ]
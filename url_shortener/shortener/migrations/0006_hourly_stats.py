@@ -0,0 +1,46 @@
+# Generated by Django 6.0.1 on 2026-10-17 09:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0005_click_weight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Агрегат')),
+                ('last_id', models.BigIntegerField(default=0, verbose_name='Последний учтенный ID клика')),
+                ('pending_id', models.BigIntegerField(default=0, verbose_name='Максимальный ID при прошлом запуске')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Состояние агрегации',
+                'verbose_name_plural': 'Состояния агрегации',
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='Начало часа')),
+                ('clicks', models.PositiveIntegerField(default=0, verbose_name='Клики')),
+                ('devices', models.JSONField(default=dict, verbose_name='Клики по устройствам')),
+                ('browsers', models.JSONField(default=dict, verbose_name='Клики по браузерам')),
+                ('countries', models.JSONField(default=dict, verbose_name='Клики по странам')),
+                ('shortened_url', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_stats', to='shortener.shortenedurl', verbose_name='Ссылка')),
+            ],
+            options={
+                'verbose_name': 'Почасовая статистика',
+                'verbose_name_plural': 'Почасовая статистика',
+                'ordering': ['-hour'],
+                'unique_together': {('shortened_url', 'hour')},
+            },
+        ),
+    ]
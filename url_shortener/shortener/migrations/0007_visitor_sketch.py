@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0006_hourly_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailystats',
+            name='visitor_sketch',
+            field=models.BinaryField(default=b'', verbose_name='Скетч посетителей (HyperLogLog)'),
+        ),
+    ]
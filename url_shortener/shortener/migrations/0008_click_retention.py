@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0007_visitor_sketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='click_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Пусто - общий срок CLICK_RETENTION_DAYS', null=True, verbose_name='Хранить клики, дней'),
+        ),
+    ]
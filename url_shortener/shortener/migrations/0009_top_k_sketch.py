@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-17 13:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0008_click_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopKSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('referer', 'Домен реферера'), ('country', 'Страна'), ('city', 'Город'), ('os', 'ОС')], max_length=20, verbose_name='Измерение')),
+                ('total', models.PositiveBigIntegerField(default=0, verbose_name='Всего кликов')),
+                ('counters', models.JSONField(default=list, verbose_name='Счетчики [значение, клики, ошибка]')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('shortened_url', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='top_k_sketches', to='shortener.shortenedurl', verbose_name='Ссылка')),
+            ],
+            options={
+                'verbose_name': 'Топ значений',
+                'verbose_name_plural': 'Топ значений',
+                'unique_together': {('shortened_url', 'dimension')},
+            },
+        ),
+    ]
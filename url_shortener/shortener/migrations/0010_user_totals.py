@@ -0,0 +1,36 @@
+# Generated by Django 6.0.1 on 2026-10-17 14:10
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def recount_user_totals(apps, schema_editor):
+    # total_links и total_clicks раньше не обновлялись: заполняем по ссылкам
+    ShortenedURL = apps.get_model('shortener', 'ShortenedURL')
+    UserProfile = apps.get_model('shortener', 'UserProfile')
+    totals = (ShortenedURL.objects.filter(user__isnull=False)
+              .values('user_id').order_by()
+              .annotate(links=Count('id'), active=Count('id', filter=Q(is_active=True)),
+                        clicks=Sum('click_count')))
+    for row in totals:
+        UserProfile.objects.filter(user_id=row['user_id']).update(
+            total_links=row['links'],
+            active_links=row['active'],
+            total_clicks=row['clicks'] or 0,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0009_top_k_sketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='active_links',
+            field=models.PositiveIntegerField(default=0, verbose_name='Активных ссылок'),
+        ),
+        migrations.RunPython(recount_user_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-17 14:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0010_user_totals'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shortenedurl',
+            index=models.Index(fields=['is_private', 'is_active', '-created_at'], name='shortener_s_is_priv_dad84d_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-17 15:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0011_public_feed_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='today_clicks',
+            field=models.PositiveIntegerField(default=0, verbose_name='Кликов за день'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='today_clicks_date',
+            field=models.DateField(blank=True, null=True, verbose_name='День кликов'),
+        ),
+        migrations.AddIndex(
+            model_name='shortenedurl',
+            index=models.Index(fields=['user', 'expires_at'], name='shortener_s_user_id_67b09d_idx'),
+        ),
+    ]
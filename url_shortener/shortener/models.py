@@ -1,8 +1,6 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
 from django.utils import timezone
-import random
-import string
 from datetime import timedelta
 
 class ShortenedURL(models.Model):
@@ -44,36 +42,84 @@ class ShortenedURL(models.Model):
             models.Index(fields=['short_code']),
             models.Index(fields=['user', 'created_at']),
             models.Index(fields=['is_active', 'expires_at']),
+            models.Index(fields=['updated_at']),
+            models.Index(fields=['is_private', 'is_active', '-created_at']),
+            models.Index(fields=['user', 'expires_at']),
         ]
     
     def __str__(self):
         return f"{self.short_code} -> {self.original_url[:50]}..."
     
+    # Сколько раз выдавать новый код, если выданный совпал с уже занятым
+    SHORT_CODE_ATTEMPTS = 5
+    
+    # Поля, изменения которых переносятся в счетчики профиля (см. signals)
+    TOTALS_FIELDS = ('user_id', 'is_active', 'click_count')
+    
+    # Счетчики кликов пишет только агрегатор (см. counters)
+    COUNTER_FIELDS = ('click_count', 'last_clicked')
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_totals()
+        return instance
+    
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.remember_totals()
+    
+    def remember_totals(self):
+        """Запоминает владельца, статус и клики, записанные в БД"""
+        if all(name in self.__dict__ for name in self.TOTALS_FIELDS):
+            self._saved_totals = tuple(self.__dict__[name] for name in self.TOTALS_FIELDS)
+        else:
+            # Отложенные поля: сигнал прочитает их из БД перед сохранением
+            self._saved_totals = None
+    
     def save(self, *args, **kwargs):
-        # Генерируем короткий код если его нет
-        if not self.short_code:
-            self.short_code = self.generate_short_code()
-        
         # Устанавливаем срок истечения по умолчанию (30 дней)
         if not self.expires_at:
             self.expires_at = timezone.now() + timedelta(days=30)
         
-        super().save(*args, **kwargs)
+        # Полное сохранение загруженной ссылки не затирает клики, сброшенные
+        # агрегатором после ее чтения
+        if not self._state.adding and kwargs.get('update_fields') is None and not args:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in self.COUNTER_FIELDS
+            ]
+        
+        if self.short_code:
+            super().save(*args, **kwargs)
+            return
+        
+        # Генерируем короткий код. Аллокатор не читает таблицу ссылок, поэтому
+        # редкое совпадение с пользовательским кодом ловим по ограничению unique
+        for attempt in range(self.SHORT_CODE_ATTEMPTS):
+            self.short_code = self.generate_short_code()
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                if attempt == self.SHORT_CODE_ATTEMPTS - 1:
+                    raise
     
     @staticmethod
-    def generate_short_code(length=6):
-        """Генерация случайного короткого кода"""
-        chars = string.ascii_letters + string.digits
-        while True:
-            code = ''.join(random.choice(chars) for _ in range(length))
-            if not ShortenedURL.objects.filter(short_code=code).exists():
-                return code
+    def generate_short_code():
+        """Выдает новый короткий код через настроенный аллокатор"""
+        from .allocators import get_allocator
+        return get_allocator().allocate()
     
     def increment_click_count(self):
         """Увеличивает счетчик кликов и обновляет время последнего клика"""
+        from .counters import click_counter
+        
+        # В БД приращение попадет при ближайшем сбросе агрегатора счетчиков
         self.click_count += 1
         self.last_clicked = timezone.now()
-        self.save(update_fields=['click_count', 'last_clicked'])
+        click_counter.add(self.pk, 1, self.last_clicked)
     
     def is_expired(self):
         """Проверяет, истекла ли ссылка"""
@@ -118,7 +164,7 @@ class ClickStatistics(models.Model):
                                      related_name='clicks', verbose_name="Ссылка")
     
     # Информация о клике
-    clicked_at = models.DateTimeField(auto_now_add=True, verbose_name="Время клика")
+    clicked_at = models.DateTimeField(default=timezone.now, verbose_name="Время клика")
     ip_address = models.GenericIPAddressField(null=True, blank=True, verbose_name="IP адрес")
     user_agent = models.TextField(blank=True, verbose_name="User Agent")
     referer = models.URLField(max_length=1000, blank=True, verbose_name="Реферер")
@@ -139,6 +185,8 @@ class ClickStatistics(models.Model):
     # Дополнительно
     is_bot = models.BooleanField(default=False, verbose_name="Бот")
     session_id = models.CharField(max_length=100, blank=True, verbose_name="ID сессии")
+    weight = models.PositiveIntegerField(default=1, verbose_name="Вес",
+                                         help_text="Сколько кликов представляет строка при выборочной записи")
     
     class Meta:
         verbose_name = "Статистика клика"
@@ -163,6 +211,7 @@ class DailyStats(models.Model):
     # Количественные показатели
     clicks = models.PositiveIntegerField(default=0, verbose_name="Клики")
     unique_visitors = models.PositiveIntegerField(default=0, verbose_name="Уникальные посетители")
+    visitor_sketch = models.BinaryField(default=b'', verbose_name="Скетч посетителей (HyperLogLog)")
     
     # Распределение по устройствам
     desktop_clicks = models.PositiveIntegerField(default=0, verbose_name="Клики с десктопов")
@@ -182,6 +231,94 @@ class DailyStats(models.Model):
         return f"Статистика {self.shortened_url.short_code} за {self.date}"
 
 
+class HourlyStats(models.Model):
+    """Почасовая агрегированная статистика кликов (см. rollups.roll_up_hourly_stats)"""
+    shortened_url = models.ForeignKey(ShortenedURL, on_delete=models.CASCADE,
+                                     related_name='hourly_stats', verbose_name="Ссылка")
+    hour = models.DateTimeField(verbose_name="Начало часа")
+    
+    clicks = models.PositiveIntegerField(default=0, verbose_name="Клики")
+    devices = models.JSONField(default=dict, verbose_name="Клики по устройствам")
+    browsers = models.JSONField(default=dict, verbose_name="Клики по браузерам")
+    countries = models.JSONField(default=dict, verbose_name="Клики по странам")
+    
+    class Meta:
+        verbose_name = "Почасовая статистика"
+        verbose_name_plural = "Почасовая статистика"
+        unique_together = ['shortened_url', 'hour']
+        ordering = ['-hour']
+    
+    def __str__(self):
+        return f"Статистика {self.shortened_url.short_code} за {self.hour}"
+
+
+class TopKSketch(models.Model):
+    """Скетч Space-Saving самых частых значений измерения кликов ссылки (см. topk)"""
+    DIMENSIONS = [
+        ('referer', 'Домен реферера'),
+        ('country', 'Страна'),
+        ('city', 'Город'),
+        ('os', 'ОС'),
+    ]
+    
+    shortened_url = models.ForeignKey(ShortenedURL, on_delete=models.CASCADE,
+                                     related_name='top_k_sketches', verbose_name="Ссылка")
+    dimension = models.CharField(max_length=20, choices=DIMENSIONS, verbose_name="Измерение")
+    
+    total = models.PositiveBigIntegerField(default=0, verbose_name="Всего кликов")
+    counters = models.JSONField(default=list, verbose_name="Счетчики [значение, клики, ошибка]")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Топ значений"
+        verbose_name_plural = "Топ значений"
+        unique_together = ['shortened_url', 'dimension']
+    
+    def __str__(self):
+        return f"Топ {self.dimension} для {self.shortened_url.short_code}"
+
+
+class RollupState(models.Model):
+    """Отметка, до какой строки ClickStatistics свернуты агрегаты"""
+    name = models.CharField(max_length=50, unique=True, verbose_name="Агрегат")
+    last_id = models.BigIntegerField(default=0, verbose_name="Последний учтенный ID клика")
+    pending_id = models.BigIntegerField(default=0, verbose_name="Максимальный ID при прошлом запуске")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Состояние агрегации"
+        verbose_name_plural = "Состояния агрегации"
+    
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
+
+class ShortCodeSequence(models.Model):
+    """Счетчик для выдачи коротких кодов блоками"""
+    name = models.CharField(max_length=50, unique=True, verbose_name="Имя последовательности")
+    next_value = models.BigIntegerField(default=0, verbose_name="Следующее значение")
+    
+    class Meta:
+        verbose_name = "Последовательность коротких кодов"
+        verbose_name_plural = "Последовательности коротких кодов"
+    
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
+
+class ShortCodePool(models.Model):
+    """Заранее сгенерированные свободные короткие коды"""
+    code = models.CharField(max_length=20, unique=True, verbose_name="Код")
+    claim = models.CharField(max_length=32, blank=True, db_index=True, verbose_name="Метка выдачи")
+    
+    class Meta:
+        verbose_name = "Свободный короткий код"
+        verbose_name_plural = "Свободные короткие коды"
+    
+    def __str__(self):
+        return self.code
+
+
 class UserProfile(models.Model):
     """Расширенный профиль пользователя"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
@@ -193,6 +330,8 @@ class UserProfile(models.Model):
     # Настройки
     default_link_expiry_days = models.IntegerField(default=30, verbose_name="Срок действия ссылок по умолчанию")
     show_advanced_options = models.BooleanField(default=False, verbose_name="Показывать расширенные настройки")
+    click_retention_days = models.PositiveIntegerField(null=True, blank=True, verbose_name="Хранить клики, дней",
+                                                       help_text="Пусто - общий срок CLICK_RETENTION_DAYS")
     theme = models.CharField(max_length=20, default='light', choices=[
         ('light', 'Светлая'),
         ('dark', 'Темная'),
@@ -202,6 +341,9 @@ class UserProfile(models.Model):
     # Статистика пользователя
     total_clicks = models.PositiveIntegerField(default=0, verbose_name="Всего кликов")
     total_links = models.PositiveIntegerField(default=0, verbose_name="Всего ссылок")
+    active_links = models.PositiveIntegerField(default=0, verbose_name="Активных ссылок")
+    today_clicks = models.PositiveIntegerField(default=0, verbose_name="Кликов за день")
+    today_clicks_date = models.DateField(null=True, blank=True, verbose_name="День кликов")
     
     # API
     api_key = models.CharField(max_length=64, blank=True, verbose_name="API ключ")
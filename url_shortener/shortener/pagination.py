@@ -0,0 +1,101 @@
+"""Постраничный вывод ссылок по ключу (created_at, id).
+
+Страница выбирается условием (created_at, id) < курсора с ORDER BY
+created_at DESC, id DESC и LIMIT, а не OFFSET, поэтому глубокие страницы
+читаются так же быстро, как первая, по индексу (user, created_at).
+Общее число строк не считается: о следующей странице говорит лишняя
+(limit + 1) строка выборки.
+
+Курсор - непрозрачная строка с (created_at, id) первой или последней
+ссылки страницы: after=<курсор> - следующая страница, before=<курсор> -
+предыдущая. Ссылки с одинаковым created_at различаются по id, так что
+при переходах строки не теряются и не повторяются.
+"""
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+LINKS_PAGE_SIZE = 20
+
+LINKS_MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(shortened_url):
+    """Курсор позиции ссылки"""
+    value = json.dumps([shortened_url.created_at.isoformat(), shortened_url.pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(created_at, id) из курсора; ValueError, если курсор испорчен"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = parse_datetime(created_at)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError(cursor)
+    if created_at is None or not isinstance(pk, int):
+        raise ValueError(cursor)
+    return created_at, pk
+
+
+class KeysetPage:
+    """Страница ссылок с курсорами соседних страниц (None, если страницы нет)"""
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def keyset_page(queryset, after=None, before=None, limit=LINKS_PAGE_SIZE):
+    """Страница ссылок queryset от новых к старым после курсора after или перед before"""
+    if before:
+        created_at, pk = decode_cursor(before)
+        # Идем назад по возрастанию ключа и разворачиваем страницу
+        rows = list(queryset.filter(created_at__gte=created_at).filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk)
+        ).order_by('created_at', 'pk')[:limit + 1])
+        items = rows[:limit][::-1]
+        return KeysetPage(
+            items,
+            next_cursor=encode_cursor(items[-1]) if items else None,
+            previous_cursor=encode_cursor(items[0]) if len(rows) > limit else None,
+        )
+
+    if after:
+        created_at, pk = decode_cursor(after)
+        # Лишнее условие created_at <= ... дает диапазон по индексу
+        queryset = queryset.filter(created_at__lte=created_at).filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+        )
+    rows = list(queryset.order_by('-created_at', '-pk')[:limit + 1])
+    items = rows[:limit]
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(items[-1]) if len(rows) > limit else None,
+        previous_cursor=encode_cursor(items[0]) if after and items else None,
+    )
+
+
+def page_limit(value, default=LINKS_PAGE_SIZE, maximum=LINKS_MAX_PAGE_SIZE):
+    """Размер страницы из параметра запроса в пределах [1, maximum]; ValueError, если не число"""
+    if not value:
+        return default
+    return max(1, min(int(value), maximum))
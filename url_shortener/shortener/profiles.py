@@ -0,0 +1,50 @@
+"""Профиль и тема текущего пользователя в пределах запроса.
+
+Профиль читается одним запросом и запоминается в кэше связи
+request.user.profile, поэтому представления, формы и шаблоны
+(user.profile, user_profile) используют один и тот же объект.
+Тема хранится в сессии: повторные страницы и анонимные посетители
+не читают профиль ради темы.
+"""
+from .models import UserProfile
+from .totals import recount_user_totals
+
+THEMES = ('light', 'dark', 'auto')
+
+THEME_SESSION_KEY = 'theme'
+
+
+def get_profile(request):
+    """Профиль пользователя запроса (создается при отсутствии); None для анонимных"""
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    try:
+        return user.profile
+    except UserProfile.DoesNotExist:
+        # Новый профиль сразу получает счетчики по уже созданным ссылкам
+        recount_user_totals([user.pk])
+        user.profile = UserProfile.objects.get(user_id=user.pk)
+        return user.profile
+
+
+def remember_theme(request, theme):
+    """Запоминает тему пользователя в сессии"""
+    request.session[THEME_SESSION_KEY] = theme
+
+
+def get_user_theme(request):
+    """Тема оформления: из сессии, иначе из профиля; auto - по заголовку браузера"""
+    theme = request.session.get(THEME_SESSION_KEY) if hasattr(request, 'session') else None
+    if theme is None:
+        if not request.user.is_authenticated:
+            # По умолчанию светлая тема
+            return 'light'
+        theme = get_profile(request).theme
+        remember_theme(request, theme)
+    if theme == 'auto':
+        # Проверяем системные настройки
+        if 'dark' in request.META.get('HTTP_SEC_CH_UA_MODE', ''):
+            return 'dark'
+        return 'light'
+    return theme
@@ -0,0 +1,161 @@
+"""Срок хранения сырых кликов.
+
+Клики старше срока хранения удаляются из ClickStatistics, после чего
+статистика по ним остается только в агрегатах HourlyStats и DailyStats.
+Срок задается глобально (CLICK_RETENTION_DAYS) или для пользователя
+(UserProfile.click_retention_days); None - хранить без ограничения.
+
+Удаляются только строки ниже отметок свертки (rolled_up_watermark), чтобы
+агрегаты не потеряли клики. Удаление идет диапазонами первичного ключа
+по CLICK_RETENTION_BATCH_SIZE ID, каждый диапазон - отдельный короткий
+DELETE в своей транзакции, с ограничением скорости
+CLICK_RETENTION_ROWS_PER_SECOND, поэтому блокировки не держатся долго.
+У ClickStatistics нет сигналов и зависимых моделей, так что Django
+удаляет строки одним DELETE, не загружая их в Python.
+
+Старые HourlyStats можно прореживать до дневной статистики
+(HOURLY_STATS_RETENTION_DAYS): после этого почасовые гистограммы за
+старые периоды недоступны, а клики по дням остаются в DailyStats.
+Сегменты архива удаляются целиком, когда все их клики старше самого
+длинного из сроков хранения.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from .archive import click_archive
+from .models import ClickStatistics, HourlyStats, ShortenedURL, UserProfile
+from .rollups import rolled_up_watermark
+
+# Сколько ссылок удалять за один запрос при очистке просроченных
+URL_DELETE_CHUNK_SIZE = 500
+
+
+class Throttle:
+    """Ограничение числа удаляемых строк в секунду"""
+
+    def __init__(self, rows_per_second):
+        self.rows_per_second = rows_per_second
+        self.started = time.monotonic()
+        self.rows = 0
+
+    def wait(self, rows):
+        self.rows += rows
+        if not self.rows_per_second:
+            return
+        delay = self.rows / self.rows_per_second - (time.monotonic() - self.started)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def delete_clicks_by_id_range(queryset, start_id, end_id, batch_size, throttle, stop_at=None):
+    """Удаляет клики queryset с ID в [start_id, end_id] диапазонами по batch_size ID.
+
+    stop_at - время: проход останавливается на первом диапазоне, где ничего
+    не удалено, а последний клик не старше stop_at (ID растут вместе со временем).
+    """
+    deleted = 0
+    for low in range(start_id, end_id + 1, batch_size):
+        high = min(low + batch_size - 1, end_id)
+        count, _ = queryset.filter(id__gte=low, id__lte=high).delete()
+        deleted += count
+        throttle.wait(count)
+        if stop_at is not None and not count:
+            last_clicked = (ClickStatistics.objects.filter(id__gte=low, id__lte=high)
+                            .order_by('-id').values_list('clicked_at', flat=True).first())
+            if last_clicked is not None and last_clicked >= stop_at:
+                break
+    return deleted
+
+
+def retention_policies():
+    """{срок в днях: Q-фильтр кликов} для глобального срока и переопределений пользователей"""
+    overrides = {}
+    for user_id, days in (UserProfile.objects.filter(click_retention_days__isnull=False)
+                          .values_list('user_id', 'click_retention_days')):
+        overrides.setdefault(days, []).append(user_id)
+
+    policies = {}
+    global_days = getattr(settings, 'CLICK_RETENTION_DAYS', None)
+    if global_days is not None:
+        overridden = [user_id for user_ids in overrides.values() for user_id in user_ids]
+        policies[global_days] = ~Q(shortened_url__user_id__in=overridden)
+    for days, user_ids in overrides.items():
+        users = Q(shortened_url__user_id__in=user_ids)
+        policies[days] = policies[days] | users if days in policies else users
+    return policies
+
+
+def apply_click_retention(batch_size=None, rows_per_second=None):
+    """Удаляет клики старше сроков хранения; возвращает {срок в днях: удалено строк}"""
+    batch_size = batch_size or getattr(settings, 'CLICK_RETENTION_BATCH_SIZE', 5000)
+    if rows_per_second is None:
+        rows_per_second = getattr(settings, 'CLICK_RETENTION_ROWS_PER_SECOND', 20000)
+    throttle = Throttle(rows_per_second)
+
+    max_id = rolled_up_watermark()
+    start_id = ClickStatistics.objects.aggregate(min_id=Min('id'))['min_id']
+    if start_id is None or start_id > max_id:
+        return {}
+
+    now = timezone.now()
+    deleted = {}
+    for days, policy in retention_policies().items():
+        cutoff = now - timedelta(days=days)
+        queryset = ClickStatistics.objects.filter(policy, clicked_at__lt=cutoff)
+        deleted[days] = delete_clicks_by_id_range(queryset, start_id, max_id, batch_size, throttle,
+                                                  stop_at=cutoff)
+    return deleted
+
+
+def apply_hourly_stats_retention(batch_size=None):
+    """Удаляет HourlyStats старше HOURLY_STATS_RETENTION_DAYS; возвращает число строк"""
+    days = getattr(settings, 'HOURLY_STATS_RETENTION_DAYS', None)
+    if days is None:
+        return 0
+    batch_size = batch_size or getattr(settings, 'CLICK_RETENTION_BATCH_SIZE', 5000)
+    queryset = HourlyStats.objects.filter(hour__lt=timezone.now() - timedelta(days=days))
+    bounds = queryset.aggregate(min_id=Min('id'), max_id=Max('id'))
+    if bounds['min_id'] is None:
+        return 0
+    deleted = 0
+    for low in range(bounds['min_id'], bounds['max_id'] + 1, batch_size):
+        count, _ = queryset.filter(id__gte=low, id__lt=low + batch_size).delete()
+        deleted += count
+    return deleted
+
+
+def apply_archive_retention():
+    """Удаляет сегменты архива старше самого длинного срока хранения"""
+    if getattr(settings, 'CLICK_RETENTION_DAYS', None) is None:
+        # Без глобального срока клики ссылок без переопределения хранятся всегда
+        return 0
+    longest = max(retention_policies())
+    return click_archive.drop_before(timezone.now() - timedelta(days=longest))
+
+
+def purge_url_clicks(url_ids, batch_size=None, rows_per_second=None):
+    """Удаляет клики ссылок диапазонами ID перед удалением самих ссылок"""
+    batch_size = batch_size or getattr(settings, 'CLICK_RETENTION_BATCH_SIZE', 5000)
+    if rows_per_second is None:
+        rows_per_second = getattr(settings, 'CLICK_RETENTION_ROWS_PER_SECOND', 20000)
+    queryset = ClickStatistics.objects.filter(shortened_url_id__in=url_ids)
+    bounds = queryset.aggregate(min_id=Min('id'), max_id=Max('id'))
+    if bounds['min_id'] is None:
+        return 0
+    return delete_clicks_by_id_range(queryset, bounds['min_id'], bounds['max_id'], batch_size,
+                                     Throttle(rows_per_second))
+
+
+def delete_urls(url_ids):
+    """Удаляет ссылки пачками: сначала их клики диапазонами ID, затем сами ссылки"""
+    url_ids = list(url_ids)
+    for start in range(0, len(url_ids), URL_DELETE_CHUNK_SIZE):
+        chunk = url_ids[start:start + URL_DELETE_CHUNK_SIZE]
+        purge_url_clicks(chunk)
+        # Остались только агрегаты: каскад удаляет их одним DELETE на таблицу
+        ShortenedURL.objects.filter(id__in=chunk).delete()
+    return len(url_ids)
@@ -0,0 +1,366 @@
+"""Агрегаты статистики кликов.
+
+DailyStats обновляется при записи кликов одним запросом
+INSERT ... ON CONFLICT DO UPDATE: синтаксис upsert одинаков для SQLite (3.24+)
+и PostgreSQL, поэтому пачка кликов сворачивается в один запрос на группу
+строк, без get_or_create и без гонок на unique_together в полночь.
+
+HourlyStats заполняется периодической задачей roll_up_hourly_stats
+(команда rollup_clicks) по отметке RollupState: строки ClickStatistics
+с ID выше отметки еще не свернуты и читаются аналитикой напрямую.
+
+Уникальные посетители DailyStats считаются HLL-скетчами (см. hll),
+которые сливаются при записи кликов (merge_daily_visitors).
+top_countries пересчитывает roll_up_daily_stats (та же команда) по своей
+отметке: новые клики лишь помечают пары (ссылка, день), которые
+пересчитываются целиком сгруппированным запросом, поэтому повторный запуск
+ничего не портит. Произвольный диапазон дат, включая скетчи посетителей,
+пересчитывает команда backfill_daily_stats. Даты DailyStats - по UTC,
+как и при записи кликов.
+"""
+from collections import Counter, defaultdict
+from itertools import chain
+from datetime import datetime, time, timedelta
+from datetime import timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import F, Max, Sum
+from django.db.models.functions import TruncDate, TruncHour
+
+from .hll import HyperLogLog, visitor_key
+from .models import ClickStatistics, DailyStats, HourlyStats, RollupState, ShortenedURL
+
+UPSERT_VENDORS = ('sqlite', 'postgresql')
+
+# Сколько строк VALUES отправлять в одном запросе
+UPSERT_CHUNK_SIZE = 100
+
+COUNTER_COLUMNS = ('clicks', 'desktop_clicks', 'mobile_clicks', 'tablet_clicks')
+VISITOR_COLUMNS = ('unique_visitors', 'top_countries', 'visitor_sketch')
+
+DEVICE_COLUMNS = {
+    'desktop': 'desktop_clicks',
+    'mobile': 'mobile_clicks',
+    'tablet': 'tablet_clicks',
+}
+
+
+def fold_daily_clicks(clicks):
+    """Сворачивает клики (url_id, date, device_type) в счетчики по ссылке и дню"""
+    folded = defaultdict(lambda: {'clicks': 0, 'desktop_clicks': 0,
+                                  'mobile_clicks': 0, 'tablet_clicks': 0})
+    for url_id, date, device_type in clicks:
+        counters = folded[(url_id, date)]
+        counters['clicks'] += 1
+        column = DEVICE_COLUMNS.get(device_type)
+        if column:
+            counters[column] += 1
+    return folded
+
+
+def _upsert_sql(rows_count, add=(), replace=()):
+    qn = connection.ops.quote_name
+    table = qn(DailyStats._meta.db_table)
+    columns = ['shortened_url_id', 'date', *COUNTER_COLUMNS, *VISITOR_COLUMNS]
+    row = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    updates = ', '.join(
+        [f'{qn(column)} = {table}.{qn(column)} + excluded.{qn(column)}' for column in add]
+        + [f'{qn(column)} = excluded.{qn(column)}' for column in replace]
+    )
+    return (
+        f'INSERT INTO {table} ({", ".join(qn(column) for column in columns)}) '
+        f'VALUES {", ".join([row] * rows_count)} '
+        f'ON CONFLICT ({qn("shortened_url_id")}, {qn("date")}) DO UPDATE SET {updates}'
+    )
+
+
+def _upsert_params(url_id, date, values):
+    top_countries = DailyStats._meta.get_field('top_countries')
+    visitor_sketch = DailyStats._meta.get_field('visitor_sketch')
+    return [
+        url_id, connection.ops.adapt_datefield_value(date),
+        *(values.get(column, 0) for column in COUNTER_COLUMNS),
+        values.get('unique_visitors', 0),
+        top_countries.get_db_prep_save(values.get('top_countries', {}), connection),
+        visitor_sketch.get_db_prep_save(values.get('visitor_sketch', b''), connection),
+    ]
+
+
+def bulk_upsert_daily_stats(rows, add=(), replace=()):
+    """Upsert строк (url_id, date, {колонка: значение}) в DailyStats.
+
+    Колонки из add прибавляются к существующей строке, из replace - заменяют
+    ее значения; отсутствующие в values колонки новой строки равны нулю.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+
+    if connection.vendor not in UPSERT_VENDORS:
+        _upsert_daily_stats_fallback(rows, add, replace)
+        return len(rows)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            chunk = rows[start:start + UPSERT_CHUNK_SIZE]
+            params = []
+            for url_id, date, values in chunk:
+                params += _upsert_params(url_id, date, values)
+            cursor.execute(_upsert_sql(len(chunk), add, replace), params)
+    return len(rows)
+
+
+def upsert_daily_stats(clicks):
+    """Прибавляет клики (url_id, date, device_type) к DailyStats одним upsert на пачку"""
+    folded = fold_daily_clicks(clicks)
+    return bulk_upsert_daily_stats(
+        ((url_id, date, counters) for (url_id, date), counters in folded.items()),
+        add=COUNTER_COLUMNS,
+    )
+
+
+def merge_daily_visitors(visitors):
+    """Добавляет посетителей (url_id, date, ключ) в HLL-скетчи существующих строк DailyStats"""
+    sketches = defaultdict(HyperLogLog)
+    for url_id, date, key in visitors:
+        sketches[(url_id, date)].add(key)
+    if not sketches:
+        return 0
+
+    with transaction.atomic():
+        rows = DailyStats.objects.select_for_update().filter(
+            shortened_url_id__in={url_id for url_id, _ in sketches},
+            date__in={date for _, date in sketches},
+        ).only('id', 'shortened_url_id', 'date', 'visitor_sketch')
+        updated = []
+        for daily_stats in rows:
+            sketch = sketches.get((daily_stats.shortened_url_id, daily_stats.date))
+            if sketch is None:
+                continue
+            merged = HyperLogLog.from_bytes(daily_stats.visitor_sketch).merge(sketch)
+            daily_stats.visitor_sketch = merged.to_bytes()
+            daily_stats.unique_visitors = merged.count()
+            updated.append(daily_stats)
+        DailyStats.objects.bulk_update(updated, ['visitor_sketch', 'unique_visitors'])
+    return len(updated)
+
+
+def _upsert_daily_stats_fallback(rows, add, replace):
+    # Для СУБД без ON CONFLICT: get_or_create и атомарное обновление
+    with transaction.atomic():
+        for url_id, date, values in rows:
+            daily_stats, created = DailyStats.objects.get_or_create(
+                shortened_url_id=url_id,
+                date=date,
+                defaults=values
+            )
+            if not created:
+                updates = {column: F(column) + values[column] for column in add if column in values}
+                updates.update({column: values[column] for column in replace if column in values})
+                DailyStats.objects.filter(pk=daily_stats.pk).update(**updates)
+
+
+def _advance_rollup(name, batch_size, process):
+    """Передает process(start_id, end_id) новые диапазоны ID кликов, двигая отметку RollupState"""
+    rolled = 0
+    while True:
+        with transaction.atomic():
+            state, _ = RollupState.objects.select_for_update().get_or_create(name=name)
+            if state.last_id >= state.pending_id:
+                # Сворачиваем только ID, выданные до прошлого запуска: их транзакции
+                # уже закоммичены, а более новые могут еще появиться с меньшими ID
+                state.pending_id = max(
+                    ClickStatistics.objects.aggregate(max_id=Max('id'))['max_id'] or 0,
+                    state.last_id,
+                )
+                state.save(update_fields=['pending_id', 'updated_at'])
+                return rolled
+
+            end = min(state.last_id + batch_size, state.pending_id)
+            process(state.last_id, end)
+            rolled += end - state.last_id
+            state.last_id = end
+            state.save(update_fields=['last_id', 'updated_at'])
+
+
+HOURLY_ROLLUP = 'hourly_stats'
+DAILY_ROLLUP = 'daily_stats'
+
+# Сколько ID кликов сворачивать в одной транзакции
+ROLLUP_BATCH_SIZE = 50000
+
+# Сколько ссылок пересчитывать одним запросом
+RECOUNT_URLS_CHUNK_SIZE = 500
+
+TOP_COUNTRIES_SIZE = 10
+
+
+def fold_hourly_clicks(rows):
+    """Сворачивает строки GROUP BY (ссылка, час, устройство, браузер, страна) по ссылке и часу"""
+    folded = defaultdict(lambda: {'clicks': 0, 'devices': Counter(),
+                                  'browsers': Counter(), 'countries': Counter()})
+    for row in rows:
+        counters = folded[(row['shortened_url_id'], row['hour'])]
+        clicks = row['clicks']
+        counters['clicks'] += clicks
+        counters['devices'][row['device_type']] += clicks
+        counters['browsers'][row['browser']] += clicks
+        if row['country']:
+            counters['countries'][row['country']] += clicks
+    return folded
+
+
+def _merge_counts(target, source):
+    for key, value in source.items():
+        target[key] = target.get(key, 0) + value
+    return target
+
+
+def _apply_hourly_stats(folded):
+    existing = {
+        (stats.shortened_url_id, stats.hour): stats
+        for stats in HourlyStats.objects.select_for_update().filter(
+            shortened_url_id__in={url_id for url_id, _ in folded},
+            hour__in={hour for _, hour in folded},
+        )
+    }
+    to_create, to_update = [], []
+    for key, counters in folded.items():
+        stats = existing.get(key)
+        if stats is None:
+            to_create.append(HourlyStats(
+                shortened_url_id=key[0], hour=key[1], clicks=counters['clicks'],
+                devices=dict(counters['devices']), browsers=dict(counters['browsers']),
+                countries=dict(counters['countries']),
+            ))
+        else:
+            stats.clicks += counters['clicks']
+            _merge_counts(stats.devices, counters['devices'])
+            _merge_counts(stats.browsers, counters['browsers'])
+            _merge_counts(stats.countries, counters['countries'])
+            to_update.append(stats)
+    HourlyStats.objects.bulk_create(to_create)
+    HourlyStats.objects.bulk_update(to_update, ['clicks', 'devices', 'browsers', 'countries'])
+
+
+def hourly_rollup_watermark():
+    """ID последнего клика, учтенного в HourlyStats"""
+    return RollupState.objects.filter(name=HOURLY_ROLLUP).values_list('last_id', flat=True).first() or 0
+
+
+def rolled_up_watermark():
+    """ID, до которого клики учтены и в HourlyStats, и в DailyStats"""
+    watermarks = dict(RollupState.objects.values_list('name', 'last_id'))
+    return min(watermarks.get(HOURLY_ROLLUP, 0), watermarks.get(DAILY_ROLLUP, 0))
+
+
+def roll_up_hourly_stats(batch_size=ROLLUP_BATCH_SIZE):
+    """Сворачивает новые строки ClickStatistics в HourlyStats, возвращает число ID"""
+    def process(start_id, end_id):
+        rows = (ClickStatistics.objects
+                .filter(id__gt=start_id, id__lte=end_id)
+                .annotate(hour=TruncHour('clicked_at', tzinfo=dt_timezone.utc))
+                .values('shortened_url_id', 'hour', 'device_type', 'browser', 'country')
+                .annotate(clicks=Sum('weight'))
+                .order_by())
+        _apply_hourly_stats(fold_hourly_clicks(rows))
+
+    return _advance_rollup(HOURLY_ROLLUP, batch_size, process)
+
+
+def _day_bounds(day):
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def recount_daily_stats(day, url_ids=None, recount_clicks=False, recount_visitors=False):
+    """Пересчитывает top_countries ссылок за день по кликам в БД и в архиве.
+
+    recount_visitors - заново строит HLL-скетчи посетителей из строк кликов
+    (для данных, записанных до появления скетчей). recount_clicks - заменяет
+    и счетчики кликов по устройствам (клики без детальной строки, например
+    боты при BOT_CLICK_POLICY 'aggregate', в таком пересчете не учитываются).
+    """
+    start, end = _day_bounds(day)
+    clicks_qs = ClickStatistics.objects.filter(clicked_at__gte=start, clicked_at__lt=end)
+    if url_ids is not None:
+        clicks_qs = clicks_qs.filter(shortened_url_id__in=url_ids)
+
+    # Клики старых дней могут быть уже перенесены в архив (archive импортирует этот модуль)
+    from .archive import click_archive
+    # В архиве остаются клики удаленных ссылок: их пропускаем
+    archived_urls = ShortenedURL.objects.all()
+    if url_ids is not None:
+        archived_urls = archived_urls.filter(id__in=url_ids)
+    archived = list(click_archive.scan(
+        ['shortened_url_id', 'country', 'device_type', 'weight', 'ip_address', 'user_agent', 'is_bot'],
+        shortened_url_ids=archived_urls.values_list('id', flat=True), since=start, until=end,
+    ))
+
+    folded = defaultdict(lambda: {'clicks': 0, 'desktop_clicks': 0, 'mobile_clicks': 0,
+                                  'tablet_clicks': 0, 'countries': Counter()})
+    grouped = (clicks_qs.values('shortened_url_id', 'country', 'device_type')
+               .annotate(clicks=Sum('weight')).order_by())
+    for row in chain(grouped, ({**row, 'clicks': row['weight']} for row in archived)):
+        values = folded[row['shortened_url_id']]
+        values['clicks'] += row['clicks']
+        column = DEVICE_COLUMNS.get(row['device_type'])
+        if column:
+            values[column] += row['clicks']
+        if row['country']:
+            values['countries'][row['country']] += row['clicks']
+
+    replace = ('top_countries',)
+    if recount_clicks:
+        replace += COUNTER_COLUMNS
+    if recount_visitors:
+        replace += ('unique_visitors', 'visitor_sketch')
+        sketches = defaultdict(HyperLogLog)
+        visitors = (clicks_qs.filter(is_bot=False)
+                    .values_list('shortened_url_id', 'ip_address', 'user_agent')
+                    .order_by().iterator(chunk_size=5000))
+        archived_visitors = (
+            (row['shortened_url_id'], row['ip_address'], row['user_agent'])
+            for row in archived if not row['is_bot']
+        )
+        for url_id, ip_address, user_agent in chain(visitors, archived_visitors):
+            sketches[url_id].add(visitor_key(ip_address, user_agent))
+        for url_id, sketch in sketches.items():
+            folded[url_id]['unique_visitors'] = sketch.count()
+            folded[url_id]['visitor_sketch'] = sketch.to_bytes()
+
+    rows = []
+    for url_id, values in folded.items():
+        values['top_countries'] = dict(values.pop('countries').most_common(TOP_COUNTRIES_SIZE))
+        rows.append((url_id, day, values))
+    return bulk_upsert_daily_stats(rows, replace=replace)
+
+
+def roll_up_daily_stats(batch_size=ROLLUP_BATCH_SIZE):
+    """Пересчитывает top_countries за дни, в которых появились новые клики; возвращает число ID"""
+    def process(start_id, end_id):
+        dirty = defaultdict(set)
+        days = (ClickStatistics.objects
+                .filter(id__gt=start_id, id__lte=end_id)
+                .annotate(day=TruncDate('clicked_at', tzinfo=dt_timezone.utc))
+                .values_list('shortened_url_id', 'day')
+                .order_by()
+                .distinct())
+        for url_id, day in days:
+            dirty[day].add(url_id)
+        for day, url_ids in dirty.items():
+            url_ids = sorted(url_ids)
+            for start in range(0, len(url_ids), RECOUNT_URLS_CHUNK_SIZE):
+                recount_daily_stats(day, url_ids[start:start + RECOUNT_URLS_CHUNK_SIZE])
+
+    return _advance_rollup(DAILY_ROLLUP, batch_size, process)
+
+
+def backfill_daily_stats(start_date, end_date, recount_clicks=False):
+    """Пересчитывает страны и скетчи посетителей DailyStats всех ссылок за даты [start_date, end_date]"""
+    day = start_date
+    total = 0
+    while day <= end_date:
+        total += recount_daily_stats(day, recount_clicks=recount_clicks, recount_visitors=True)
+        day += timedelta(days=1)
+    return total
@@ -0,0 +1,96 @@
+"""Политика записи детальных строк ClickStatistics.
+
+Каждый клик учитывается в click_count и DailyStats, а детальная строка
+с User-Agent, IP и реферером пишется не всегда:
+
+* боты определяются регулярным выражением по строке User-Agent до разбора
+  и до обращений к БД; BOT_CLICK_POLICY задает, что с ними делать:
+  'record' - писать как обычный клик, 'aggregate' - только счетчики,
+  'sample' - одна детальная строка из BOT_CLICK_SAMPLE_RATE,
+  'skip' - не учитывать вовсе;
+* по горячим ссылкам (больше HOT_LINK_THRESHOLD кликов в секунду
+  в процессе) пишется одна строка из HOT_LINK_SAMPLE_RATE.
+
+Выборка случайная, а строка получает вес weight = N, поэтому суммы
+Sum('weight') по любому срезу остаются несмещенными оценками.
+"""
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+
+# Поисковые роботы, генераторы превью ссылок и HTTP-библиотеки.
+# "bot" в конце слова считается ботом, только если слово само "bot" или
+# "bot" в нем написан строчными после строчной буквы (Googlebot, TelegramBot):
+# модели телефонов вроде "CUBOT NOTE 20" ботами не считаются
+BOT_UA_RE = re.compile(
+    r'(?<![a-z])bot\b|bot/|(?-i:[a-z][bB]ot\b)|crawl|spider|slurp|preview|facebookexternalhit|facebookcatalog|'
+    r'whatsapp|embedly|vkshare|'
+    r'headless|lighthouse|curl/|wget/|python-|okhttp|go-http-client|java/|'
+    r'httpclient|axios/|node-fetch|libwww|scrapy|phantomjs',
+    re.IGNORECASE,
+)
+
+# Решение по клику: None - не учитывать, 0 - только счетчики, N - строка с весом N
+SKIP = None
+AGGREGATE_ONLY = 0
+
+
+def is_bot_user_agent(user_agent_string):
+    """Быстрая проверка User-Agent на бота без полного разбора"""
+    return bool(user_agent_string) and BOT_UA_RE.search(user_agent_string) is not None
+
+
+class HotLinkSampler:
+    """Счетчик кликов по ссылкам в текущем секундном окне процесса"""
+
+    def __init__(self, threshold=0, rate=1):
+        self.threshold = threshold
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._window = None
+        self._counts = {}
+
+    def weight(self, url_id):
+        """Вес детальной строки для клика: 1, rate или 0 (строку не писать)"""
+        if not self.threshold or self.rate <= 1:
+            return 1
+        window = int(time.monotonic())
+        with self._lock:
+            if window != self._window:
+                # Окно сменилось: счетчики прошлой секунды не нужны
+                self._window = window
+                self._counts = {}
+            count = self._counts.get(url_id, 0) + 1
+            self._counts[url_id] = count
+        if count <= self.threshold:
+            return 1
+        return self.rate if random.random() * self.rate < 1 else AGGREGATE_ONLY
+
+
+hot_link_sampler = HotLinkSampler(
+    threshold=getattr(settings, 'HOT_LINK_THRESHOLD', 0),
+    rate=getattr(settings, 'HOT_LINK_SAMPLE_RATE', 10),
+)
+
+
+def bot_click_weight():
+    """Вес детальной строки для клика бота согласно BOT_CLICK_POLICY"""
+    policy = getattr(settings, 'BOT_CLICK_POLICY', 'aggregate')
+    if policy == 'skip':
+        return SKIP
+    if policy == 'aggregate':
+        return AGGREGATE_ONLY
+    if policy == 'sample':
+        rate = getattr(settings, 'BOT_CLICK_SAMPLE_RATE', 100)
+        return rate if random.random() * rate < 1 else AGGREGATE_ONLY
+    return 1
+
+
+def click_weight(url_id, is_bot):
+    """Решение по клику: None - пропустить, 0 - только счетчики, N - вес строки"""
+    if is_bot:
+        return bot_click_weight()
+    return hot_link_sampler.weight(url_id)
@@ -0,0 +1,226 @@
+"""Временные ряды кликов на NumPy.
+
+Клики по дням читаются из DailyStats одним запросом (дата, клики) прямо
+в массивы: дни хранятся как datetime64[D], клики - int64, пропущенные дни
+заполняются нулями индексированием, без циклов по элементам. Скользящие
+средние, сравнение с предыдущим периодом, перцентили и гистограммы
+считаются векторно, поэтому ряд за год или за все время обрабатывается
+так же быстро, как за неделю.
+
+Ряды по неделям и месяцам (click_buckets) группируются в БД по DailyStats
+(TruncWeek/TruncMonth), так что число строк ответа равно числу корзин,
+а не дней или кликов, и время ответа не растет с возрастом ссылки.
+
+Почасовые гистограммы по HourlyStats тоже собираются через bincount:
+клики сворачиваются в сетку (день, четверть часа UTC), и смещение
+часового пояса применяется к ячейкам сетки, а не к каждому часу.
+"""
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+import numpy as np
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import DailyStats
+
+MOVING_AVERAGE_WINDOW = 7
+
+PERCENTILES = (50, 90, 99)
+
+SECONDS_PER_DAY = 86400
+
+# Ячейка сетки local_hour_histograms: смещения поясов и моменты переходов кратны 15 минутам
+SLOT_SECONDS = 900
+
+SLOTS_PER_DAY = SECONDS_PER_DAY // SLOT_SECONDS
+
+# group_by -> функция усечения даты в БД
+BUCKETS = {
+    'day': None,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def daily_click_series(shortened_url, start=None, end=None):
+    """Клики ссылки по дням [start, end] (даты UTC) с нулями в пропусках.
+
+    Возвращает (дни datetime64[D], клики int64); без start ряд начинается
+    с первого дня в DailyStats, без end заканчивается сегодняшним днем.
+    """
+    rows = DailyStats.objects.filter(shortened_url=shortened_url)
+    if start is not None:
+        rows = rows.filter(date__gte=start)
+    if end is not None:
+        rows = rows.filter(date__lte=end)
+    rows = rows.values_list('date', 'clicks')
+    count = len(rows)
+    dates = np.fromiter((date for date, _ in rows), dtype='datetime64[D]', count=count)
+    clicks = np.fromiter((clicks for _, clicks in rows), dtype=np.int64, count=count)
+
+    first = np.datetime64(start, 'D') if start is not None else (dates.min() if count else None)
+    last = np.datetime64(end if end is not None else timezone.now().date(), 'D')
+    if first is None or first > last:
+        return np.array([], dtype='datetime64[D]'), np.array([], dtype=np.int64)
+    return fill_days(dates, clicks, first, last)
+
+
+def fill_days(dates, values, first, last):
+    """Плотный ряд по дням [first, last]: значения в своих днях, нули в пропусках"""
+    days = np.arange(first, last + np.timedelta64(1, 'D'), dtype='datetime64[D]')
+    filled = np.zeros(len(days), dtype=np.int64)
+    index = (dates - first).astype(np.int64)
+    inside = (index >= 0) & (index < len(days))
+    filled[index[inside]] = values[inside]
+    return days, filled
+
+
+def bucket_index(days, first, group_by):
+    """Номера корзин для дат datetime64[D] относительно корзины first"""
+    if group_by == 'month':
+        return (days.astype('datetime64[M]') - first.astype('datetime64[M]')).astype(np.int64)
+    if group_by == 'week':
+        return (days - first).astype(np.int64) // 7
+    return (days - first).astype(np.int64)
+
+
+def bucket_starts(first, last, group_by):
+    """Начала корзин от корзины даты first до корзины даты last включительно"""
+    if group_by == 'month':
+        months = np.arange(first.astype('datetime64[M]'), last.astype('datetime64[M]') + 1)
+        return months.astype('datetime64[D]')
+    if group_by == 'week':
+        # 1 января 1970 - четверг: сдвигаем first на понедельник своей недели
+        monday = first - (first.astype(np.int64) + 3) % 7
+        return np.arange(monday, last + np.timedelta64(1, 'D'), 7)
+    return np.arange(first, last + np.timedelta64(1, 'D'))
+
+
+def click_buckets(shortened_url, start=None, end=None, group_by='day'):
+    """Клики по дням, неделям или месяцам за [start, end] (даты UTC) с нулями в пропусках.
+
+    Возвращает {'group_by', 'labels', 'clicks'}; метки - дата начала корзины
+    (для месяцев - YYYY-MM). Первая и последняя корзины могут быть неполными.
+    """
+    if BUCKETS[group_by] is None:
+        days, clicks = daily_click_series(shortened_url, start, end)
+        return {'group_by': group_by, 'labels': np.datetime_as_string(days).tolist(), 'clicks': clicks.tolist()}
+
+    rows = DailyStats.objects.filter(shortened_url=shortened_url)
+    if start is not None:
+        rows = rows.filter(date__gte=start)
+    if end is not None:
+        rows = rows.filter(date__lte=end)
+    rows = (rows.annotate(bucket=BUCKETS[group_by]('date')).values('bucket')
+            .annotate(clicks=Sum('clicks')).order_by().values_list('bucket', 'clicks'))
+    count = len(rows)
+    buckets = np.fromiter((bucket for bucket, _ in rows), dtype='datetime64[D]', count=count)
+    sums = np.fromiter((clicks for _, clicks in rows), dtype=np.int64, count=count)
+
+    first = np.datetime64(start, 'D') if start is not None else (buckets.min() if count else None)
+    last = np.datetime64(end if end is not None else timezone.now().date(), 'D')
+    if first is None or first > last:
+        return {'group_by': group_by, 'labels': [], 'clicks': []}
+    starts = bucket_starts(first, last, group_by)
+    clicks = np.zeros(len(starts), dtype=np.int64)
+    clicks[bucket_index(buckets, starts[0], group_by)] = sums
+    if group_by == 'month':
+        labels = np.datetime_as_string(starts.astype('datetime64[M]'))
+    else:
+        labels = np.datetime_as_string(starts)
+    return {'group_by': group_by, 'labels': labels.tolist(), 'clicks': clicks.tolist()}
+
+
+def moving_average(values, window=MOVING_AVERAGE_WINDOW):
+    """Скользящее среднее; в первых днях - среднее по имеющимся"""
+    if not len(values):
+        return np.array([], dtype=np.float64)
+    sums = np.cumsum(values, dtype=np.float64)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return sums / counts
+
+
+def period_over_period(values, period):
+    """Сумма последних period значений против предыдущих period"""
+    current = int(values[-period:].sum()) if period else 0
+    previous = int(values[-2 * period:-period].sum()) if period and len(values) > period else 0
+    change = current - previous
+    return {
+        'current': current,
+        'previous': previous,
+        'change': change,
+        'change_percent': round(change * 100.0 / previous, 1) if previous else None,
+    }
+
+
+def percentiles(values, points=PERCENTILES):
+    """Перцентили значений {'p50': ..., ...}"""
+    if not len(values):
+        return {f'p{point}': 0.0 for point in points}
+    return {f'p{point}': float(value) for point, value in zip(points, np.percentile(values, points))}
+
+
+def histogram(codes, weights=None, size=None):
+    """Сумма весов по целым кодам 0..size-1"""
+    return np.bincount(codes, weights=weights, minlength=size or 0)
+
+
+def local_hour_histograms(seconds, clicks):
+    """Гистограммы (24 часа, 7 дней недели) по меткам Unix в местном времени.
+
+    seconds - int64 секунды UTC, clicks - веса; смещение пояса берется на начало
+    и конец каждого дня UTC, а для дней с переходом времени - на каждую ячейку.
+    """
+    if not len(seconds):
+        return np.zeros(24, dtype=np.int64), np.zeros(7, dtype=np.int64)
+    days, day_index = np.unique(seconds // SECONDS_PER_DAY, return_inverse=True)
+    slot = (seconds % SECONDS_PER_DAY) // SLOT_SECONDS
+    # Клики сворачиваются в сетку одним bincount: дальше работа не зависит от их числа
+    grid = histogram(day_index * SLOTS_PER_DAY + slot, clicks, len(days) * SLOTS_PER_DAY)
+
+    # Начало каждой ячейки сетки (день, четверть часа) и смещение пояса в нем
+    starts = days[:, np.newaxis] * SECONDS_PER_DAY + np.arange(SLOTS_PER_DAY) * SLOT_SECONDS
+    offsets = np.empty_like(starts)
+    for number, day in enumerate(days.tolist()):
+        start, end = _utc_offset(day * SECONDS_PER_DAY), _utc_offset((day + 1) * SECONDS_PER_DAY - 1)
+        if start == end:
+            offsets[number] = start
+        else:
+            offsets[number] = [_utc_offset(value) for value in starts[number].tolist()]
+
+    local = (starts + offsets).ravel()
+    hour_of_day = (local // 3600) % 24
+    # 1 января 1970 - четверг: сдвиг на 3 дает 0 для понедельника
+    weekday = (local // SECONDS_PER_DAY + 3) % 7
+    return (histogram(hour_of_day, grid, 24).astype(np.int64),
+            histogram(weekday, grid, 7).astype(np.int64))
+
+
+def _utc_offset(seconds):
+    moment = datetime.fromtimestamp(seconds, dt_timezone.utc)
+    return int(timezone.localtime(moment).utcoffset() // timedelta(seconds=1))
+
+
+def click_trend(shortened_url, start=None, end=None, window=MOVING_AVERAGE_WINDOW):
+    """Ряд кликов по дням для графиков и сводка: скользящее среднее, динамика, перцентили"""
+    if start is not None:
+        # Вместе с периодом читаем предыдущий такой же длины - для сравнения
+        last = end if end is not None else timezone.now().date()
+        period = max((last - start).days + 1, 0)
+        days, clicks_both = daily_click_series(shortened_url, start - timedelta(days=period), last)
+        days, clicks = days[period:], clicks_both[period:]
+    else:
+        # За все время сравнивать не с чем
+        days, clicks = daily_click_series(shortened_url, None, end)
+        period = None
+    return {
+        'labels': np.datetime_as_string(days).tolist(),
+        'clicks': clicks.tolist(),
+        'moving_average': np.round(moving_average(clicks, window), 2).tolist(),
+        'period_over_period': period_over_period(clicks_both, period) if period is not None else None,
+        'percentiles': percentiles(clicks),
+        'peak': {'date': str(days[clicks.argmax()]), 'clicks': int(clicks.max())} if len(days) else None,
+    }
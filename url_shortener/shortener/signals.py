@@ -0,0 +1,77 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from .bloom import short_code_filter
+from .cache import cache_resolved, invalidate_short_codes
+from .feed import affects_public_feed, schedule_public_feed_refresh
+from .models import ShortenedURL, UserProfile
+from .profiles import remember_theme
+from .totals import adjust_user_totals, invalidate_user_stats
+
+
+@receiver(pre_save, sender=ShortenedURL)
+def shortened_url_saving(sender, instance, **kwargs):
+    """Читает владельца и статус до сохранения, если их не запомнили при загрузке"""
+    if instance.pk is not None and getattr(instance, '_saved_totals', None) is None:
+        instance._saved_totals = (ShortenedURL.objects.filter(pk=instance.pk)
+                                  .values_list(*ShortenedURL.TOTALS_FIELDS).first())
+
+
+@receiver(post_save, sender=ShortenedURL)
+def shortened_url_saved(sender, instance, **kwargs):
+    """Добавляет код в фильтр и кладет свежий снимок ссылки в кэш"""
+    short_code_filter.add(instance.short_code)
+    # Другие процессы найдут новый код в общем кэше, пока их фильтр не обновился
+    cache_resolved(instance)
+    if affects_public_feed(instance):
+        schedule_public_feed_refresh()
+
+
+@receiver(post_save, sender=ShortenedURL)
+def update_user_totals_on_save(sender, instance, created=False, update_fields=None, **kwargs):
+    before = None if created else getattr(instance, '_saved_totals', None)
+    # Срок или статус ссылки могли измениться: число истекших считаем заново
+    invalidate_user_stats(instance.user_id)
+    if before is None:
+        adjust_user_totals(instance.user_id, links=1, active=int(instance.is_active),
+                           clicks=instance.click_count)
+        instance.remember_totals()
+        return
+    user_id, is_active, click_count = before
+    if update_fields is not None and 'click_count' in update_fields:
+        saved_clicks = instance.click_count
+    elif user_id != instance.user_id:
+        # Клики, сброшенные после загрузки, переходят к новому владельцу вместе со ссылкой
+        saved_clicks = click_count = (ShortenedURL.objects.filter(pk=instance.pk)
+                                      .values_list('click_count', flat=True).first())
+    else:
+        saved_clicks = click_count
+    if user_id != instance.user_id:
+        invalidate_user_stats(user_id)
+        adjust_user_totals(user_id, links=-1, active=-int(is_active), clicks=-click_count)
+        adjust_user_totals(instance.user_id, links=1, active=int(instance.is_active),
+                           clicks=saved_clicks)
+    elif is_active != instance.is_active or saved_clicks != click_count:
+        adjust_user_totals(user_id, active=int(instance.is_active) - int(is_active),
+                           clicks=saved_clicks - click_count)
+    instance._saved_totals = (instance.user_id, instance.is_active, saved_clicks)
+
+
+@receiver(post_delete, sender=ShortenedURL)
+def shortened_url_deleted(sender, instance, **kwargs):
+    short_code_filter.discard(instance.short_code)
+    # Любой путь удаления (представление, админка, очистка истекших) сбрасывает кэш кода
+    invalidate_short_codes(instance.short_code)
+    if affects_public_feed(instance):
+        schedule_public_feed_refresh()
+    adjust_user_totals(instance.user_id, links=-1, active=-int(instance.is_active),
+                       clicks=-instance.click_count)
+    invalidate_user_stats(instance.user_id)
+
+
+@receiver(user_logged_in)
+def remember_theme_on_login(sender, request, user, **kwargs):
+    """Кладет тему в сессию при входе, чтобы страницы не читали ради нее профиль"""
+    theme = UserProfile.objects.filter(user=user).values_list('theme', flat=True).first()
+    remember_theme(request, theme or 'light')
@@ -1,3 +1,1043 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import tempfile
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth.models import User
+from django.core import signals
+from django.core.cache import cache
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .allocators import BASE, FeistelPermutation, PoolAllocator, SequenceAllocator
+from .analytics import click_breakdown, url_click_breakdown
+from .archive import (
+    COLUMNS as ARCHIVE_COLUMNS, ArchiveSegment, archive_clicks, archived_clicks, click_archive, write_segment,
+)
+from .bloom import BloomFilter, ShortCodeFilter
+from .cache import CACHE_KEY_PREFIX, resolve_short_code
+from .counters import (
+    CacheClickCounter, ClickCounterAggregator, MemoryClickCounter, apply_click_deltas, click_counter,
+)
+from .export import export_stream
+from .fastpath import FastRedirectASGI, FastRedirectWSGI
+from .feed import public_feed
+from .ingest import ClickEvent, ClickIngestor, write_click_batch
+from .models import ClickStatistics, DailyStats, HourlyStats, ShortCodePool, ShortenedURL, UserProfile
+from .pagination import keyset_page
+from .retention import Throttle, apply_click_retention, delete_urls
+from .rollups import (
+    backfill_daily_stats, bulk_upsert_daily_stats, roll_up_daily_stats, roll_up_hourly_stats, upsert_daily_stats,
+)
+from .sampling import HotLinkSampler, bot_click_weight, is_bot_user_agent
+from .series import click_buckets, click_trend, local_hour_histograms, moving_average
+from .topk import SpaceSaving, referer_domain
+from .totals import get_user_stats
+from .useragents import UserAgentCache, classify_browser, classify_user_agent
+
+
+def make_click(url, clicked_at, **fields):
+    return ClickStatistics(shortened_url=url, clicked_at=clicked_at, **fields)
+
+
+def make_event(url_id, clicked_at=None, **fields):
+    values = {
+        'shortened_url_id': url_id, 'clicked_at': clicked_at or timezone.now(),
+        'ip_address': '10.0.0.1', 'user_agent': 'Mozilla/5.0', 'referer': '',
+        'device_type': 'desktop', 'browser': 'chrome', 'operating_system': 'Windows',
+        'is_bot': False, 'session_id': 'session',
+    }
+    values.update(fields)
+    return ClickEvent(**values)
+
+
+@override_settings(CLICK_INGEST_ASYNC=False)
+class ClickBreakdownTests(TestCase):
+    """Статистика url_detail за фиксированное число запросов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.url = ShortenedURL.objects.create(original_url='https://example.com/', user=cls.user)
+        monday_morning = timezone.make_aware(datetime(2026, 10, 12, 9, 30))
+        saturday_evening = timezone.make_aware(datetime(2026, 10, 17, 21, 5))
+        ClickStatistics.objects.bulk_create([
+            make_click(cls.url, monday_morning, device_type='desktop', browser='chrome', country='RU'),
+            make_click(cls.url, monday_morning, device_type='desktop', browser='firefox', country='RU'),
+            make_click(cls.url, saturday_evening, device_type='mobile', browser='safari', country='DE'),
+            # Строка выборки, представляющая 5 кликов
+            make_click(cls.url, saturday_evening, device_type='mobile', browser='chrome', weight=5),
+        ])
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            click_breakdown(ClickStatistics.objects.filter(shortened_url=self.url))
+
+    def test_histograms_and_distributions(self):
+        breakdown = click_breakdown(ClickStatistics.objects.filter(shortened_url=self.url))
+
+        self.assertEqual(breakdown['total'], 8)
+        self.assertEqual(breakdown['hourly'][9], {'hour': 9, 'count': 2})
+        self.assertEqual(breakdown['hourly'][21], {'hour': 21, 'count': 6})
+        self.assertEqual(sum(hour['count'] for hour in breakdown['hourly']), 8)
+        self.assertEqual(breakdown['weekdays'][0], {'day': 'Пн', 'count': 2})
+        self.assertEqual(breakdown['weekdays'][5], {'day': 'Сб', 'count': 6})
+        self.assertEqual(breakdown['devices'], [
+            {'device_type': 'mobile', 'count': 6, 'percentage': 75.0},
+            {'device_type': 'desktop', 'count': 2, 'percentage': 25.0},
+        ])
+        self.assertEqual(breakdown['browsers'][0], {'browser': 'chrome', 'count': 6, 'percentage': 75.0})
+        self.assertEqual([row['country'] for row in breakdown['countries']], ['RU', 'DE'])
+
+    def test_empty(self):
+        breakdown = click_breakdown(ClickStatistics.objects.none())
+        self.assertEqual(breakdown['total'], 0)
+        self.assertEqual(breakdown['devices'], [])
+        self.assertEqual(len(breakdown['hourly']), 24)
+
+    def test_url_detail_query_count(self):
+        self.client.force_login(self.user)
+        # Сессия, пользователь, ссылка, отметка свертки, HourlyStats,
+        # GROUP BY несвернутых кликов, скетчи посетителей, последние клики, DailyStats,
+        # скетчи топ-значений
+        with self.assertNumQueries(10):
+            response = self.client.get(f'/{self.url.short_code}/stats/', {
+                'period': 'custom', 'start_date': '2026-10-01', 'end_date': '2026-10-31',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_filtered_clicks'], 8)
+
+    def test_rollup_matches_raw_clicks(self):
+        expected = click_breakdown(ClickStatistics.objects.filter(shortened_url=self.url))
+        # Первый запуск только запоминает максимальный ID, второй сворачивает
+        self.assertEqual(roll_up_hourly_stats(), 0)
+        self.assertEqual(roll_up_hourly_stats(), ClickStatistics.objects.count())
+        self.assertEqual(HourlyStats.objects.filter(shortened_url=self.url).count(), 2)
+
+        # Новый клик выше отметки читается из сырых строк
+        ClickStatistics.objects.create(
+            shortened_url=self.url, clicked_at=timezone.make_aware(datetime(2026, 10, 12, 9, 45)),
+            device_type='tablet', browser='other',
+        )
+        breakdown = url_click_breakdown(self.url)
+        self.assertEqual(breakdown['total'], expected['total'] + 1)
+        self.assertEqual(breakdown['hourly'][9]['count'], expected['hourly'][9]['count'] + 1)
+        self.assertEqual(breakdown['weekdays'][0]['count'], expected['weekdays'][0]['count'] + 1)
+        self.assertEqual(breakdown['weekdays'][5], expected['weekdays'][5])
+        self.assertIn({'device_type': 'tablet', 'count': 1, 'percentage': 100 / 9}, breakdown['devices'])
+
+
+class ClickSeriesTests(TestCase):
+    """Векторные ряды кликов по дням"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = ShortenedURL.objects.create(original_url='https://example.com/')
+        DailyStats.objects.bulk_create([
+            DailyStats(shortened_url=cls.url, date=datetime(2026, 10, day).date(), clicks=clicks)
+            for day, clicks in [(1, 4), (3, 2), (8, 10), (9, 6)]
+        ])
+
+    def test_click_trend_fills_gaps(self):
+        trend = click_trend(self.url, datetime(2026, 10, 6).date(), datetime(2026, 10, 10).date())
+        self.assertEqual(trend['labels'][0], '2026-10-06')
+        self.assertEqual(trend['clicks'], [0, 0, 10, 6, 0])
+        # Предыдущие 5 дней: 1-5 октября
+        self.assertEqual(trend['period_over_period'], {
+            'current': 16, 'previous': 6, 'change': 10, 'change_percent': 166.7,
+        })
+        self.assertEqual(trend['peak'], {'date': '2026-10-08', 'clicks': 10})
+
+    def test_click_buckets(self):
+        start, end = datetime(2026, 9, 28).date(), datetime(2026, 11, 3).date()
+        weeks = click_buckets(self.url, start, end, 'week')
+        self.assertEqual(weeks['labels'][:3], ['2026-09-28', '2026-10-05', '2026-10-12'])
+        self.assertEqual(weeks['clicks'], [6, 16, 0, 0, 0, 0])
+        months = click_buckets(self.url, start, end, 'month')
+        self.assertEqual(months, {'group_by': 'month', 'labels': ['2026-09', '2026-10', '2026-11'],
+                                  'clicks': [0, 22, 0]})
+
+    def test_moving_average(self):
+        self.assertEqual(moving_average(np.array([2, 4, 6, 8]), window=2).tolist(), [2.0, 3.0, 5.0, 7.0])
+
+    @override_settings(TIME_ZONE='Europe/Berlin')
+    def test_local_hour_histograms_across_dst(self):
+        # Переход на летнее время 29 марта 2026
+        start = datetime(2026, 3, 27, 23, tzinfo=dt_timezone.utc)
+        hours = [start + timedelta(hours=step) for step in range(72)]
+        hour_counts, weekday_counts = local_hour_histograms(
+            np.array([hour.timestamp() for hour in hours], dtype=np.int64), np.ones(len(hours)),
+        )
+        expected_hours = [0] * 24
+        expected_weekdays = [0] * 7
+        for hour in hours:
+            local = timezone.localtime(hour)
+            expected_hours[local.hour] += 1
+            expected_weekdays[local.isoweekday() - 1] += 1
+        self.assertEqual(hour_counts.tolist(), expected_hours)
+        self.assertEqual(weekday_counts.tolist(), expected_weekdays)
+
+    @override_settings(TIME_ZONE='Asia/Kolkata')
+    def test_local_hour_histograms_half_hour_zone(self):
+        rng = np.random.default_rng(1)
+        start = int(datetime(2026, 1, 1, tzinfo=dt_timezone.utc).timestamp())
+        seconds = np.sort(rng.integers(start, start + 40 * 86400, 2000))
+        clicks = rng.integers(1, 5, len(seconds))
+        expected_hours = [0] * 24
+        for value, count in zip(seconds.tolist(), clicks.tolist()):
+            expected_hours[timezone.localtime(datetime.fromtimestamp(value, dt_timezone.utc)).hour] += count
+        hour_counts, weekday_counts = local_hour_histograms(seconds, clicks)
+        self.assertEqual(hour_counts.tolist(), expected_hours)
+        self.assertEqual(int(weekday_counts.sum()), int(clicks.sum()))
+
+
+class ClickExportTests(TestCase):
+    """Потоковая выгрузка кликов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = ShortenedURL.objects.create(original_url='https://example.com/')
+        other = ShortenedURL.objects.create(original_url='https://example.org/')
+        clicked_at = timezone.make_aware(datetime(2026, 10, 12, 9, 30))
+        ClickStatistics.objects.bulk_create(
+            [make_click(cls.url, clicked_at, user_agent='Agent, "quoted"') for _ in range(5)]
+            + [make_click(other, clicked_at)]
+        )
+
+    def export(self, export_format, **filters):
+        urls = ShortenedURL.objects.filter(id=self.url.id)
+        filters.setdefault('include_archive', False)
+        data = b''.join(export_stream(urls, export_format, page_size=2, **filters))
+        if export_format == 'ndjson':
+            return [json.loads(line) for line in data.decode().splitlines()]
+        return data
+
+    def test_ndjson_pages_and_cursor(self):
+        records = self.export('ndjson')
+        ids = [record['id'] for record in records]
+        self.assertEqual(len(records), 5)
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual({record['short_code'] for record in records}, {self.url.short_code})
+
+        resumed = self.export('ndjson', after=ids[2])
+        self.assertEqual([record['id'] for record in resumed], ids[3:])
+
+    def test_csv_gzip(self):
+        urls = ShortenedURL.objects.filter(id=self.url.id)
+        data = gzip.decompress(b''.join(export_stream(urls, 'csv', compress=True, include_archive=False)))
+        rows = list(csv.DictReader(io.StringIO(data.decode())))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['user_agent'], 'Agent, "quoted"')
+
+    def test_archive_merged_once_in_id_order(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(mock.patch.object(click_archive, 'directory', directory.name))
+        other = ShortenedURL.objects.exclude(id=self.url.id).get()
+        # Клики двух ссылок вперемешку; сегмент записан, но строки еще не удалены из БД
+        clicked_at = timezone.make_aware(datetime(2026, 10, 13, 9, 30))
+        ClickStatistics.objects.bulk_create(
+            [make_click(url, clicked_at) for _ in range(3) for url in (self.url, other)]
+        )
+        # Как в archive_clicks: сегмент упорядочен по ссылке и времени
+        rows = list(ClickStatistics.objects.order_by('shortened_url_id', 'clicked_at', 'id').values(*ARCHIVE_COLUMNS))
+        ids = [row['id'] for row in rows]
+        with mock.patch('shortener.archive.ARCHIVE_BLOCK_ROWS', 4):
+            write_segment(click_archive.path_for(min(ids), max(ids)), rows)
+        archived_ids = [row['id'] for row in rows if row['shortened_url_id'] == self.url.id]
+        ClickStatistics.objects.filter(id__in=archived_ids[:2]).delete()
+        ids = list(ClickStatistics.objects.filter(shortened_url=self.url).values_list('id', flat=True))
+
+        expected = sorted(set(ids) | set(archived_ids))
+        self.assertEqual([record['id'] for record in self.export('ndjson', include_archive=True)], expected)
+        after = archived_ids[1]
+        resumed = self.export('ndjson', include_archive=True, after=after)
+        self.assertEqual([record['id'] for record in resumed], [i for i in expected if i > after])
+
+
+class SpaceSavingTests(TestCase):
+    """Скетч самых частых значений"""
+
+    def test_heavy_hitters_survive_eviction_and_merge(self):
+        first, second = SpaceSaving(capacity=3), SpaceSaving(capacity=3)
+        for sketch in (first, second):
+            for _ in range(50):
+                sketch.add('google.com')
+            for value in range(20):
+                sketch.add(f'rare-{value}.example')
+        first.merge(second)
+
+        top = first.top(1)[0]
+        self.assertEqual(top['value'], 'google.com')
+        self.assertGreaterEqual(top['count'], 100)
+        self.assertLessEqual(top['count'] - top['error'], 100)
+        self.assertEqual(first.total, 140)
+        self.assertLessEqual(len(first.counters), 3)
+
+    def test_referer_domain(self):
+        self.assertEqual(referer_domain('https://www.Google.com/search?q=1'), 'google.com')
+        self.assertEqual(referer_domain(''), '')
+
+
+class KeysetPaginationTests(TestCase):
+    """Постраничный вывод ссылок по курсору"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        UserProfile.objects.create(user=cls.user, api_key='key')
+        ShortenedURL.objects.bulk_create([
+            ShortenedURL(original_url='https://example.com/', short_code=f'page{number}', user=cls.user)
+            for number in range(25)
+        ])
+        # Ссылки с одинаковым created_at различаются по id
+        now = timezone.now()
+        for number, pk in enumerate(ShortenedURL.objects.order_by('id').values_list('id', flat=True)):
+            ShortenedURL.objects.filter(pk=pk).update(created_at=now - timedelta(minutes=number // 4))
+        cls.expected = list(ShortenedURL.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_pages_forward_and_back(self):
+        urls = ShortenedURL.objects.filter(user=self.user)
+        pages = [keyset_page(urls, limit=10)]
+        while pages[-1].has_next:
+            pages.append(keyset_page(urls, after=pages[-1].next_cursor, limit=10))
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([url.pk for page in pages for url in page], self.expected)
+        self.assertFalse(pages[0].has_previous)
+
+        previous = keyset_page(urls, before=pages[-1].previous_cursor, limit=10)
+        self.assertEqual([url.pk for url in previous], self.expected[10:20])
+        self.assertTrue(previous.has_previous)
+
+    def test_dashboard_and_api(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/dashboard/')
+        self.assertEqual([url.pk for url in response.context['user_urls']], self.expected[:20])
+        response = self.client.get('/dashboard/', {'after': response.context['page'].next_cursor})
+        self.assertEqual([url.pk for url in response.context['user_urls']], self.expected[20:])
+
+        data = self.client.get('/api/links/', {'limit': 20}, HTTP_X_API_KEY='key').json()
+        self.assertEqual(len(data['links']), 20)
+        data = self.client.get('/api/links/', {'after': data['next_cursor']}, HTTP_X_API_KEY='key').json()
+        self.assertEqual(len(data['links']), 5)
+        self.assertIsNone(data['next_cursor'])
+        response = self.client.get('/api/links/', {'after': 'broken'}, HTTP_X_API_KEY='key')
+        self.assertEqual(response.status_code, 400)
+
+
+class PublicFeedTests(TransactionTestCase):
+    """Лента публичных ссылок на главной"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_feed_served_from_cache_and_refreshed_on_commit(self):
+        first = ShortenedURL.objects.create(original_url='https://example.com/')
+        ShortenedURL.objects.create(original_url='https://example.org/', is_private=True)
+        ShortenedURL.objects.create(original_url='https://example.net/', expires_at=timezone.now() - timedelta(days=1))
+        with self.assertNumQueries(0):
+            self.assertEqual([link.id for link in public_feed()], [first.id])
+
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                second = ShortenedURL.objects.create(original_url='https://example.com/2')
+                first.is_active = False
+                first.save()
+        # Одна пересборка на транзакцию
+        self.assertEqual(sum('LIMIT 10' in query['sql'] for query in queries.captured_queries), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual([link.id for link in public_feed()], [second.id])
+
+        # Откаченная транзакция не мешает пересборке после следующей
+        with transaction.atomic():
+            ShortenedURL.objects.create(original_url='https://example.com/3')
+            transaction.set_rollback(True)
+        third = ShortenedURL.objects.create(original_url='https://example.com/4')
+        with self.assertNumQueries(0):
+            self.assertEqual([link.id for link in public_feed()], [third.id, second.id])
+
+
+class RequestProfileTests(TestCase):
+    """Профиль и тема читаются не больше одного раза за запрос"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader', password='secret')
+        UserProfile.objects.create(user=cls.user, theme='dark', show_advanced_options=True)
+
+    def profile_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        return response, sum('shortener_userprofile' in query['sql'] for query in queries.captured_queries)
+
+    def test_home_reads_profile_once(self):
+        response, count = self.profile_queries('/')
+        self.assertEqual(count, 0)
+        self.assertContains(response, 'data-bs-theme="light"')
+
+        self.client.force_login(self.user)
+        response, count = self.profile_queries('/')
+        self.assertEqual(count, 1)
+        self.assertEqual(type(response.context['form']).__name__, 'AdvancedURLShortenForm')
+        self.assertContains(response, 'data-bs-theme="dark"')
+
+        # Тема - из сессии: страница, которой профиль не нужен, его не читает
+        url = ShortenedURL.objects.create(original_url='https://example.com/', user=self.user)
+        response, count = self.profile_queries(f'/{url.short_code}/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(count, 0)
+        self.assertContains(response, 'data-bs-theme="dark"')
+
+
+class UserStatsTests(TestCase):
+    """Сводная статистика пользователя"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('stats', password='secret')
+        UserProfile.objects.create(user=self.user, api_key='stats-key')
+        self.urls = [ShortenedURL.objects.create(original_url='https://example.com/', user=self.user) for _ in range(3)]
+        self.urls[0].expires_at = timezone.now() - timedelta(days=1)
+        self.urls[0].save()
+
+    def test_counters_and_expired(self):
+        apply_click_deltas({self.urls[1].id: (4, timezone.now()), self.urls[2].id: (2, timezone.now())})
+        expected = {'total_urls': 3, 'total_clicks': 6, 'active_urls': 2, 'expired_urls': 1, 'today_clicks': 6}
+        self.assertEqual(get_user_stats(self.user), expected)
+        # Истекшие ссылки - из кэша: остается только чтение профиля
+        with self.assertNumQueries(1):
+            get_user_stats(self.user)
+
+        response = self.client.get('/api/user/stats/', HTTP_X_API_KEY='stats-key')
+        self.assertEqual(response.json(), expected)
+
+        UserProfile.objects.filter(user=self.user).update(today_clicks_date=timezone.localdate() - timedelta(days=1))
+        self.assertEqual(get_user_stats(self.user)['today_clicks'], 0)
+        apply_click_deltas({self.urls[1].id: (1, timezone.now())})
+        self.assertEqual(get_user_stats(self.user)['today_clicks'], 1)
+
+    def test_today_clicks_by_click_day(self):
+        now = timezone.now()
+        apply_click_deltas({self.urls[1].id: (3, now)})
+        # Клики прошлого дня, сброшенные после полуночи, не попадают в сегодняшние
+        apply_click_deltas({self.urls[1].id: (1, now - timedelta(days=1)), self.urls[2].id: (2, now)})
+        apply_click_deltas({self.urls[2].id: (4, now - timedelta(days=1))})
+        stats = get_user_stats(self.user)
+        self.assertEqual((stats['total_clicks'], stats['today_clicks']), (10, 5))
+
+    def test_saves_keep_flushed_clicks(self):
+        url = ShortenedURL.objects.get(id=self.urls[1].id)
+        apply_click_deltas({url.id: (5, timezone.now())})
+        self.client.force_login(self.user)
+
+        self.client.post(f'/{url.short_code}/toggle/')
+        self.client.post(f'/{url.short_code}/edit/', {
+            'original_url': 'https://example.com/edited', 'title': 'Edited', 'expiry_days': 30,
+        })
+        url.refresh_from_db()
+        self.assertEqual((url.click_count, url.title, url.is_active), (5, 'Edited', False))
+        self.assertEqual(get_user_stats(self.user)['total_clicks'], 5)
+
+        # Полное сохранение устаревшего экземпляра не затирает сброшенные клики
+        stale = ShortenedURL.objects.get(id=url.id)
+        apply_click_deltas({url.id: (2, timezone.now())})
+        with CaptureQueriesContext(connection) as queries:
+            stale.save()
+        self.assertFalse(any(query['sql'].startswith('SELECT') for query in queries.captured_queries))
+        url.refresh_from_db()
+        self.assertEqual(url.click_count, 7)
+        self.assertEqual(get_user_stats(self.user)['total_clicks'], 7)
+
+        # Клики переходят к новому владельцу вместе со ссылкой
+        other = User.objects.create_user('other')
+        url.user = other
+        url.save()
+        self.assertEqual(get_user_stats(self.user)['total_clicks'], 0)
+        self.assertEqual(get_user_stats(other)['total_clicks'], 7)
+
+
+class ClickIngestTests(TransactionTestCase):
+    """Пакетная запись кликов"""
+
+    def setUp(self):
+        # Фоновый сброс счетчиков мешал бы очистке БД: сбрасываем в тесте
+        patcher = mock.patch.object(click_counter, '_ensure_started')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(click_counter.flush)
+
+    def test_batch_with_deleted_link(self):
+        kept = ShortenedURL.objects.create(original_url='https://example.com/')
+        deleted = ShortenedURL.objects.create(original_url='https://example.org/')
+        deleted_id = deleted.id
+        deleted.delete()
+
+        write_click_batch([make_event(kept.id), make_event(deleted_id), make_event(kept.id, weight=0)])
+        click_counter.flush()
+
+        self.assertEqual(ClickStatistics.objects.filter(shortened_url=kept).count(), 1)
+        daily = DailyStats.objects.get(shortened_url=kept)
+        self.assertEqual((daily.clicks, daily.desktop_clicks, daily.unique_visitors), (2, 2, 1))
+        kept.refresh_from_db()
+        self.assertEqual(kept.click_count, 2)
+
+    def test_top_k_counted_by_weight(self):
+        url = ShortenedURL.objects.create(original_url='https://example.com/')
+        events = [make_event(url.id, country='RU', weight=3), make_event(url.id, country='DE', weight=0)]
+        with mock.patch('shortener.ingest.top_k_accumulator') as accumulator:
+            write_click_batch(events)
+        self.assertEqual(
+            [(call.args[1]['country'], call.args[2]) for call in accumulator.add.call_args_list],
+            [('RU', 3)],
+        )
+
+    def test_queue_written_in_batches(self):
+        url = ShortenedURL.objects.create(original_url='https://example.com/')
+        ingestor = ClickIngestor(batch_size=2)
+        with mock.patch.object(ingestor, '_ensure_started'), \
+                mock.patch('shortener.ingest.write_click_batch', wraps=write_click_batch) as write:
+            for index in range(5):
+                ingestor.submit(make_event(url.id, ip_address=f'10.0.0.{index}'))
+            self.assertFalse(ClickStatistics.objects.exists())
+            ingestor.flush()
+        click_counter.flush()
+
+        self.assertEqual([len(call.args[0]) for call in write.call_args_list], [2, 2, 1])
+        self.assertEqual(ClickStatistics.objects.filter(shortened_url=url).count(), 5)
+        daily = DailyStats.objects.get(shortened_url=url)
+        self.assertEqual((daily.clicks, daily.unique_visitors), (5, 5))
+        url.refresh_from_db()
+        self.assertEqual(url.click_count, 5)
+
+    def test_full_queue_written_synchronously(self):
+        url = ShortenedURL.objects.create(original_url='https://example.com/')
+        ingestor = ClickIngestor(maxsize=1, put_timeout=0)
+        with mock.patch.object(ingestor, '_ensure_started'):
+            ingestor.submit(make_event(url.id))
+            self.assertFalse(ingestor.offer(make_event(url.id)))
+            with self.assertLogs('shortener.ingest', 'WARNING'):
+                ingestor.submit(make_event(url.id))
+            self.assertEqual(ClickStatistics.objects.count(), 1)
+            ingestor.flush()
+        self.assertEqual(ClickStatistics.objects.count(), 2)
+
+
+class ClickArchiveTests(TransactionTestCase):
+    """Колоночный архив старых кликов"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(click_archive, 'directory', directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_archive_round_trip(self):
+        urls = [ShortenedURL.objects.create(original_url='https://example.com/') for _ in range(3)]
+        old = timezone.now() - timedelta(days=100)
+        ClickStatistics.objects.bulk_create([
+            make_click(url, old + timedelta(minutes=index), country='RU', city='Москва',
+                       latitude=55.75, longitude=37.61, referer='https://t.me/', is_bot=index == 3,
+                       user_agent=f'Agent {index % 2}', weight=index + 1)
+            for url in urls for index in range(5)
+        ])
+        expected = {row['id']: row for row in ClickStatistics.objects.values(*ARCHIVE_COLUMNS)}
+        ClickStatistics.objects.create(shortened_url=urls[0], clicked_at=timezone.now())
+        # Архивируются только свернутые клики; первый запуск свертки лишь фиксирует отметку
+        for _ in range(2):
+            roll_up_hourly_stats()
+            roll_up_daily_stats()
+
+        with mock.patch('shortener.archive.ARCHIVE_BLOCK_ROWS', 4):
+            self.assertEqual(archive_clicks(older_than_days=90), 15)
+        self.assertEqual(ClickStatistics.objects.count(), 1)
+        self.assertEqual({row['id']: row for row in click_archive.scan()}, expected)
+        # Блоки упорядочены по ссылке: каждый захватывает не больше двух соседних ссылок
+        blocks = click_archive.segments()[0].blocks
+        self.assertTrue(all(block['max_url'] - block['min_url'] <= 1 for block in blocks))
+
+        # Зональные карты: по ссылке и времени читаются только нужные строки
+        rows = list(click_archive.scan(['id', 'weight'], shortened_url_id=urls[1].id,
+                                       since=old + timedelta(minutes=1), until=old + timedelta(minutes=3)))
+        self.assertEqual([row['weight'] for row in rows], [2, 3])
+        latest = archived_clicks(urls[2].id, limit=2)
+        self.assertEqual([click.weight for click in latest], [5, 4])
+
+        segment = click_archive.segments()[0]
+        with open(segment.path, 'r+b') as damaged:
+            damaged.seek(-1, 2)
+            damaged.write(b'?')
+        with self.assertRaises(ValueError):
+            ArchiveSegment(segment.path)
+
+    def test_backfill_skips_deleted_links(self):
+        kept = ShortenedURL.objects.create(original_url='https://example.com/')
+        deleted = ShortenedURL.objects.create(original_url='https://example.org/')
+        clicked_at = timezone.make_aware(datetime(2026, 6, 1, 12, 0), dt_timezone.utc)
+        ClickStatistics.objects.bulk_create(
+            [make_click(kept, clicked_at, country='RU', ip_address=f'10.0.0.{i}') for i in range(3)]
+            + [make_click(deleted, clicked_at, country='DE')]
+        )
+        rows = list(ClickStatistics.objects.order_by('id').values(*ARCHIVE_COLUMNS))
+        write_segment(click_archive.path_for(rows[0]['id'], rows[-1]['id']), rows)
+        ClickStatistics.objects.all().delete()
+        deleted.delete()
+
+        backfill_daily_stats(clicked_at.date(), clicked_at.date(), recount_clicks=True)
+
+        daily = DailyStats.objects.get()
+        self.assertEqual(daily.shortened_url_id, kept.id)
+        self.assertEqual((daily.clicks, daily.unique_visitors, daily.top_countries), (3, 3, {'RU': 3}))
+
+
+@override_settings(CLICK_INGEST_ASYNC=False)
+class FastRedirectTests(TestCase):
+    """Перенаправления в обход middleware"""
+
+    def setUp(self):
+        cache.clear()
+        # Как тестовый клиент: соединение с БД не закрывается в конце запроса
+        signals.request_finished.disconnect(close_old_connections)
+        self.addCleanup(signals.request_finished.connect, close_old_connections)
+        self.url = ShortenedURL.objects.create(original_url='https://example.com/target')
+        self.passed = []
+
+    def wsgi(self, method, path):
+        def application(environ, start_response):
+            self.passed.append(environ['PATH_INFO'])
+            start_response('200 OK', [])
+            return [b'django']
+
+        started = []
+        environ = RequestFactory().generic(method, path).environ
+        body = b''.join(FastRedirectWSGI(application)(environ, lambda status, headers: started.append(status)))
+        return started[0], body
+
+    async def asgi(self, method, path):
+        async def application(scope, receive, send):
+            self.passed.append(scope['path'])
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+                 'headers': [(b'host', b'testserver')]}
+        await FastRedirectASGI(application)(scope, None, send)
+        return messages
+
+    def test_wsgi_redirect_and_click(self):
+        status, body = self.wsgi('GET', f'/{self.url.short_code}/')
+        self.assertTrue(status.startswith('302'))
+        self.assertEqual(ClickStatistics.objects.filter(shortened_url=self.url).count(), 1)
+        self.assertEqual(self.wsgi('HEAD', f'/{self.url.short_code}/'), (status, b''))
+        self.assertEqual(self.passed, [])
+
+    def test_wsgi_passthrough(self):
+        self.wsgi('POST', f'/{self.url.short_code}/')
+        self.wsgi('GET', '/dashboard/')
+        self.assertTrue(self.wsgi('GET', '/missing/')[0].startswith('404'))
+        self.url.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.url.save()
+        self.wsgi('GET', f'/{self.url.short_code}/')
+        self.assertEqual(self.passed, [f'/{self.url.short_code}/', '/dashboard/', f'/{self.url.short_code}/'])
+        self.assertFalse(ClickStatistics.objects.exists())
+
+    def test_wsgi_errors(self):
+        with self.assertLogs('shortener.fastpath', 'ERROR'):
+            with mock.patch('shortener.fastpath.resolve_short_code', side_effect=RuntimeError):
+                self.assertEqual(self.wsgi('GET', f'/{self.url.short_code}/'), ('200 OK', b'django'))
+            # Сбой записи клика не мешает перенаправлению
+            with mock.patch('shortener.fastpath.submit_click', side_effect=RuntimeError):
+                self.assertTrue(self.wsgi('GET', f'/{self.url.short_code}/')[0].startswith('302'))
+
+    async def test_asgi_redirect_and_passthrough(self):
+        with mock.patch('shortener.fastpath.submit_click_nowait') as submit:
+            messages = await self.asgi('GET', f'/{self.url.short_code}/')
+            self.assertEqual(messages[0]['status'], 302)
+            self.assertIn((b'location', b'https://example.com/target'), messages[0]['headers'])
+            self.assertEqual(submit.call_args.args[0].shortened_url_id, self.url.id)
+
+            messages = await self.asgi('HEAD', f'/{self.url.short_code}/')
+            self.assertEqual(messages[1]['body'], b'')
+            await self.asgi('POST', f'/{self.url.short_code}/')
+            await self.asgi('GET', '/dashboard/')
+            self.assertEqual(submit.call_count, 2)
+        self.assertEqual(self.passed, [f'/{self.url.short_code}/', '/dashboard/'])
+
+    def test_expired_link_page(self):
+        self.url.expires_at = timezone.now() - timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.url.save()
+        for path in (f'/{self.url.short_code}/', f'/go/{self.url.short_code}/'):
+            self.assertTemplateUsed(self.client.get(path), 'shortener/expired.html')
+        self.assertFalse(ClickStatistics.objects.exists())
+
+    async def test_asgi_errors(self):
+        with self.assertLogs('shortener.fastpath', 'ERROR'):
+            with mock.patch('shortener.fastpath.aresolve_short_code', side_effect=RuntimeError):
+                self.assertEqual(await self.asgi('GET', f'/{self.url.short_code}/'), [])
+            self.assertEqual(self.passed, [f'/{self.url.short_code}/'])
+            with mock.patch('shortener.fastpath.submit_click_nowait', side_effect=RuntimeError):
+                messages = await self.asgi('GET', f'/{self.url.short_code}/')
+        self.assertEqual(messages[0]['status'], 302)
+
+
+class ShortCodeCacheTests(TestCase):
+    """Кэш разрешения коротких кодов"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_snapshot_cached_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            url = ShortenedURL.objects.create(original_url='https://example.com/')
+            url.original_url = 'https://example.com/changed'
+        self.assertIsNone(cache.get(CACHE_KEY_PREFIX + url.short_code))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(cache.get(CACHE_KEY_PREFIX + url.short_code)[2], 'https://example.com/')
+
+    def test_deleted_code_invalidated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            url = ShortenedURL.objects.create(original_url='https://example.com/')
+        self.assertIsNotNone(resolve_short_code(url.short_code))
+        delete_urls([url.id])
+        self.assertIsNone(cache.get(CACHE_KEY_PREFIX + url.short_code))
+        self.assertIsNone(resolve_short_code(url.short_code))
+
+
+class ShortCodeFilterTests(TestCase):
+    """Фильтр Блума коротких кодов"""
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        codes = [f'code{i}' for i in range(1000)]
+        for code in codes:
+            bloom.add(code)
+        self.assertTrue(all(code in bloom for code in codes))
+        false_positives = sum(f'other{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 50)
+
+    def test_warm_add_and_rebuild_after_deletes(self):
+        urls = [ShortenedURL.objects.create(original_url='https://example.com/') for _ in range(5)]
+        codes = ShortCodeFilter(min_capacity=10)
+        codes.warm()
+        self.assertIsNotNone(codes._filter)
+        self.assertTrue(all(codes.might_exist(url.short_code) for url in urls))
+        self.assertFalse(codes.might_exist('missing'))
+        codes.add('added')
+        self.assertTrue(codes.might_exist('added'))
+
+        # Удаленные коды остаются до перестройки
+        deleted = urls.pop()
+        deleted.delete()
+        codes.discard(deleted.short_code)
+        codes.refresh()
+        self.assertIn(deleted.short_code, codes._filter)
+        second = urls.pop()
+        second.delete()
+        codes.discard(second.short_code)
+        codes.refresh()
+        self.assertNotIn(deleted.short_code, codes._filter)
+        self.assertTrue(all(url.short_code in codes._filter for url in urls))
+
+    def test_refresh_reads_codes_within_margin(self):
+        codes = ShortCodeFilter(refresh_interval=5, min_capacity=10)
+        codes.rebuild()
+        late = ShortenedURL.objects.create(original_url='https://example.com/')
+        old = ShortenedURL.objects.create(original_url='https://example.org/')
+        # Транзакция зафиксирована после построения, но updated_at - раньше него
+        ShortenedURL.objects.filter(id=late.id).update(updated_at=codes._refreshed_at - timedelta(seconds=60))
+        ShortenedURL.objects.filter(id=old.id).update(updated_at=codes._refreshed_at - timedelta(days=1))
+        codes.refresh()
+        self.assertIn(late.short_code, codes._filter)
+        self.assertNotIn(old.short_code, codes._filter)
+
+
+class ClickCounterTests(TestCase):
+    """Накопление и сброс счетчиков кликов"""
+
+    def setUp(self):
+        cache.clear()
+        self.url = ShortenedURL.objects.create(original_url='https://example.com/')
+        self.earlier = timezone.now() - timedelta(hours=1)
+        self.later = timezone.now()
+
+    def test_apply_keeps_latest_click(self):
+        apply_click_deltas({self.url.id: (2, self.later)})
+        apply_click_deltas({self.url.id: (3, self.earlier)})
+        self.url.refresh_from_db()
+        self.assertEqual((self.url.click_count, self.url.last_clicked), (5, self.later))
+
+    def test_cache_backend_coalesces(self):
+        counter = CacheClickCounter()
+        counter.add(self.url.id, 1, self.earlier)
+        counter.add(self.url.id, 2, self.later)
+        deltas = counter.take()
+        self.assertEqual(deltas[self.url.id][0], 3)
+        self.assertAlmostEqual(deltas[self.url.id][1].timestamp(), self.later.timestamp(), places=3)
+        self.assertEqual(counter.take(), {})
+
+        # Клик после сброса снова помечает ссылку
+        counter.add(self.url.id, 1, self.later)
+        self.assertEqual(counter.take()[self.url.id][0], 1)
+
+    def test_failed_flush_restores_deltas(self):
+        backend = MemoryClickCounter()
+        aggregator = ClickCounterAggregator(backend)
+        backend.add(self.url.id, 2, self.earlier)
+        backend.add(self.url.id, 1, self.later)
+        with mock.patch('shortener.counters.apply_click_deltas', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                aggregator.flush()
+        self.assertEqual(aggregator.flush(), 1)
+        self.url.refresh_from_db()
+        self.assertEqual((self.url.click_count, self.url.last_clicked), (3, self.later))
+
+
+class DailyStatsUpsertTests(TestCase):
+    """Upsert DailyStats и запасной путь через get_or_create"""
+
+    def setUp(self):
+        self.urls = [ShortenedURL.objects.create(original_url='https://example.com/') for _ in range(2)]
+        self.day = timezone.now().date()
+
+    def write(self):
+        first, second = self.urls
+        upsert_daily_stats([(first.id, self.day, 'desktop'), (first.id, self.day, 'mobile'), (second.id, self.day, 'bot')])
+        upsert_daily_stats([(first.id, self.day, 'tablet')])
+        bulk_upsert_daily_stats([(second.id, self.day, {'top_countries': {'RU': 1}})], replace=('top_countries',))
+        return [
+            (row.clicks, row.desktop_clicks, row.mobile_clicks, row.tablet_clicks, row.top_countries)
+            for row in DailyStats.objects.order_by('shortened_url_id')
+        ]
+
+    def test_upsert_matches_fallback(self):
+        with CaptureQueriesContext(connection) as queries:
+            upsert_daily_stats([(self.urls[0].id, self.day, 'desktop')] * 3)
+        statements = [query['sql'].split()[0] for query in queries.captured_queries]
+        self.assertEqual([sql for sql in statements if sql in ('SELECT', 'INSERT', 'UPDATE')], ['INSERT'])
+        DailyStats.objects.all().delete()
+
+        expected = [(3, 1, 1, 1, {}), (1, 0, 0, 0, {'RU': 1})]
+        self.assertEqual(self.write(), expected)
+        DailyStats.objects.all().delete()
+        with mock.patch('shortener.rollups.UPSERT_VENDORS', ()):
+            self.assertEqual(self.write(), expected)
+
+
+class ShortCodeAllocatorTests(TestCase):
+    """Выдача коротких кодов"""
+
+    def test_feistel_is_permutation(self):
+        permutation = FeistelPermutation(1000, 'key')
+        shuffled = [permutation(number) for number in range(1000)]
+        self.assertEqual(sorted(shuffled), list(range(1000)))
+        self.assertNotEqual(shuffled, list(range(1000)))
+
+    def test_sequence_blocks_are_shared(self):
+        first = SequenceAllocator(length=2, block_size=10, key='key')
+        second = SequenceAllocator(length=2, block_size=10, key='key')
+        with CaptureQueriesContext(connection) as queries:
+            codes = [first.allocate() for _ in range(10)] + [second.allocate() for _ in range(10)]
+        # Один блок на аллокатор, без чтения таблицы ссылок
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries.captured_queries), 2)
+        self.assertFalse(any('shortenedurl' in query['sql'] for query in queries.captured_queries))
+        codes.append(first.allocate())
+        self.assertEqual(len(set(codes)), 21)
+        # После исчерпания кодов длины 2 выдаются коды длины 3
+        self.assertEqual(len(first.encode(BASE ** 2)), 3)
+
+    def test_pool_and_fallback(self):
+        ShortCodePool.objects.bulk_create([ShortCodePool(code=code) for code in ('pool1', 'pool2')])
+        allocator = PoolAllocator(batch_size=5, key='key')
+        self.assertEqual({allocator.allocate(), allocator.allocate()}, {'pool1', 'pool2'})
+        self.assertFalse(ShortCodePool.objects.exists())
+        with self.assertLogs('shortener.allocators', 'WARNING'):
+            self.assertEqual(len(allocator.allocate()), 6)
+
+    def test_save_retries_taken_code(self):
+        taken = ShortenedURL.objects.create(original_url='https://example.com/', short_code='taken')
+        with mock.patch.object(ShortenedURL, 'generate_short_code', side_effect=['taken', 'fresh']):
+            url = ShortenedURL.objects.create(original_url='https://example.org/')
+        self.assertEqual(url.short_code, 'fresh')
+
+        codes = [taken.short_code] * ShortenedURL.SHORT_CODE_ATTEMPTS
+        with mock.patch.object(ShortenedURL, 'generate_short_code', side_effect=codes):
+            with self.assertRaises(IntegrityError):
+                ShortenedURL.objects.create(original_url='https://example.org/')
+
+
+class UserAgentCacheTests(TestCase):
+    """Мемоизация классификации User-Agent"""
+
+    CHROME = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/120.0 Safari/537.36')
+    IPHONE = ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 '
+              '(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_classification(self):
+        self.assertEqual(classify_browser('Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0'), 'firefox')
+        self.assertEqual(classify_browser(self.CHROME), 'chrome')
+        self.assertEqual(classify_browser(self.IPHONE), 'safari')
+        self.assertEqual(classify_browser(self.CHROME + ' Edg/120.0.2210.91'), 'edge')
+        self.assertEqual(classify_browser(self.CHROME + ' OPR/105.0.0.0'), 'opera')
+        self.assertEqual(classify_user_agent(self.IPHONE).device_type, 'mobile')
+        self.assertTrue(classify_user_agent('Googlebot/2.1 (+http://www.google.com/bot.html)').is_bot)
+
+    def test_local_and_shared_cache(self):
+        with mock.patch('shortener.useragents.classify_user_agent', wraps=classify_user_agent) as classify:
+            agents = UserAgentCache(maxsize=1)
+            first = agents.get(self.CHROME)
+            self.assertEqual(agents.get(self.CHROME), first)
+            self.assertEqual(classify.call_count, 1)
+            self.assertEqual((agents.hits, agents.misses), (1, 1))
+
+            # Вытесненная из LRU строка и другой процесс берут результат из общего кэша
+            agents.get(self.IPHONE)
+            self.assertEqual(agents.get(self.CHROME), first)
+            self.assertEqual(UserAgentCache().get(self.IPHONE).device_type, 'mobile')
+            self.assertEqual(async_to_sync(UserAgentCache().aget)(self.CHROME), first)
+            self.assertEqual(classify.call_count, 2)
+
+            local_only = UserAgentCache(maxsize=1, cache_alias=None)
+            local_only.get(self.CHROME)
+            local_only.get(self.IPHONE)
+            local_only.get(self.CHROME)
+            self.assertEqual(classify.call_count, 5)
+
+
+class ClickSamplingTests(TestCase):
+    """Политика для ботов и выборка по горячим ссылкам"""
+
+    def test_bot_detection(self):
+        self.assertTrue(is_bot_user_agent('Googlebot/2.1 (+http://www.google.com/bot.html)'))
+        self.assertTrue(is_bot_user_agent('curl/8.4.0'))
+        self.assertTrue(is_bot_user_agent('TelegramBot (like TwitterBot)'))
+        self.assertFalse(is_bot_user_agent(UserAgentCacheTests.CHROME))
+        self.assertFalse(is_bot_user_agent(
+            'Mozilla/5.0 (Linux; Android 11; CUBOT NOTE 20) AppleWebKit/537.36 '
+            '(KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36'
+        ))
+        self.assertFalse(is_bot_user_agent(''))
+
+    def test_bot_policies(self):
+        for policy, expected in (('skip', None), ('aggregate', 0), ('record', 1)):
+            with self.settings(BOT_CLICK_POLICY=policy):
+                self.assertEqual(bot_click_weight(), expected)
+        with self.settings(BOT_CLICK_POLICY='sample', BOT_CLICK_SAMPLE_RATE=100):
+            with mock.patch('shortener.sampling.random.random', side_effect=[0.001, 0.5]):
+                self.assertEqual([bot_click_weight(), bot_click_weight()], [100, 0])
+
+    def test_hot_link_weights(self):
+        sampler = HotLinkSampler(threshold=3, rate=4)
+        with mock.patch('shortener.sampling.time.monotonic', return_value=100.0), \
+                mock.patch('shortener.sampling.random.random', side_effect=[0.1, 0.5, 0.9, 0.6] * 2):
+            weights = [sampler.weight(1) for _ in range(11)]
+            self.assertEqual(sampler.weight(2), 1)
+        # Сверх порога одна строка из rate с весом rate: сумма весов равна числу кликов
+        self.assertEqual(weights, [1, 1, 1, 4, 0, 0, 0, 4, 0, 0, 0])
+        self.assertEqual(sum(weights), 11)
+        with mock.patch('shortener.sampling.time.monotonic', return_value=101.0):
+            self.assertEqual(sampler.weight(1), 1)
+
+    @override_settings(CLICK_INGEST_ASYNC=False, BOT_CLICK_POLICY='aggregate')
+    def test_bot_redirect_counted_without_row(self):
+        url = ShortenedURL.objects.create(original_url='https://example.com/')
+        response = self.client.get(f'/{url.short_code}/', HTTP_USER_AGENT='Googlebot/2.1')
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(ClickStatistics.objects.exists())
+        self.assertEqual(DailyStats.objects.get(shortened_url=url).clicks, 1)
+        url.refresh_from_db()
+        self.assertEqual(url.click_count, 1)
+
+
+class DailyRollupTests(TestCase):
+    """Инкрементальный пересчет top_countries DailyStats"""
+
+    def setUp(self):
+        self.url = ShortenedURL.objects.create(original_url='https://example.com/')
+        self.day = timezone.now() - timedelta(days=1)
+
+    def countries(self):
+        return {row.date: row.top_countries for row in DailyStats.objects.filter(shortened_url=self.url)}
+
+    def test_rollup_by_watermark(self):
+        write_click_batch([make_event(self.url.id, self.day, country='RU'),
+                           make_event(self.url.id, self.day, country='DE', weight=3),
+                           *[make_event(self.url.id, self.day, country='DE', weight=0)] * 2,
+                           make_event(self.url.id, country='RU')])
+        # Первый запуск только фиксирует ID, выданные до него
+        self.assertEqual(roll_up_daily_stats(), 0)
+        self.assertEqual(roll_up_daily_stats(), 3)
+        today = timezone.now().date()
+        self.assertEqual(self.countries(), {self.day.date(): {'DE': 3, 'RU': 1}, today: {'RU': 1}})
+        self.assertEqual(DailyStats.objects.get(shortened_url=self.url, date=self.day.date()).clicks, 4)
+
+        # Повторный запуск без новых кликов ничего не пересчитывает
+        roll_up_daily_stats()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(roll_up_daily_stats(), 0)
+        self.assertFalse(any('dailystats' in query['sql'] for query in queries.captured_queries))
+
+        write_click_batch([make_event(self.url.id, country='FR')])
+        roll_up_daily_stats()
+        roll_up_daily_stats()
+        self.assertEqual(self.countries()[today], {'RU': 1, 'FR': 1})
+        self.assertEqual(self.countries()[self.day.date()], {'DE': 3, 'RU': 1})
+
+
+class ClickRetentionTests(TestCase):
+    """Удаление старых кликов по срокам хранения"""
+
+    def test_throttle(self):
+        throttle = Throttle(100)
+        with mock.patch('shortener.retention.time.monotonic', return_value=throttle.started + 0.2), \
+                mock.patch('shortener.retention.time.sleep') as sleep:
+            throttle.wait(50)
+            throttle.wait(10)
+            Throttle(0).wait(1000)
+        self.assertEqual([round(call.args[0], 3) for call in sleep.call_args_list], [0.3, 0.4])
+
+    @override_settings(CLICK_RETENTION_DAYS=30)
+    def test_policies_and_watermark(self):
+        keeper = User.objects.create_user('keeper')
+        UserProfile.objects.create(user=keeper, click_retention_days=365)
+        plain = ShortenedURL.objects.create(original_url='https://example.com/')
+        kept = ShortenedURL.objects.create(original_url='https://example.org/', user=keeper)
+        old = timezone.now() - timedelta(days=60)
+        ClickStatistics.objects.bulk_create(
+            [make_click(plain, old) for _ in range(5)] + [make_click(kept, old)]
+            + [make_click(plain, timezone.now())]
+        )
+        for _ in range(2):
+            roll_up_hourly_stats()
+            roll_up_daily_stats()
+        # Еще не свернутые клики не удаляются
+        unrolled = ClickStatistics.objects.create(shortened_url=plain, clicked_at=old)
+
+        with mock.patch('shortener.retention.time.sleep') as sleep:
+            deleted = apply_click_retention(batch_size=2, rows_per_second=1)
+        self.assertEqual(deleted, {30: 5, 365: 0})
+        self.assertTrue(sleep.called)
+        self.assertEqual(ClickStatistics.objects.filter(shortened_url=kept).count(), 1)
+        self.assertEqual(ClickStatistics.objects.filter(shortened_url=plain, clicked_at__gt=old).count(), 1)
+        self.assertEqual(
+            list(ClickStatistics.objects.filter(shortened_url=plain, clicked_at=old).values_list('id', flat=True)),
+            [unrolled.id],
+        )
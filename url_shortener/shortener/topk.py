@@ -0,0 +1,230 @@
+"""Самые частые рефереры, страны, города и ОС ссылки (Space-Saving).
+
+Скетч Space-Saving хранит не больше TOP_K_CAPACITY счетчиков: новое
+значение при заполненном скетче вытесняет минимальный счетчик и наследует
+его значение как ошибку. Любое значение с частотой выше total / capacity
+гарантированно попадает в скетч, а завышение счетчика не больше его ошибки.
+Скетчи объединяются сложением счетчиков (отсутствующему значению
+заполненного скетча приписывается его минимум) с отсечением до capacity.
+
+Клики добавляются в скетчи процесса при записи пачки (ingest), а в
+TopKSketch сливаются не чаще раза в TOP_K_FLUSH_INTERVAL секунд, поэтому
+панели "топ N" читают O(K) значений одним запросом, не сканируя клики.
+Для уже записанных кликов (в БД и в архиве) скетчи строит команда rebuild_top_k.
+"""
+import threading
+import time
+from collections import defaultdict
+from itertools import chain
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .archive import click_archive
+from .models import ClickStatistics, ShortenedURL, TopKSketch
+
+TOP_K_CAPACITY = 100
+
+TOP_K_DEFAULT_LIMIT = 10
+
+DIMENSIONS = [dimension for dimension, _ in TopKSketch.DIMENSIONS]
+
+
+class SpaceSaving:
+    """Скетч Space-Saving: {значение: [клики, ошибка]} не больше capacity значений"""
+
+    def __init__(self, capacity=TOP_K_CAPACITY, counters=None, total=0):
+        self.capacity = capacity
+        self.counters = counters if counters is not None else {}
+        self.total = total
+
+    def add(self, value, count=1):
+        self.total += count
+        entry = self.counters.get(value)
+        if entry is not None:
+            entry[0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[value] = [count, 0]
+        else:
+            victim = min(self.counters, key=lambda key: self.counters[key][0])
+            minimum = self.counters.pop(victim)[0]
+            self.counters[value] = [minimum + count, minimum]
+
+    def _floor(self):
+        # Верхняя оценка частоты значения, которого нет в скетче
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def merge(self, other):
+        """Объединяет с другим скетчем"""
+        own_floor, other_floor = self._floor(), other._floor()
+        merged = {}
+        for value in self.counters.keys() | other.counters.keys():
+            own = self.counters.get(value, (own_floor, own_floor))
+            theirs = other.counters.get(value, (other_floor, other_floor))
+            merged[value] = [own[0] + theirs[0], own[1] + theirs[1]]
+        kept = sorted(merged.items(), key=lambda item: item[1][0], reverse=True)[:self.capacity]
+        self.counters = dict(kept)
+        self.total += other.total
+        return self
+
+    def top(self, limit=TOP_K_DEFAULT_LIMIT):
+        """Самые частые значения: [{value, count, error, percentage}] по убыванию"""
+        ranked = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        return [
+            {
+                'value': value,
+                'count': count,
+                'error': error,
+                'percentage': count * 100.0 / self.total if self.total else 0.0,
+            }
+            for value, (count, error) in ranked
+        ]
+
+    def to_list(self):
+        return [[value, count, error] for value, (count, error) in self.counters.items()]
+
+    @classmethod
+    def from_list(cls, counters, total, capacity=TOP_K_CAPACITY):
+        return cls(capacity, {value: [count, error] for value, count, error in counters}, total)
+
+
+def referer_domain(referer):
+    """Домен реферера без www; пустая строка для прямых переходов"""
+    if not referer:
+        return ''
+    try:
+        host = urlsplit(referer).hostname or ''
+    except ValueError:
+        return ''
+    return host[4:] if host.startswith('www.') else host
+
+
+def click_dimensions(referer, country, city, operating_system):
+    """Значения измерений клика для скетчей; пустые значения не учитываются"""
+    values = {
+        'referer': referer_domain(referer),
+        'country': country,
+        'city': city,
+        'os': operating_system,
+    }
+    return {dimension: value for dimension, value in values.items() if value}
+
+
+def merge_top_k_sketches(sketches):
+    """Сливает скетчи {(url_id, измерение): SpaceSaving} в TopKSketch"""
+    # Ссылки, удаленные до сброса, пропускаем: их строки нарушили бы внешний ключ
+    existing = set(ShortenedURL.objects.filter(
+        id__in={url_id for url_id, _ in sketches},
+    ).values_list('id', flat=True))
+    sketches = {key: sketch for key, sketch in sketches.items() if key[0] in existing}
+    if not sketches:
+        return 0
+    with transaction.atomic():
+        # Недостающие строки создаются пустыми (конфликт с другим процессом не страшен),
+        # затем все строки сливаются под блокировкой
+        TopKSketch.objects.bulk_create([
+            TopKSketch(shortened_url_id=url_id, dimension=dimension) for url_id, dimension in sketches
+        ], ignore_conflicts=True)
+        rows = TopKSketch.objects.select_for_update().filter(
+            shortened_url_id__in={url_id for url_id, _ in sketches},
+        )
+        updated = []
+        for row in rows:
+            sketch = sketches.get((row.shortened_url_id, row.dimension))
+            if sketch is None:
+                continue
+            merged = SpaceSaving.from_list(row.counters, row.total, sketch.capacity).merge(sketch)
+            row.total, row.counters = merged.total, merged.to_list()
+            row.updated_at = timezone.now()
+            updated.append(row)
+        TopKSketch.objects.bulk_update(updated, ['total', 'counters', 'updated_at'])
+    return len(sketches)
+
+
+class TopKAccumulator:
+    """Скетчи кликов процесса, периодически сливаемые в БД"""
+
+    def __init__(self, capacity=TOP_K_CAPACITY, flush_interval=30.0):
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._sketches = defaultdict(self._new_sketch)
+        self._flushed_at = time.monotonic()
+
+    def _new_sketch(self):
+        return SpaceSaving(self.capacity)
+
+    def add(self, url_id, dimensions, count=1):
+        with self._lock:
+            for dimension, value in dimensions.items():
+                self._sketches[(url_id, dimension)].add(value, count)
+
+    def flush(self):
+        """Сливает накопленные скетчи в TopKSketch, возвращает их число"""
+        with self._lock:
+            sketches, self._sketches = self._sketches, defaultdict(self._new_sketch)
+            self._flushed_at = time.monotonic()
+        try:
+            return merge_top_k_sketches(sketches)
+        except Exception:
+            # Возвращаем скетчи, чтобы слить их следующим сбросом
+            with self._lock:
+                for key, sketch in sketches.items():
+                    self._sketches[key].merge(sketch)
+            raise
+
+    def maybe_flush(self):
+        """Сбрасывает скетчи, если с прошлого сброса прошло flush_interval секунд"""
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            return self.flush()
+        return 0
+
+
+top_k_accumulator = TopKAccumulator(
+    capacity=getattr(settings, 'TOP_K_CAPACITY', TOP_K_CAPACITY),
+    flush_interval=getattr(settings, 'TOP_K_FLUSH_INTERVAL', 30.0),
+)
+
+
+def top_values(shortened_url, limit=TOP_K_DEFAULT_LIMIT):
+    """Топ значений ссылки по всем измерениям одним запросом: {измерение: [...]}"""
+    top = {dimension: [] for dimension in DIMENSIONS}
+    for dimension, total, counters in (TopKSketch.objects.filter(shortened_url=shortened_url)
+                                       .values_list('dimension', 'total', 'counters')):
+        top[dimension] = SpaceSaving.from_list(counters, total).top(limit)
+    return top
+
+
+def rebuild_top_k(url_ids=None, chunk_size=5000):
+    """Строит скетчи заново по кликам в БД и в архиве; возвращает число учтенных кликов"""
+    sketches = defaultdict(lambda: SpaceSaving(getattr(settings, 'TOP_K_CAPACITY', TOP_K_CAPACITY)))
+    clicks = ClickStatistics.objects.all()
+    if url_ids is not None:
+        clicks = clicks.filter(shortened_url_id__in=url_ids)
+    columns = ['shortened_url_id', 'referer', 'country', 'city', 'operating_system', 'weight']
+    live = clicks.order_by().values_list(*columns).iterator(chunk_size=chunk_size)
+    # В архиве остаются клики удаленных ссылок: их пропускаем
+    archived_url_ids = url_ids if url_ids is not None else ShortenedURL.objects.values_list('id', flat=True)
+    archived = (tuple(row[column] for column in columns)
+                for row in click_archive.scan(columns, shortened_url_ids=archived_url_ids))
+    counted = 0
+    for url_id, referer, country, city, operating_system, weight in chain(live, archived):
+        counted += weight
+        for dimension, value in click_dimensions(referer, country, city, operating_system).items():
+            sketches[(url_id, dimension)].add(value, weight)
+
+    with transaction.atomic():
+        existing = TopKSketch.objects.all()
+        if url_ids is not None:
+            existing = existing.filter(shortened_url_id__in=url_ids)
+        existing.delete()
+        TopKSketch.objects.bulk_create([
+            TopKSketch(shortened_url_id=url_id, dimension=dimension,
+                       total=sketch.total, counters=sketch.to_list())
+            for (url_id, dimension), sketch in sketches.items()
+        ], batch_size=1000)
+    return counted
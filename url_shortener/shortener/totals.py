@@ -0,0 +1,155 @@
+"""Счетчики пользователя в UserProfile: ссылки, активные ссылки, клики.
+
+total_links и active_links меняются сигналами при создании, изменении
+и удалении ссылок, total_clicks - при сбросе счетчиков кликов (counters),
+всегда атомарным UPDATE ... SET x = x + n; там же копятся клики за текущий
+день (today_clicks по местной дате клика, обнуляются с первым кликом нового
+дня). Поэтому сводка (get_user_stats) читается из одной строки профиля,
+сколько бы ссылок ни было у пользователя; отдельным запросом, кэшируемым
+на USER_STATS_CACHE_TIMEOUT секунд, считаются только истекшие ссылки.
+
+Активной считается включенная ссылка (is_active); истекшие ссылки
+перестают учитываться, когда их удаляет cleanup_expired_urls. Массовые
+изменения в обход сигналов (queryset.update) пересчитывают счетчики
+затронутых пользователей через recount_user_totals; им же (команда
+recount_user_totals) можно исправить любое расхождение.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Case, Count, F, PositiveIntegerField, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import ShortenedURL, UserProfile
+
+
+def adjust_user_totals(user_id, links=0, active=0, clicks=0):
+    """Атомарно прибавляет приращения к счетчикам профиля пользователя"""
+    if user_id is None or not (links or active or clicks):
+        return
+    updated = UserProfile.objects.filter(user_id=user_id).update(
+        total_links=Greatest(F('total_links') + links, Value(0)),
+        active_links=Greatest(F('active_links') + active, Value(0)),
+        total_clicks=Greatest(F('total_clicks') + clicks, Value(0)),
+    )
+    if not updated:
+        # Профиля еще нет: создаем его с посчитанными заново значениями
+        recount_user_totals([user_id])
+
+
+def add_user_clicks(deltas):
+    """Прибавляет клики {url_id: (n, last_clicked)} к total_clicks владельцев ссылок"""
+    owners = ShortenedURL.objects.filter(pk__in=deltas, user__isnull=False).values_list('id', 'user_id')
+    clicks = Counter()
+    # Клики за день - по местной дате клика, а не сброса: для каждого
+    # владельца значим только самый поздний день в пачке
+    latest = {}
+    for url_id, user_id in owners:
+        count, last_clicked = deltas[url_id]
+        clicks[user_id] += count
+        day = timezone.localdate(last_clicked)
+        if user_id not in latest or latest[user_id][0] < day:
+            latest[user_id] = [day, 0]
+        if latest[user_id][0] == day:
+            latest[user_id][1] += count
+    for user_id, count in clicks.items():
+        day, day_clicks = latest[user_id]
+        updated = UserProfile.objects.filter(user_id=user_id).update(
+            total_clicks=F('total_clicks') + count,
+            # Клики прошедшего дня не сбрасывают счетчик уже начавшегося
+            today_clicks=Case(
+                When(today_clicks_date=day, then=F('today_clicks') + day_clicks),
+                When(today_clicks_date__gt=day, then=F('today_clicks')),
+                default=Value(day_clicks),
+                output_field=PositiveIntegerField(),
+            ),
+            today_clicks_date=Case(
+                When(today_clicks_date__gt=day, then=F('today_clicks_date')),
+                default=Value(day),
+            ),
+        )
+        if not updated:
+            recount_user_totals([user_id])
+    return len(clicks)
+
+
+def recount_user_totals(user_ids=None):
+    """Пересчитывает счетчики профилей по ссылкам; создает недостающие профили"""
+    urls = ShortenedURL.objects.filter(user__isnull=False)
+    if user_ids is not None:
+        urls = urls.filter(user_id__in=user_ids)
+    totals = {
+        row['user_id']: row
+        for row in urls.values('user_id').order_by().annotate(
+            links=Count('id'),
+            active=Count('id', filter=Q(is_active=True)),
+            clicks=Sum('click_count'),
+        )
+    }
+    if user_ids is None:
+        profiles = UserProfile.objects.all()
+    else:
+        profiles = UserProfile.objects.filter(user_id__in=user_ids)
+    existing = set(profiles.values_list('user_id', flat=True))
+
+    empty = {'links': 0, 'active': 0, 'clicks': 0}
+    user_ids = existing | set(totals) if user_ids is None else set(user_ids)
+    for user_id in user_ids:
+        values = totals.get(user_id, empty)
+        fields = {
+            'total_links': values['links'],
+            'active_links': values['active'],
+            'total_clicks': values['clicks'] or 0,
+        }
+        if user_id in existing:
+            UserProfile.objects.filter(user_id=user_id).update(**fields)
+        else:
+            UserProfile.objects.get_or_create(user_id=user_id, defaults=fields)
+        invalidate_user_stats(user_id)
+    return len(user_ids)
+
+
+def _stats_cache():
+    return caches[getattr(settings, 'USER_STATS_CACHE_ALIAS', 'default')]
+
+
+def _expired_cache_key(user_id):
+    return f'user_stats:expired:{user_id}'
+
+
+def invalidate_user_stats(user_id):
+    """Сбрасывает кэшированное число истекших ссылок пользователя"""
+    if user_id is not None:
+        _stats_cache().delete(_expired_cache_key(user_id))
+
+
+def _expired_links(user_id):
+    key = _expired_cache_key(user_id)
+    counts = _stats_cache().get(key)
+    if counts is None:
+        counts = ShortenedURL.objects.filter(user_id=user_id, expires_at__lt=timezone.now()).aggregate(
+            expired=Count('id'),
+            expired_active=Count('id', filter=Q(is_active=True)),
+        )
+        _stats_cache().set(key, counts, getattr(settings, 'USER_STATS_CACHE_TIMEOUT', 30))
+    return counts
+
+
+def get_user_stats(user, profile=None):
+    """Сводка пользователя: ссылки, клики, активные и истекшие ссылки, клики за сегодня"""
+    if profile is None:
+        profile = UserProfile.objects.filter(user=user).first()
+        if profile is None:
+            recount_user_totals([user.pk])
+            profile = UserProfile.objects.get(user=user)
+    expired = _expired_links(profile.user_id)
+    return {
+        'total_urls': profile.total_links,
+        'total_clicks': profile.total_clicks,
+        # Активные - включенные и неистекшие
+        'active_urls': max(profile.active_links - expired['expired_active'], 0),
+        'expired_urls': expired['expired'],
+        'today_clicks': profile.today_clicks if profile.today_clicks_date == timezone.localdate() else 0,
+    }
@@ -0,0 +1,172 @@
+"""Классификация User-Agent с мемоизацией.
+
+Различных строк User-Agent в реальном трафике немного, поэтому результат
+классификации (тип устройства, браузер, ОС, бот) кэшируется: в LRU процесса
+по хешу строки и в общем кэше Django, который прогревается командой
+warm_user_agents по самым частым строкам из ClickStatistics.
+"""
+import hashlib
+import re
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count
+from user_agents import parse
+
+from .cache import LRUCache
+from .models import ClickStatistics
+
+UserAgentInfo = namedtuple('UserAgentInfo', ['device_type', 'browser', 'os', 'is_bot'])
+
+# Один проход по строке вместо цепочки проверок подстрок
+BROWSER_RE = re.compile(r'\bedge?/|\bopr/|opera|chrome|firefox|safari', re.IGNORECASE)
+
+# Токены Edge ("Edg/", "Edge/") и Opera на Chromium ("OPR/")
+BROWSER_ALIASES = {'edg/': 'edge', 'edge/': 'edge', 'opr/': 'opera'}
+
+# Порядок важен: Edge и Opera содержат "Chrome", Chrome содержит "Safari"
+BROWSER_PRIORITY = ('edge', 'opera', 'chrome', 'firefox', 'safari')
+
+SHARED_KEY_PREFIX = 'ua:'
+
+
+def classify_browser(user_agent_string):
+    """Определяет браузер по строке User-Agent"""
+    found = {BROWSER_ALIASES.get(match.lower(), match.lower())
+             for match in BROWSER_RE.findall(user_agent_string)}
+    for browser in BROWSER_PRIORITY:
+        if browser in found:
+            return browser
+    return 'other'
+
+
+def classify_user_agent(user_agent_string):
+    """Классифицирует строку User-Agent без кэша"""
+    user_agent = parse(user_agent_string)
+
+    device_type = 'other'
+    if user_agent.is_mobile:
+        device_type = 'mobile'
+    elif user_agent.is_tablet:
+        device_type = 'tablet'
+    elif user_agent.is_pc:
+        device_type = 'desktop'
+    elif user_agent.is_bot:
+        device_type = 'bot'
+
+    return UserAgentInfo(
+        device_type=device_type,
+        browser=classify_browser(user_agent_string),
+        os=user_agent.get_os(),
+        is_bot=user_agent.is_bot,
+    )
+
+
+class UserAgentCache:
+    """LRU классификаций User-Agent по хешу строки со счетчиками попаданий"""
+
+    def __init__(self, maxsize=5000, cache_alias='default', timeout=86400):
+        self.local = LRUCache(maxsize=maxsize)
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        # Счетчики обновляют и потоки запросов, и поток записи кликов
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def key(user_agent_string):
+        return hashlib.blake2b(user_agent_string.encode('utf-8', 'replace'), digest_size=16).hexdigest()
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def _local_get(self, key):
+        info = self.local.get(key)
+        with self._stats_lock:
+            if info is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return info
+
+    def get(self, user_agent_string):
+        key = self.key(user_agent_string)
+        info = self._local_get(key)
+        if info is not None:
+            return info
+
+        shared = self.shared
+        cached = shared.get(SHARED_KEY_PREFIX + key) if shared else None
+        if cached is not None:
+            info = UserAgentInfo(*cached)
+        else:
+            info = classify_user_agent(user_agent_string)
+            if shared:
+                shared.set(SHARED_KEY_PREFIX + key, tuple(info), self.timeout)
+        self.local.set(key, info)
+        return info
+
+    async def aget(self, user_agent_string):
+        """Асинхронный get: общий кэш не блокирует цикл событий"""
+        key = self.key(user_agent_string)
+        info = self._local_get(key)
+        if info is not None:
+            return info
+
+        shared = self.shared
+        cached = await shared.aget(SHARED_KEY_PREFIX + key) if shared else None
+        if cached is not None:
+            info = UserAgentInfo(*cached)
+        else:
+            info = classify_user_agent(user_agent_string)
+            if shared:
+                await shared.aset(SHARED_KEY_PREFIX + key, tuple(info), self.timeout)
+        self.local.set(key, info)
+        return info
+
+    def info(self):
+        """Статистика кэша: попадания, промахи, размер"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.local),
+            'maxsize': self.local.maxsize,
+        }
+
+    def clear(self):
+        self.local.clear()
+        with self._stats_lock:
+            self.hits = self.misses = 0
+
+
+user_agent_cache = UserAgentCache(
+    maxsize=getattr(settings, 'USER_AGENT_CACHE_SIZE', 5000),
+    cache_alias=getattr(settings, 'USER_AGENT_CACHE_ALIAS', 'default'),
+)
+
+
+def parse_user_agent(user_agent_string):
+    """Возвращает UserAgentInfo для строки User-Agent (с кэшем)"""
+    return user_agent_cache.get(user_agent_string or '')
+
+
+async def aparse_user_agent(user_agent_string):
+    """Асинхронный вариант parse_user_agent для async-представлений"""
+    return await user_agent_cache.aget(user_agent_string or '')
+
+
+def warm_user_agent_cache(limit=None):
+    """Прогревает кэш самыми частыми строками User-Agent из ClickStatistics"""
+    limit = limit or user_agent_cache.local.maxsize
+    top = (ClickStatistics.objects.values('user_agent')
+           .annotate(clicks=Count('id'))
+           .order_by('-clicks')[:limit])
+    warmed = 0
+    for row in top:
+        user_agent_cache.get(row['user_agent'])
+        warmed += 1
+    return warmed
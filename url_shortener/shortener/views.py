@@ -1,22 +1,24 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse, Http404
+from django.http import HttpResponse, HttpResponseNotFound, JsonResponse, Http404, StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout, authenticate
 from django.contrib import messages
 from .models import ShortenedURL, ClickStatistics, UserProfile
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.db.models import Count, Q, F, Sum
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.core.paginator import Paginator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_GET
 from django.conf import settings
-from django_user_agents.utils import get_user_agent
+from asgiref.sync import sync_to_async
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
 import json
 
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 import json
 try:
     import qrcode
@@ -28,30 +30,40 @@ except ImportError:
 import uuid
 
 from .models import ShortenedURL, ClickStatistics, DailyStats, UserProfile
+from .analytics import period_dates, unique_visitors_by_period, url_click_breakdown
+from .archive import archived_clicks
+from .bloom import is_short_code_taken
+from .cache import resolve_short_code, aresolve_short_code, invalidate_short_codes
+from .export import EXPORT_FORMATS, export_stream, parse_moment
+from .feed import public_feed
+from .ingest import ClickEvent, submit_click, submit_click_nowait
+from .pagination import keyset_page, page_limit
+from .profiles import THEMES, get_profile, remember_theme
+from .retention import delete_urls
+from .sampling import click_weight, is_bot_user_agent
+from .series import BUCKETS, click_buckets, click_trend
+from .topk import top_values
+from .totals import get_user_stats
+from .useragents import aparse_user_agent as aclassify_user_agent
+from .useragents import parse_user_agent as classify_user_agent
 from .forms import (
     URLShortenForm, AdvancedURLShortenForm, 
     UserRegisterForm, UserLoginForm, UserProfileForm,
     StatsFilterForm
 )
 
-def get_user_theme(request):
-    """Получение темы пользователя"""
-    if request.user.is_authenticated:
-        try:
-            profile = UserProfile.objects.get(user=request.user)
-            if profile.theme == 'auto':
-                # Проверяем системные настройки
-                if 'dark' in request.META.get('HTTP_SEC_CH_UA_MODE', ''):
-                    return 'dark'
-                return 'light'
-            return profile.theme
-        except UserProfile.DoesNotExist:
-            pass
-    
-    # По умолчанию светлая тема
-    return 'light'
-
 # Вспомогательные функции
+_not_found_content = None
+
+
+def short_code_not_found():
+    """Ответ 404 для неизвестного кода без обращения к БД и сессии"""
+    global _not_found_content
+    if _not_found_content is None:
+        _not_found_content = render_to_string('shortener/404.html')
+    return HttpResponseNotFound(_not_found_content)
+
+
 def get_client_ip(request):
     """Получение IP адреса клиента"""
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -63,53 +75,89 @@ def get_client_ip(request):
 
 def parse_user_agent(user_agent_string):
     """Парсинг User-Agent"""
-    user_agent = get_user_agent(request=None, user_agent_string=user_agent_string)
-    
-    device_type = 'other'
-    if user_agent.is_mobile:
-        device_type = 'mobile'
-    elif user_agent.is_tablet:
-        device_type = 'tablet'
-    elif user_agent.is_pc:
-        device_type = 'desktop'
-    elif user_agent.is_bot:
-        device_type = 'bot'
-    
-    browser = 'other'
-    if 'chrome' in user_agent_string.lower():
-        browser = 'chrome'
-    elif 'firefox' in user_agent_string.lower():
-        browser = 'firefox'
-    elif 'safari' in user_agent_string.lower() and 'chrome' not in user_agent_string.lower():
-        browser = 'safari'
-    elif 'edge' in user_agent_string.lower():
-        browser = 'edge'
-    elif 'opera' in user_agent_string.lower():
-        browser = 'opera'
-    
-    return {
-        'device_type': device_type,
-        'browser': browser,
-        'os': str(user_agent.os),
-        'is_bot': user_agent.is_bot,
-    }
+    return classify_user_agent(user_agent_string)._asdict()
+
+async def aparse_user_agent(user_agent_string):
+    """Асинхронный парсинг User-Agent"""
+    return (await aclassify_user_agent(user_agent_string))._asdict()
+
+# Ботов отсекаем регулярным выражением, без разбора User-Agent
+BOT_UA_INFO = {'device_type': 'bot', 'browser': 'other', 'os': '', 'is_bot': True}
+
+def client_location(request):
+    """Страна и город клиента из заголовков CDN/прокси (GEO_COUNTRY_HEADER, GEO_CITY_HEADER)"""
+    country = request.META.get(getattr(settings, 'GEO_COUNTRY_HEADER', 'HTTP_CF_IPCOUNTRY'), '')
+    city = request.META.get(getattr(settings, 'GEO_CITY_HEADER', 'HTTP_CF_IPCITY'), '')
+    # XX - страна неизвестна, T1 - Tor (обозначения Cloudflare)
+    if country in ('XX', 'T1'):
+        country = ''
+    return {'country': country[:100], 'city': city[:100]}
+
+
+def build_click_event(request, resolved, ua_info=None):
+    """Событие клика с учетом политики для ботов и выборки; None - не учитывать"""
+    user_agent = request.META.get('HTTP_USER_AGENT', '')
+    if ua_info is None:
+        ua_info = BOT_UA_INFO if is_bot_user_agent(user_agent) else parse_user_agent(user_agent)
+    
+    weight = click_weight(resolved.id, ua_info['is_bot'])
+    if weight is None:
+        return None
+    
+    # Быстрый путь (fastpath) работает без SessionMiddleware: ключ берем из cookie
+    session = getattr(request, 'session', None)
+    if session is not None:
+        session_key = session.session_key
+    else:
+        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    
+    return ClickEvent(
+        shortened_url_id=resolved.id,
+        clicked_at=timezone.now(),
+        ip_address=get_client_ip(request),
+        user_agent=user_agent,
+        referer=request.META.get('HTTP_REFERER', ''),
+        device_type=ua_info['device_type'],
+        browser=ua_info['browser'],
+        operating_system=ua_info['os'],
+        is_bot=ua_info['is_bot'],
+        session_id=session_key or str(uuid.uuid4())[:8],
+        # 0 - клик попадет только в счетчики, DailyStats и скетч посетителей
+        weight=weight,
+        **client_location(request),
+    )
+
+
+async def abuild_click_event(request, resolved):
+    """build_click_event для async-кода: User-Agent разбирается без блокирующих вызовов кэша"""
+    user_agent = request.META.get('HTTP_USER_AGENT', '')
+    ua_info = BOT_UA_INFO if is_bot_user_agent(user_agent) else await aparse_user_agent(user_agent)
+    return build_click_event(request, resolved, ua_info)
 
 # Основные представления
 def home(request):
     """Главная страница"""
-    context = {
-        'theme': get_user_theme(request)
-    }
+    context = {}
+    # Профиль (если есть) читается один раз за запрос, тема - из сессии (контекст-процессор)
+    profile = get_profile(request)
+    advanced = profile is not None and profile.show_advanced_options
     
     if request.method == 'POST':
-        if request.user.is_authenticated and hasattr(request.user, 'profile') and request.user.profile.show_advanced_options:
+        if advanced:
             form = AdvancedURLShortenForm(request.POST)
         else:
             form = URLShortenForm(request.POST)
         
+        shortened_url = None
         if form.is_valid():
-            shortened_url = form.save(user=request.user if request.user.is_authenticated else None)
-            
+            try:
+                with transaction.atomic():
+                    shortened_url = form.save(user=request.user if request.user.is_authenticated else None)
+            except IntegrityError:
+                # Свой код заняли между проверкой формы и сохранением
+                form.add_error('custom_code', 'Этот код уже занят. Попробуйте другой.')
+        
+        if shortened_url is not None:
             # Генерация QR кода (если доступна)
             if QRCODE_AVAILABLE:
                 try:
@@ -131,38 +179,33 @@ def home(request):
             messages.success(request, 'Ссылка успешно создана!')
     
     else:
-        if request.user.is_authenticated and hasattr(request.user, 'profile') and request.user.profile.show_advanced_options:
+        if advanced:
             form = AdvancedURLShortenForm()
         else:
             form = URLShortenForm()
     
-    # Показываем последние публичные ссылки
-    public_urls = ShortenedURL.objects.filter(
-        is_private=False, 
-        is_active=True,
-        expires_at__gt=timezone.now()
-    ).order_by('-created_at')[:10]
-    
     context['form'] = form
-    context['public_urls'] = public_urls
+    # Последние публичные ссылки - из ленты в кэше
+    context['public_urls'] = public_feed()
     
     return render(request, 'shortener/home.html', context)
 
 
 def redirect_to_original(request, short_code):
     """Перенаправление по короткой ссылке"""
-    shortened_url = get_object_or_404(
-        ShortenedURL, 
-        short_code=short_code,
-        is_active=True
-    )
+    resolved = resolve_short_code(short_code)
+    if resolved is None:
+        return short_code_not_found()
+    if not resolved.is_active:
+        raise Http404
     
     # Проверка срока действия
-    if shortened_url.is_expired():
-        return render(request, 'shortener/expired.html', {'url': shortened_url})
+    if resolved.is_expired():
+        return render(request, 'shortener/expired.html', {'url': resolved})
     
-    # Проверка пароля для приватных ссылок
-    if shortened_url.is_private and shortened_url.password:
+    # Проверка пароля для приватных ссылок (пароль в кэше не хранится)
+    if resolved.is_protected:
+        shortened_url = get_object_or_404(ShortenedURL, pk=resolved.id, is_active=True)
         if request.method == 'POST':
             password = request.POST.get('password', '')
             if password == shortened_url.password:
@@ -173,82 +216,87 @@ def redirect_to_original(request, short_code):
         elif not request.session.get(f'url_{shortened_url.id}_accessed'):
             return render(request, 'shortener/password_protected.html', {'url': shortened_url})
     
-    # Получаем информацию о клиенте
-    ip_address = get_client_ip(request)
-    user_agent = request.META.get('HTTP_USER_AGENT', '')
-    referer = request.META.get('HTTP_REFERER', '')
+    # Ставим клик в очередь на запись, ответ не ждет БД
+    event = build_click_event(request, resolved)
+    if event is not None:
+        submit_click(event)
     
-    # Парсим User-Agent
-    ua_info = parse_user_agent(user_agent)
+    # Перенаправляем на оригинальный URL
+    return redirect(resolved.original_url)
+
+
+async def redirect_to_original_async(request, short_code):
+    """Асинхронное перенаправление по короткой ссылке (для ASGI/uvicorn)"""
+    resolved = await aresolve_short_code(short_code)
+    if resolved is None:
+        return short_code_not_found()
+    if not resolved.is_active:
+        raise Http404
     
-    # Создаем запись о клике
-    with transaction.atomic():
-        # Обновляем основную статистику
-        shortened_url.increment_click_count()
-        
-        # Создаем детальную запись
-        ClickStatistics.objects.create(
-            shortened_url=shortened_url,
-            ip_address=ip_address,
-            user_agent=user_agent,
-            referer=referer,
-            device_type=ua_info['device_type'],
-            browser=ua_info['browser'],
-            operating_system=ua_info['os'],
-            is_bot=ua_info['is_bot'],
-            session_id=request.session.session_key or str(uuid.uuid4())[:8]
-        )
-        
-        # Обновляем ежедневную статистику
-        today = timezone.now().date()
-        daily_stats, created = DailyStats.objects.get_or_create(
-            shortened_url=shortened_url,
-            date=today,
-            defaults={'clicks': 1}
-        )
-        
-        if not created:
-            daily_stats.clicks = F('clicks') + 1
-            daily_stats.save()
+    # Истекшие и защищенные паролем ссылки требуют шаблонов, сессии и БД -
+    # отдаем синхронной версии
+    if resolved.is_expired() or resolved.is_protected:
+        return await sync_to_async(redirect_to_original)(request, short_code)
     
-    # Перенаправляем на оригинальный URL
-    return redirect(shortened_url.original_url)
+    # Запись клика не задерживает ответ
+    event = await abuild_click_event(request, resolved)
+    if event is not None:
+        submit_click_nowait(event)
+    
+    return redirect(resolved.original_url)
 
 
 @login_required
 def dashboard(request):
-    user_urls = ShortenedURL.objects.filter(user=request.user).order_by('-created_at')
-    
-    # Отладочный вывод в консоль
-    print(f"=== DASHBOARD DEBUG ===")
-    print(f"Пользователь: {request.user} (id: {request.user.id})")
-    print(f"Найдено ссылок: {user_urls.count()}")
-    if user_urls.exists():
-        for i, url in enumerate(user_urls[:5]):
-            print(f"  {i+1}. {url.short_code} -> {url.original_url[:50]}")
-    else:
-        print("  Нет ссылок для этого пользователя")
-    print(f"=======================")
+    user_urls = ShortenedURL.objects.filter(user=request.user)
     
-    total_urls = user_urls.count()
-    total_clicks = sum(url.click_count for url in user_urls)
-    active_urls = user_urls.filter(is_active=True, expires_at__gt=timezone.now()).count()
+    # Сводка - из счетчиков профиля, без подсчета ссылок пользователя
+    stats = get_user_stats(request.user, get_profile(request))
     
-    # Если параметр all=true, показываем все ссылки
-    if request.GET.get('all') == 'true':
-        context_user_urls = user_urls
-    else:
-        context_user_urls = user_urls[:20]
+    # Страница по курсору (?after= / ?before=), без OFFSET и COUNT
+    try:
+        page = keyset_page(user_urls, request.GET.get('after'), request.GET.get('before'))
+    except ValueError:
+        page = keyset_page(user_urls)
     
     context = {
-        'user_urls': context_user_urls,
-        'total_urls': total_urls,
-        'total_clicks': total_clicks,
-        'active_urls': active_urls,
+        'user_urls': page.items,
+        'page': page,
+        **stats,
     }
     return render(request, 'shortener/dashboard.html', context)
 
 
+def stats_period(params, default='week'):
+    """Период статистики из параметров запроса: (period, since, until), границы в местном времени"""
+    period = params.get('period', default)
+    now = timezone.now()
+    today_start = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    since = until = None
+    
+    if period == 'today':
+        since = today_start
+    elif period == 'yesterday':
+        since, until = today_start - timedelta(days=1), today_start
+    elif period == 'week':
+        since = now - timedelta(days=7)
+    elif period == 'month':
+        since = now - timedelta(days=30)
+    elif period == 'year':
+        since = now - timedelta(days=365)
+    elif period == 'custom':
+        start_date = parse_date(params.get('start_date') or '')
+        end_date = parse_date(params.get('end_date') or '')
+        if start_date and end_date:
+            since = timezone.make_aware(datetime.combine(start_date, time.min))
+            until = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+    elif period != 'all':
+        period = 'all'
+    # 'all' - без границ: ряды строятся по DailyStats от первого дня ссылки
+    
+    return period, since, until
+
+
 @login_required
 def url_detail(request, short_code):
     """Детальная информация о ссылке"""
@@ -261,90 +309,67 @@ def url_detail(request, short_code):
     # Форма фильтрации статистики
     filter_form = StatsFilterForm(request.GET or None)
     
-    # Базовый queryset для кликов
+    period, since, until = stats_period(request.GET)
+    group_by = request.GET.get('group_by')
+    if group_by not in BUCKETS:
+        group_by = 'day'
+    
     clicks_qs = ClickStatistics.objects.filter(shortened_url=shortened_url)
+    if since is not None:
+        clicks_qs = clicks_qs.filter(clicked_at__gte=since)
+    if until is not None:
+        clicks_qs = clicks_qs.filter(clicked_at__lt=until)
     
-    # Применяем фильтры
-    period = request.GET.get('period', 'week')
+    # Свернутые часы из HourlyStats, остальное - одним GROUP BY по сырым кликам
+    breakdown = url_click_breakdown(shortened_url, since, until)
     
-    if period == 'today':
-        clicks_qs = clicks_qs.filter(clicked_at__date=timezone.now().date())
-    elif period == 'yesterday':
-        yesterday = timezone.now().date() - timedelta(days=1)
-        clicks_qs = clicks_qs.filter(clicked_at__date=yesterday)
-    elif period == 'week':
-        week_ago = timezone.now() - timedelta(days=7)
-        clicks_qs = clicks_qs.filter(clicked_at__gte=week_ago)
-    elif period == 'month':
-        month_ago = timezone.now() - timedelta(days=30)
-        clicks_qs = clicks_qs.filter(clicked_at__gte=month_ago)
-    elif period == 'year':
-        year_ago = timezone.now() - timedelta(days=365)
-        clicks_qs = clicks_qs.filter(clicked_at__gte=year_ago)
-    elif period == 'custom':
-        start_date = request.GET.get('start_date')
-        end_date = request.GET.get('end_date')
-        if start_date and end_date:
-            clicks_qs = clicks_qs.filter(
-                clicked_at__date__gte=start_date,
-                clicked_at__date__lte=end_date
-            )
-    
-    # Статистика по времени суток
-    hourly_stats = []
-    for hour in range(24):
-        count = clicks_qs.filter(clicked_at__hour=hour).count()
-        hourly_stats.append({'hour': hour, 'count': count})
-    
-    # Статистика по дням недели
-    days_of_week = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
-    daily_stats = []
-    for i, day in enumerate(days_of_week):
-        count = clicks_qs.filter(clicked_at__week_day=i+2).count()  # Django неделя начинается с воскресенья (1)
-        daily_stats.append({'day': day, 'count': count})
-    
-    # Топ стран
-    top_countries = clicks_qs.exclude(country='').values('country').annotate(
-        count=Count('id')
-    ).order_by('-count')[:10]
-    
-    # Распределение по устройствам и браузерам
-    device_stats = clicks_qs.values('device_type').annotate(
-        count=Count('id'),
-        percentage=Count('id') * 100.0 / clicks_qs.count()
-    ).order_by('-count')
-    
-    browser_stats = clicks_qs.values('browser').annotate(
-        count=Count('id'),
-        percentage=Count('id') * 100.0 / clicks_qs.count()
-    ).order_by('-count')
-    
-    # Последние клики
-    recent_clicks = clicks_qs.order_by('-clicked_at')[:20]
+    # Уникальные посетители - слиянием дневных HLL-скетчей
+    unique_visitors = unique_visitors_by_period(
+        shortened_url, {'period': period_dates(since, until)}
+    )['period']
+    
+    # Последние клики; если в БД их мало, дополняем из архива
+    recent_clicks = list(clicks_qs.order_by('-clicked_at')[:20])
+    if len(recent_clicks) < 20:
+        recent_clicks += archived_clicks(shortened_url.id, since, until, limit=20 - len(recent_clicks))
     
     # Ежедневная статистика
     daily_stats_qs = DailyStats.objects.filter(
         shortened_url=shortened_url
     ).order_by('-date')[:30]
     
-    # Подготавливаем данные для графиков
-    chart_data = {
-        'labels': [stat.date.strftime('%d.%m') for stat in daily_stats_qs][::-1],
-        'clicks': [stat.clicks for stat in daily_stats_qs][::-1],
-    }
+    # Ряд по дням: нули в пропусках, скользящее среднее, динамика
+    start_date, end_date = period_dates(since, until)
+    click_trend_data = click_trend(shortened_url, start_date, end_date)
+    if group_by == 'day':
+        chart_data = {
+            'group_by': group_by,
+            'labels': click_trend_data['labels'],
+            'clicks': click_trend_data['clicks'],
+            'moving_average': click_trend_data['moving_average'],
+        }
+    else:
+        # Недели и месяцы группируются в БД по DailyStats
+        chart_data = click_buckets(shortened_url, start_date, end_date, group_by)
     
     context = {
         'url': shortened_url,
         'filter_form': filter_form,
         'recent_clicks': recent_clicks,
-        'hourly_stats': hourly_stats,
-        'daily_stats': daily_stats,
-        'top_countries': top_countries,
-        'device_stats': device_stats,
-        'browser_stats': browser_stats,
+        'hourly_stats': breakdown['hourly'],
+        'daily_stats': breakdown['weekdays'],
+        'top_countries': breakdown['countries'],
+        'device_stats': breakdown['devices'],
+        'browser_stats': breakdown['browsers'],
         'daily_stats_qs': daily_stats_qs,
         'chart_data': json.dumps(chart_data),
-        'total_filtered_clicks': clicks_qs.count(),
+        'total_filtered_clicks': breakdown['total'],
+        'unique_visitors': unique_visitors,
+        'click_trend': click_trend_data,
+        # Топ рефереров, стран, городов и ОС за все время - из скетчей, без чтения кликов
+        'top_values': top_values(shortened_url),
+        'period': period,
+        'group_by': group_by,
     }
     
     return render(request, 'shortener/url_detail.html', context)
@@ -360,9 +385,11 @@ def edit_url(request, short_code):
     )
     
     if request.method == 'POST':
+        old_short_code = shortened_url.short_code
         form = URLShortenForm(request.POST, instance=shortened_url)
         if form.is_valid():
             form.save()
+            invalidate_short_codes(old_short_code, shortened_url.short_code)
             messages.success(request, 'Ссылка успешно обновлена!')
             return redirect('url_detail', short_code=shortened_url.short_code)
     else:
@@ -384,7 +411,8 @@ def delete_url(request, short_code):
         user=request.user
     )
     
-    shortened_url.delete()
+    # Клики удаляются пачками, а не одним каскадом в транзакции
+    delete_urls([shortened_url.id])
     messages.success(request, 'Ссылка успешно удалена!')
     return redirect('dashboard')
 
@@ -400,7 +428,8 @@ def toggle_url_status(request, short_code):
     )
     
     shortened_url.is_active = not shortened_url.is_active
-    shortened_url.save()
+    shortened_url.save(update_fields=['is_active', 'updated_at'])
+    invalidate_short_codes(shortened_url.short_code)
     
     action = 'активирована' if shortened_url.is_active else 'деактивирована'
     messages.success(request, f'Ссылка успешно {action}!')
@@ -457,7 +486,7 @@ def user_logout(request):
 @login_required
 def user_profile(request):
     """Профиль пользователя"""
-    profile, created = UserProfile.objects.get_or_create(user=request.user)
+    profile = get_profile(request)
     
     if request.method == 'POST':
         form = UserProfileForm(request.POST, instance=profile)
@@ -468,15 +497,18 @@ def user_profile(request):
     else:
         form = UserProfileForm(instance=profile)
     
-    return render(request, 'shortener/profile.html', {'form': form})
+    return render(request, 'shortener/profile.html', {
+        'form': form,
+        'stats': get_user_stats(request.user, profile),
+    })
 
 
 @login_required
 def generate_api_key(request):
     """Генерация нового API ключа"""
-    profile = request.user.profile
+    profile = get_profile(request)
     profile.api_key = uuid.uuid4().hex
-    profile.save()
+    profile.save(update_fields=['api_key', 'updated_at'])
     
     messages.success(request, 'Новый API ключ успешно сгенерирован!')
     return redirect('user_profile')
@@ -511,20 +543,23 @@ def api_shorten(request):
     # Создание короткой ссылки
     custom_code = request.POST.get('custom_code') or json.loads(request.body).get('custom_code', '')
     
-    shortened_url = ShortenedURL.objects.create(
-        original_url=original_url,
-        user=profile.user,
-    )
+    if custom_code and is_short_code_taken(custom_code):
+        return JsonResponse({'error': 'Код уже занят'}, status=400)
     
-    if custom_code:
-        if ShortenedURL.objects.filter(short_code=custom_code).exists():
-            return JsonResponse({'error': 'Код уже занят'}, status=400)
-        shortened_url.short_code = custom_code
-        shortened_url.save()
+    try:
+        shortened_url = ShortenedURL.objects.create(
+            original_url=original_url,
+            short_code=custom_code,
+            user=profile.user,
+        )
+    except IntegrityError:
+        # Код заняли одновременно с нами
+        return JsonResponse({'error': 'Код уже занят'}, status=400)
     
     # Увеличиваем счетчик использования API
     profile.api_usage = F('api_usage') + 1
-    profile.save()
+    # Только свои поля: счетчики профиля меняются параллельно (см. totals)
+    profile.save(update_fields=['api_usage', 'updated_at'])
     
     return JsonResponse({
         'short_url': shortened_url.get_short_url(request),
@@ -534,6 +569,63 @@ def api_shorten(request):
     })
 
 
+@require_GET
+def api_links(request):
+    """API списка ссылок пользователя по страницам: ?after= / ?before= (курсоры), ?limit="""
+    api_key = request.headers.get('X-API-Key')
+
+    if not api_key:
+        return JsonResponse({'error': 'API ключ обязателен'}, status=401)
+
+    try:
+        profile = UserProfile.objects.get(api_key=api_key)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({'error': 'Неверный API ключ'}, status=401)
+
+    try:
+        limit = page_limit(request.GET.get('limit'))
+        page = keyset_page(
+            ShortenedURL.objects.filter(user=profile.user),
+            request.GET.get('after'), request.GET.get('before'), limit,
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Неверные параметры after, before или limit'}, status=400)
+
+    return JsonResponse({
+        'links': [
+            {
+                'short_url': shortened_url.get_short_url(request),
+                'short_code': shortened_url.short_code,
+                'original_url': shortened_url.original_url,
+                'title': shortened_url.title,
+                'click_count': shortened_url.click_count,
+                'is_active': shortened_url.is_active,
+                'created_at': shortened_url.created_at.isoformat(),
+                'expires_at': shortened_url.expires_at.isoformat() if shortened_url.expires_at else None,
+            }
+            for shortened_url in page
+        ],
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+    })
+
+
+@require_GET
+def api_user_stats(request):
+    """API сводной статистики пользователя"""
+    api_key = request.headers.get('X-API-Key')
+    
+    if not api_key:
+        return JsonResponse({'error': 'API ключ обязателен'}, status=401)
+    
+    try:
+        profile = UserProfile.objects.get(api_key=api_key)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({'error': 'Неверный API ключ'}, status=401)
+    
+    return JsonResponse(get_user_stats(profile.user, profile))
+
+
 @require_GET
 def api_stats(request, short_code):
     """API для получения статистики"""
@@ -556,30 +648,109 @@ def api_stats(request, short_code):
     except ShortenedURL.DoesNotExist:
         return JsonResponse({'error': 'Ссылка не найдена'}, status=404)
     
-    # Получаем статистику за последние 30 дней
-    thirty_days_ago = timezone.now() - timedelta(days=30)
+    # Статистика за последние 30 дней (даты по UTC)
+    today = timezone.now().date()
     daily_stats = DailyStats.objects.filter(
         shortened_url=shortened_url,
-        date__gte=thirty_days_ago.date()
+        date__gte=today - timedelta(days=29)
     ).order_by('date')
     
-    stats_data = []
-    for stat in daily_stats:
-        stats_data.append({
-            'date': stat.date.isoformat(),
-            'clicks': stat.clicks,
-            'unique_visitors': stat.unique_visitors,
-        })
+    stats_data = [
+        {'date': date.isoformat(), 'clicks': clicks, 'unique_visitors': unique}
+        for date, clicks, unique in daily_stats.values_list('date', 'clicks', 'unique_visitors')
+    ]
+    
+    # Ряд с нулями в пропусках, скользящее среднее, сравнение с прошлыми 30 днями
+    trend = click_trend(shortened_url, today - timedelta(days=29), today)
+    
+    # Ряд за выбранный период (?period=, ?group_by=day|week|month), по умолчанию месяц по дням
+    period, since, until = stats_period(request.GET, default='month')
+    group_by = request.GET.get('group_by', 'day')
+    if group_by not in BUCKETS:
+        return JsonResponse({'error': 'group_by должен быть day, week или month'}, status=400)
+    series = click_buckets(shortened_url, *period_dates(since, until), group_by)
+    series['period'] = period
+    
+    # Уникальные посетители по HLL-скетчам (ошибка ~1.6%)
+    unique_visitors = unique_visitors_by_period(shortened_url, {
+        'week': (today - timedelta(days=6), None),
+        'month': (today - timedelta(days=29), None),
+        'all_time': (None, None),
+    })
     
     return JsonResponse({
         'short_code': shortened_url.short_code,
         'total_clicks': shortened_url.click_count,
+        'unique_visitors': unique_visitors,
         'created_at': shortened_url.created_at.isoformat(),
         'expires_at': shortened_url.expires_at.isoformat() if shortened_url.expires_at else None,
         'is_active': shortened_url.is_active,
         'daily_stats': stats_data,
+        'trend': trend,
+        'series': series,
+        'top': top_values(shortened_url),
     })
 
+def export_response(request, urls, filename):
+    """Потоковая выгрузка кликов ссылок queryset urls по параметрам запроса.
+
+    format=csv|ndjson, gzip=1, since/until - границы clicked_at,
+    after - курсор (id последней полученной строки) для продолжения выгрузки.
+    """
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'error': 'format должен быть csv или ndjson'}, status=400)
+    try:
+        after = int(request.GET.get('after') or 0)
+        since = parse_moment(request.GET.get('since'))
+        until = parse_moment(request.GET.get('until'))
+    except ValueError:
+        return JsonResponse({'error': 'Неверные параметры after, since или until'}, status=400)
+    compress = request.GET.get('gzip') in ('1', 'true')
+    
+    content_type, extension = EXPORT_FORMATS[export_format]
+    if compress:
+        content_type, extension = 'application/gzip', f'{extension}.gz'
+    response = StreamingHttpResponse(
+        export_stream(urls, export_format, compress, after=after, since=since, until=until),
+        content_type=content_type,
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+    return response
+
+
+@login_required
+@require_GET
+def export_url_clicks(request, short_code):
+    """Выгрузка кликов ссылки"""
+    urls = ShortenedURL.objects.filter(short_code=short_code, user=request.user)
+    if not urls.exists():
+        raise Http404
+    return export_response(request, urls, f'clicks-{short_code}')
+
+
+@require_GET
+def api_export_clicks(request):
+    """API выгрузки кликов всех ссылок пользователя или одной (?short_code=)"""
+    api_key = request.headers.get('X-API-Key')
+    
+    if not api_key:
+        return JsonResponse({'error': 'API ключ обязателен'}, status=401)
+    
+    try:
+        profile = UserProfile.objects.get(api_key=api_key)
+    except UserProfile.DoesNotExist:
+        return JsonResponse({'error': 'Неверный API ключ'}, status=401)
+    
+    urls = ShortenedURL.objects.filter(user=profile.user)
+    short_code = request.GET.get('short_code')
+    if short_code:
+        urls = urls.filter(short_code=short_code)
+        if not urls.exists():
+            return JsonResponse({'error': 'Ссылка не найдена'}, status=404)
+    
+    return export_response(request, urls, f'clicks-{short_code or profile.user.username}')
+
 @csrf_exempt
 @login_required
 def update_theme(request):
@@ -589,12 +760,13 @@ def update_theme(request):
             data = json.loads(request.body)
             theme = data.get('theme', 'light')
             
-            if theme not in ['light', 'dark', 'auto']:
+            if theme not in THEMES:
                 return JsonResponse({'error': 'Неверная тема'}, status=400)
             
-            profile, created = UserProfile.objects.get_or_create(user=request.user)
+            profile = get_profile(request)
             profile.theme = theme
-            profile.save()
+            profile.save(update_fields=['theme', 'updated_at'])
+            remember_theme(request, theme)
             
             return JsonResponse({'success': True, 'theme': theme})
         except json.JSONDecodeError:
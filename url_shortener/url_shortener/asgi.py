@@ -3,14 +3,34 @@ ASGI config for url_shortener project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Run with uvicorn workers to serve the async redirect path (/go/<code>/):
+
+    gunicorn url_shortener.asgi:application -k uvicorn.workers.UvicornWorker
+
+Redirects (/<code>/) are served by shortener.fastpath ahead of the middleware
+chain; set REDIRECT_FAST_PATH = False to route them through the full stack.
+The short code Bloom filter is built at import time unless
+SHORTCODE_FILTER_WARM_ON_STARTUP = False.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'url_shortener.settings')
 
 application = get_asgi_application()
+
+if getattr(settings, 'SHORTCODE_FILTER_WARM_ON_STARTUP', True):
+    from shortener.bloom import short_code_filter
+
+    short_code_filter.warm()
+
+if getattr(settings, 'REDIRECT_FAST_PATH', True):
+    from shortener.fastpath import FastRedirectASGI
+
+    application = FastRedirectASGI(application)
@@ -29,7 +29,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django_user_agents.middleware.UserAgentMiddleware',
+    'shortener.middleware.user_agent_middleware',
 ]
 
 ROOT_URLCONF = 'url_shortener.urls'
@@ -45,6 +45,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'shortener.context_processors.user_profile_processor',
             ],
         },
     },
@@ -88,6 +89,85 @@ LOGIN_URL = '/login/'
 # Установите django-user-agents
 USER_AGENTS_CACHE = 'default'
 
+# Кэш (в продакшене указать общий бэкенд: Redis или Memcached)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Перенаправления /<код>/ в обход MIDDLEWARE (см. shortener/fastpath.py)
+REDIRECT_FAST_PATH = True
+
+# Кэш классификации User-Agent
+USER_AGENT_CACHE_SIZE = 5000  # различных строк User-Agent в памяти процесса
+USER_AGENT_CACHE_ALIAS = 'default'  # общий кэш; None - только память процесса
+
+# Кэш разрешения коротких кодов для перенаправлений
+SHORTCODE_CACHE_ALIAS = 'default'
+SHORTCODE_CACHE_TIMEOUT = 300  # секунд в общем кэше
+SHORTCODE_LOCAL_CACHE_SIZE = 10000  # записей в памяти процесса
+SHORTCODE_LOCAL_CACHE_TTL = 10  # секунд в памяти процесса
+
+# Лента последних публичных ссылок на главной (см. shortener/feed.py)
+PUBLIC_FEED_CACHE_ALIAS = 'default'
+PUBLIC_FEED_TIMEOUT = 60  # секунд до страховочной пересборки ленты
+
+# Сводка пользователя (см. shortener/totals.py)
+USER_STATS_CACHE_ALIAS = 'default'
+USER_STATS_CACHE_TIMEOUT = 30  # секунд кэширования числа истекших ссылок
+
+# Фильтр Блума по выданным коротким кодам
+SHORTCODE_FILTER_REFRESH_INTERVAL = 5  # секунд между дочитываниями новых кодов
+SHORTCODE_FILTER_ERROR_RATE = 0.001  # доля ложных срабатываний
+SHORTCODE_FILTER_MIN_CAPACITY = 100000  # минимальная емкость фильтра
+SHORTCODE_FILTER_WARM_ON_STARTUP = True  # строить фильтр при загрузке wsgi/asgi, а не на первом запросе
+
+# Фоновая запись кликов
+CLICK_INGEST_ASYNC = True  # False - писать клик синхронно в запросе
+CLICK_INGEST_QUEUE_SIZE = 10000  # максимум событий в очереди процесса
+CLICK_INGEST_BATCH_SIZE = 500  # событий в одной пачке
+CLICK_INGEST_FLUSH_INTERVAL = 1.0  # секунд до записи неполной пачки
+CLICK_INGEST_PUT_TIMEOUT = 0.05  # секунд ожидания места в очереди
+
+# Запись детальной статистики кликов (ClickStatistics)
+BOT_CLICK_POLICY = 'aggregate'  # 'record', 'aggregate' (только счетчики), 'sample' или 'skip'
+BOT_CLICK_SAMPLE_RATE = 100  # для 'sample': одна строка из N кликов ботов
+HOT_LINK_THRESHOLD = 50  # кликов в секунду по ссылке в процессе до включения выборки; 0 - всегда писать
+HOT_LINK_SAMPLE_RATE = 10  # по горячей ссылке пишется одна строка из N
+
+# Архив старых кликов (колоночные сегменты на диске, см. shortener/archive.py)
+CLICK_ARCHIVE_DIR = os.path.join(BASE_DIR, 'archive')
+CLICK_ARCHIVE_AFTER_DAYS = 90  # клики старше переносятся из БД в архив
+
+# Срок хранения кликов (команда apply_retention)
+CLICK_RETENTION_DAYS = 365  # сырые клики старше удаляются, остаются агрегаты; None - хранить всегда
+CLICK_RETENTION_BATCH_SIZE = 5000  # ID кликов в одном DELETE
+CLICK_RETENTION_ROWS_PER_SECOND = 20000  # ограничение скорости удаления; 0 - без ограничения
+HOURLY_STATS_RETENTION_DAYS = None  # почасовая статистика старше удаляется, остается дневная
+
+# Топ рефереров, стран, городов и ОС (скетчи Space-Saving, см. shortener/topk.py)
+TOP_K_CAPACITY = 100  # счетчиков в скетче на ссылку и измерение
+TOP_K_FLUSH_INTERVAL = 30.0  # секунд между сбросами скетчей процесса в БД
+
+# Заголовки с геолокацией клиента от CDN или прокси (по умолчанию Cloudflare)
+GEO_COUNTRY_HEADER = 'HTTP_CF_IPCOUNTRY'
+GEO_CITY_HEADER = 'HTTP_CF_IPCITY'
+
+# Агрегация счетчиков кликов (click_count / last_clicked)
+CLICK_COUNTER_BACKEND = 'memory'  # 'memory' или 'cache' (общий для всех процессов)
+CLICK_COUNTER_CACHE_ALIAS = 'default'
+CLICK_COUNTER_FLUSH_INTERVAL = 500  # миллисекунд между сбросами в БД
+
+# Выдача коротких кодов
+SHORT_CODE_ALLOCATOR = 'shortener.allocators.SequenceAllocator'  # или PoolAllocator
+SHORT_CODE_ALLOCATOR_OPTIONS = {
+    'length': 6,  # минимальная длина кода
+    'block_size': 100,  # номеров, резервируемых процессом за один запрос
+    'shuffle': True,  # перемешивать номера, чтобы коды нельзя было угадать
+}
+SHORT_CODE_SHUFFLE_KEY = os.environ.get('SHORT_CODE_SHUFFLE_KEY', '')  # по умолчанию SECRET_KEY
+
 LOGIN_REDIRECT_URL = '/dashboard/'
 LOGIN_URL = '/login/'
 LOGOUT_REDIRECT_URL = '/'
@@ -19,18 +19,25 @@ urlpatterns = [
     
     # API маршруты
     path('api/shorten/', views.api_shorten, name='api_shorten'),
+    path('api/links/', views.api_links, name='api_links'),
+    path('api/user/stats/', views.api_user_stats, name='api_user_stats'),
     path('api/stats/<str:short_code>/', views.api_stats, name='api_stats'),
+    path('api/export/clicks/', views.api_export_clicks, name='api_export_clicks'),
     
     # Основные маршруты
     path('', views.home, name='home'),
     path('shorten/', views.home, name='shorten_url'),
     
+    # Асинхронное перенаправление (ASGI/uvicorn)
+    path('go/<str:short_code>/', views.redirect_to_original_async, name='redirect_async'),
+    
     # URL для перенаправления (должен быть ПОСЛЕДНИМ!)
     path('<str:short_code>/', views.redirect_to_original, name='redirect'),
     path('<str:short_code>/stats/', views.url_detail, name='url_detail'),
     path('<str:short_code>/edit/', views.edit_url, name='edit_url'),
     path('<str:short_code>/delete/', views.delete_url, name='delete_url'),
     path('<str:short_code>/toggle/', views.toggle_url_status, name='toggle_url_status'),
+    path('<str:short_code>/export/', views.export_url_clicks, name='export_url_clicks'),
 
 
     path('api/update-theme/', views.update_theme, name='update_theme'),
@@ -3,14 +3,30 @@ WSGI config for url_shortener project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
 
+Redirects (/<code>/) are served by shortener.fastpath ahead of the middleware
+chain; set REDIRECT_FAST_PATH = False to route them through the full stack.
+The short code Bloom filter is built at import time unless
+SHORTCODE_FILTER_WARM_ON_STARTUP = False.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/wsgi/
 """
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'url_shortener.settings')
 
 application = get_wsgi_application()
+
+if getattr(settings, 'SHORTCODE_FILTER_WARM_ON_STARTUP', True):
+    from shortener.bloom import short_code_filter
+
+    short_code_filter.warm()
+
+if getattr(settings, 'REDIRECT_FAST_PATH', True):
+    from shortener.fastpath import FastRedirectWSGI
+
+    application = FastRedirectWSGI(application)